@@ -1,127 +1,331 @@
 """
-This tracefile generator is to be used in conjunction with Assignment 2 of CompX529.
-It takes a student ID value and an integer seed, from which it generates a tracefile for use
-with a simulated Kubernetes cluster
+Generates synthetic tracefiles for the simulated Kubernetes cluster.
+
+generate_trace() streams the commands of a trace as attribute lists (the same shape read_trace and
+run_command use), so a trace can be written to disk with write_trace() or handed straight to
+runSimulation.main without ever being held in memory. Everything is drawn from a single
+random.Random seeded up front, so a seed always gives the same trace.
+
+    python TraceFileGenerator.py --nodes 1000 --deployments 500 --duration 3600 --arrival poisson --rate 0.5 -o trace.txt
+
+generate_exec_trace() keeps the shapes of the original assignment generator, where each step's
+request execTimes follow a ramp or sine wave instead of the arrival rate:
+
+    python TraceFileGenerator.py --shape exec-sine --seed STUDENT_ID -o trace.txt
 """
+from abc import ABCMeta, abstractmethod
+import argparse
 import math
 import random
-from matplotlib import pyplot as plt
-
-try:
-	idVal = int(input("Enter your student ID: "))
-	seed = int(input("Enter seed: "))
-	if seed > 3 or seed < 1:
-		print ("please use seed of 1, 2, or 3")
-		quit()
-except:
-	print("Please enter as integer")
-	quit()
-
-nodes = []
-deployments = []
-hpas = []
-nodeMax = 5
-depMax =  3
-depA = 65
-depB = 65
-commandCount = 300
-separator = " "
-expRounds = []
-expProg = []
-xVals = []
-f = open("instructions.txt", "w")
-for x in range (1, commandCount+1): #Generates a set number of commands
-	commands = [] #Establishes the list of possible commands for this step
-	random.seed(idVal+x)
-	if len(nodes) == 0:
-		cpus = random.randint(5,8)
-		node = "".join(["Node_",str(len(nodes)+1)])
-		command = separator.join(["AddNode", node, str(cpus)])
-		nodes.append(node)
-		f.write(command+"\n") #Node creation will always be the first command
-		continue
-	elif len(nodes) < nodeMax:#If we have at least one node but can still have more
-		commands.append("AddNode")
-	if len(deployments) < depMax: #If we can deploy to the cluster
-		if depA < 90:
-			commands.append("Deploy")
-	if len(deployments) == depMax:#If we have deployments
-		commands.append("ReqIn")
-	if len(hpas)< len(deployments):
-		commands.append("CreateHPA")
-	choice = random.choice(commands) #Select a command from the pool of available options
-	if choice == "AddNode":
-		cpus = random.randint(5,8)
-		node = "".join(["Node_",str(len(nodes)+1)])
-		command = separator.join([choice, node, str(cpus)])
-		f.write(command+"\n")
-		nodes.append(node)
-	if choice == "Deploy":
-		cpus = random.randint(1,3)
-		reps = random.randint(1,3)
-		depLabel = "".join(map(chr,[depA, depB]))
-		if depB < 90:
-			depB +=1
-		else:
-			depA +=1
-			depB = 65
-		deployment = "".join(["Deployment_",depLabel])
-		command = separator.join([choice, deployment, str(reps), str(cpus)])
-		f.write(command+"\n")
-		deployments.append(deployment)
-		if len(expRounds)<len(deployments):
-			expRounds.append(1)
-			expProg.append(0)	
-	if choice == "ReqIn":
-		if seed == 1:#Generates a stable load 
-			newSeed = idVal
-			for deployment in deployments:
-				random.seed(newSeed)
-				reqTime = random.randint(5,15)
-				command = separator.join([choice, str(x), deployment, str(reqTime)])
-				f.write(command+"\n")
-				newSeed +=1
-
-		elif seed == 2:#Generates a load that ramps up to steady level before dropping
-			newSeed = idVal
-			for deployment in deployments:
-				index = deployments.index(deployment)
-				random.seed(newSeed*expRounds[index])
-				maxTime = random.randint(20,40)
-				curMax = random.randint(5, 15)
-				if expProg[index] == maxTime:
-					expRounds[index] +=1
-					expProg[index] = 0
-				if expProg[index] > curMax:
-					reqTime = curMax
-				else:
-					reqTime = expProg[index]
-				command = separator.join([choice, str(x), deployment, str(reqTime)])
-				f.write(command+"\n")
-				expProg[index]+=1
-				newSeed +=1
-
-		elif seed == 3:#Produces a load in sine pattern
-			newSeed = idVal
-			for deployment in deployments:
-				random.seed(newSeed)
-				reqTime = int(random.randint(5,10)*(math.sin(x/random.uniform(10,30))**2))
-				command = separator.join([choice, str(x), deployment, str(reqTime)])
-				f.write(command+"\n")
-				newSeed +=1
-
-	if choice == "CreateHPA":
-		setPoint = random.randint(60,90)
-		syncPeriod = random.randint(5,15)
-		for deployment in deployments:
-			if not deployment in hpas:
-				command = separator.join([choice, deployment, str(setPoint), str(syncPeriod)])
-				hpas.append(deployment)
-				f.write(command+"\n")
-				break
-			
-	f.write("Sleep 1\n")
-	
-for deployment in deployments:
-	f.write ("DeleteDeployment "+deployment+"\n")
+from typing import Iterator, List
+
+# Arrival processes decide how many requests a deployment receives in each second of the trace.
+# Every process averages out to rate requests per second over a whole period.
+# stable, ramp and sine follow their shape exactly (fractions of a request carry over to the next
+# second). poisson, diurnal and bursty draw Poisson counts around theirs.
+
+class IArrivalProcess:
+    __metaclass__ = ABCMeta
+
+    def __init__(self, rng: random.Random, rate: float, period: float):
+        self.rng = rng
+        self.rate = rate
+        self.period = period
+        # Deployments start at different points of their period
+        self.phase = rng.uniform(0, period)
+
+    @abstractmethod
+    def count(self, t: int) -> int: raise NotImplementedError
+
+
+class ShapedArrivals(IArrivalProcess):
+    def __init__(self, rng, rate, period):
+        super().__init__(rng, rate, period)
+        self.owed = 0.0
+
+    @abstractmethod
+    def shape(self, t: int) -> float: raise NotImplementedError
+
+    def count(self, t):
+        self.owed += self.shape(t)
+        n = math.floor(self.owed)
+        self.owed -= n
+        return n
+
+
+class StableArrivals(ShapedArrivals):
+    def shape(self, t):
+        return self.rate
+
+
+class RampArrivals(ShapedArrivals):
+    ''' Ramps up from nothing to twice the rate over each period, then drops back. '''
+    def shape(self, t):
+        return 2 * self.rate * ((t + self.phase) % self.period) / self.period
+
+
+class SineArrivals(ShapedArrivals):
+    def shape(self, t):
+        return 2 * self.rate * math.sin(math.pi * (t + self.phase) / self.period) ** 2
+
+
+class PoissonArrivals(IArrivalProcess):
+    def count(self, t):
+        return poisson(self.rng, self.rate)
+
+
+class DiurnalArrivals(IArrivalProcess):
+    ''' Poisson arrivals whose rate follows a day/night cycle of length period. '''
+    def count(self, t):
+        return poisson(self.rng, self.rate * (1 - math.cos(2 * math.pi * (t + self.phase) / self.period)))
+
+
+class BurstyArrivals(IArrivalProcess):
+    ''' On/off arrivals: bursts lasting a tenth of the period on average with nothing in between. '''
+    ON_SHARE = 0.1
+
+    def __init__(self, rng, rate, period):
+        super().__init__(rng, rate, period)
+        self.on = rng.random() < self.ON_SHARE
+
+    def count(self, t):
+        # Bursts and gaps end with a fixed probability every second, so their lengths are geometric
+        mean_length = self.period * (self.ON_SHARE if self.on else 1 - self.ON_SHARE)
+        if self.rng.random() < 1 / max(1, mean_length):
+            self.on = not self.on
+        return poisson(self.rng, self.rate / self.ON_SHARE) if self.on else 0
+
+
+ARRIVAL_PROCESSES = {
+    'stable': StableArrivals,
+    'ramp': RampArrivals,
+    'sine': SineArrivals,
+    'poisson': PoissonArrivals,
+    'diurnal': DiurnalArrivals,
+    'bursty': BurstyArrivals,
+}
+
+def poisson(rng: random.Random, mean: float) -> int:
+    if mean <= 0:
+        return 0
+    if mean > 30:
+        # Normal approximation, Knuth's method gets slow and underflows for large means
+        return max(0, round(rng.gauss(mean, math.sqrt(mean))))
+
+    limit = math.exp(-mean)
+    n = 0
+    p = rng.random()
+    while p > limit:
+        n += 1
+        p *= rng.random()
+    return n
+
+
+def label(i: int, count: int) -> str:
+    ''' Deployment_AA, Deployment_AB, ... with enough letters for count deployments. '''
+    width = max(2, math.ceil(math.log(count, 26))) if count > 1 else 2
+    letters = []
+    for _ in range(width):
+        i, letter = divmod(i, 26)
+        letters.append(chr(ord('A') + letter))
+    return ''.join(reversed(letters))
+
+
+def generate_trace(
+    nodes: int = 5,
+    deployments: int = 3,
+    duration: int = 300,
+    arrival: str = 'stable',
+    rate: float = 1.0,
+    period: float = 60,
+    seed: int = 0,
+    node_cpu = (5, 8),
+    deployment_cpu = (1, 3),
+    replicas = (1, 3),
+    exec_time = (5, 15),
+    set_point = (60, 90),
+    sync_period = (5, 15),
+    hpa: bool = True,
+    crash_rate: float = 0.0,
+) -> Iterator[List[str]]:
+    ''' Streams a trace: the cluster and deployments (with an HPA each if hpa is set), duration seconds
+    of requests, then the deployments are deleted. rate is the mean requests per second of each
+    deployment and period the length of a cycle of the arrival process. Every second a pod is
+    crashed with probability crash_rate. (low, high) tuples are drawn from uniformly. '''
+    if arrival not in ARRIVAL_PROCESSES:
+        raise ValueError(f'Unknown arrival process {arrival!r}, expected one of {list(ARRIVAL_PROCESSES)}')
+
+    rng = random.Random(seed)
+
+    for i in range(nodes):
+        yield ['AddNode', f'Node_{i + 1}', str(rng.randint(*node_cpu))]
+
+    labels = [f'Deployment_{label(i, deployments)}' for i in range(deployments)]
+    processes = []
+    for deployment_label in labels:
+        yield ['Deploy', deployment_label, str(rng.randint(*replicas)), str(rng.randint(*deployment_cpu))]
+        if hpa:
+            yield ['CreateHPA', deployment_label, str(rng.randint(*set_point)), str(rng.randint(*sync_period))]
+        # Each deployment gets its own share of the load, between half and one and a half times rate
+        processes.append(ARRIVAL_PROCESSES[arrival](rng, rate * rng.uniform(0.5, 1.5), period))
+
+    request_id = 0
+    for t in range(duration):
+        for deployment_label, process in zip(labels, processes):
+            for _ in range(process.count(t)):
+                request_id += 1
+                yield ['ReqIn', str(request_id), deployment_label, str(rng.randint(*exec_time))]
+
+        if crash_rate and rng.random() < crash_rate:
+            yield ['CrashPod', rng.choice(labels)]
+        yield ['Sleep', '1']
+
+    for deployment_label in labels:
+        yield ['DeleteDeployment', deployment_label]
+
+
+# The shapes of the original assignment generator. Every step sends one request to each deployment
+# and it is the execTime of the requests which follows the shape: exec-stable draws a fixed execTime
+# per deployment, exec-ramp climbs from 0 to a cap over 20-40 steps and starts again, and exec-sine
+# follows randint(5, 10) * sin^2(step / uniform(10, 30)). Before the requests start, each step adds a
+# node, a deployment or an HPA. The student ID seeds everything, so these reproduce the assignment traces.
+EXEC_SHAPES = {
+    'exec-stable': 1,
+    'exec-ramp': 2,
+    'exec-sine': 3,
+}
+
+def generate_exec_trace(shape: str, student_id: int, steps: int = 300) -> Iterator[List[str]]:
+    ''' Streams a trace of the original generator, which made the trace for student_id with seed 1, 2
+    or 3 for the exec-stable, exec-ramp and exec-sine shapes. '''
+    if shape not in EXEC_SHAPES:
+        raise ValueError(f'Unknown shape {shape!r}, expected one of {list(EXEC_SHAPES)}')
+
+    rng = random.Random()
+    nodes, deployments, hpas = [], [], []
+    node_max, deployment_max = 5, 3
+    dep_a, dep_b = 65, 65
+    # exec-ramp: how many times each deployment has ramped up, and how far along the current ramp it is
+    ramp_rounds, ramp_progress = [], []
+
+    for x in range(1, steps + 1):
+        rng.seed(student_id + x)
+        if not nodes:
+            # The first node is added without a Sleep after it
+            nodes.append(f'Node_{len(nodes) + 1}')
+            yield ['AddNode', nodes[-1], str(rng.randint(5, 8))]
+            continue
+
+        choices = []
+        if len(nodes) < node_max:
+            choices.append('AddNode')
+        if len(deployments) < deployment_max and dep_a < 90:
+            choices.append('Deploy')
+        if len(deployments) == deployment_max:
+            choices.append('ReqIn')
+        if len(hpas) < len(deployments):
+            choices.append('CreateHPA')
+        choice = rng.choice(choices)
+
+        if choice == 'AddNode':
+            cpus = rng.randint(5, 8)
+            nodes.append(f'Node_{len(nodes) + 1}')
+            yield ['AddNode', nodes[-1], str(cpus)]
+        elif choice == 'Deploy':
+            cpus = rng.randint(1, 3)
+            replicas = rng.randint(1, 3)
+            deployment_label = f'Deployment_{chr(dep_a)}{chr(dep_b)}'
+            if dep_b < 90:
+                dep_b += 1
+            else:
+                dep_a += 1
+                dep_b = 65
+            deployments.append(deployment_label)
+            ramp_rounds.append(1)
+            ramp_progress.append(0)
+            yield ['Deploy', deployment_label, str(replicas), str(cpus)]
+        elif choice == 'ReqIn':
+            for index, deployment_label in enumerate(deployments):
+                if shape == 'exec-stable':
+                    rng.seed(student_id + index)
+                    exec_time = rng.randint(5, 15)
+                elif shape == 'exec-ramp':
+                    rng.seed((student_id + index) * ramp_rounds[index])
+                    ramp_length = rng.randint(20, 40)
+                    cap = rng.randint(5, 15)
+                    if ramp_progress[index] == ramp_length:
+                        ramp_rounds[index] += 1
+                        ramp_progress[index] = 0
+                    exec_time = min(ramp_progress[index], cap)
+                    ramp_progress[index] += 1
+                else:
+                    rng.seed(student_id + index)
+                    exec_time = int(rng.randint(5, 10) * math.sin(x / rng.uniform(10, 30)) ** 2)
+                yield ['ReqIn', str(x), deployment_label, str(exec_time)]
+        elif choice == 'CreateHPA':
+            set_point = rng.randint(60, 90)
+            sync_period = rng.randint(5, 15)
+            deployment_label = next(label for label in deployments if label not in hpas)
+            hpas.append(deployment_label)
+            yield ['CreateHPA', deployment_label, str(set_point), str(sync_period)]
+
+        yield ['Sleep', '1']
+
+    for deployment_label in deployments:
+        yield ['DeleteDeployment', deployment_label]
+
+
+def write_trace(commands, path: str) -> int:
+    ''' Writes a stream of commands as a text trace. Returns the number of commands written. '''
+    count = 0
+    with open(path, 'w') as fp:
+        for command in commands:
+            fp.write(' '.join(command) + '\n')
+            count += 1
+    return count
+
+
+def _int_range(value: str):
+    low, _, high = value.partition(',')
+    return int(low), int(high or low)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic tracefile.')
+    parser.add_argument('-o', '--output', default='instructions.txt')
+    parser.add_argument('--nodes', type=int, default=5)
+    parser.add_argument('--deployments', type=int, default=3)
+    parser.add_argument('--duration', type=int, default=300, help='seconds of requests')
+    parser.add_argument('--arrival', choices=list(ARRIVAL_PROCESSES), default='stable')
+    parser.add_argument('--rate', type=float, default=1.0, help='mean requests per second per deployment')
+    parser.add_argument('--period', type=float, default=60, help='seconds per cycle of the arrival process')
+    parser.add_argument('--seed', type=int, default=0, help='the student ID for --shape')
+    parser.add_argument('--shape', choices=list(EXEC_SHAPES), help='an original exec-time shape, which ignores the other options')
+    parser.add_argument('--node-cpu', type=_int_range, default=(5, 8), help='LOW,HIGH')
+    parser.add_argument('--deployment-cpu', type=_int_range, default=(1, 3), help='LOW,HIGH')
+    parser.add_argument('--replicas', type=_int_range, default=(1, 3), help='LOW,HIGH')
+    parser.add_argument('--exec-time', type=_int_range, default=(5, 15), help='LOW,HIGH seconds per request')
+    parser.add_argument('--no-hpa', action='store_true')
+    parser.add_argument('--crash-rate', type=float, default=0.0, help='chance of a pod crash every second')
+    args = parser.parse_args()
 
+    if args.shape is not None:
+        commands = generate_exec_trace(args.shape, args.seed)
+    else:
+        commands = generate_trace(
+            nodes=args.nodes,
+            deployments=args.deployments,
+            duration=args.duration,
+            arrival=args.arrival,
+            rate=args.rate,
+            period=args.period,
+            seed=args.seed,
+            node_cpu=args.node_cpu,
+            deployment_cpu=args.deployment_cpu,
+            replicas=args.replicas,
+            exec_time=args.exec_time,
+            hpa=not args.no_hpa,
+            crash_rate=args.crash_rate,
+        )
+    count = write_trace(commands, args.output)
+    print(count, 'commands written to', args.output)
@@ -0,0 +1,82 @@
+from abc import ABCMeta, abstractmethod
+import random
+
+# Admission policies decide what happens to a request arriving at a deployment whose queue of
+# pending requests has reached its capacity (see config.admission_queue_capacity).
+# admit() is called with the deployment lock held. It either appends the request to the queue or
+# not, and returns the requests it turned away (the new one, or ones it evicted from the queue) so
+# that they can be recorded as rejected.
+
+class IAdmissionPolicy:
+    __metaclass__ = ABCMeta
+
+    def __init__(self, capacity: int, seed=None):
+        self.capacity = capacity
+
+    @abstractmethod
+    def admit(self, queue, request): raise NotImplementedError
+
+    def state(self) -> dict:
+        ''' What a checkpoint needs for a restored policy to admit like this one would. '''
+        return {}
+
+    def restore_state(self, state: dict):
+        pass
+
+
+class RejectNewestAdmission(IAdmissionPolicy):
+    ''' Turns arrivals away while the queue is full (tail drop). '''
+
+    def admit(self, queue, request):
+        if len(queue) >= self.capacity:
+            return [request]
+        queue.append(request)
+        return []
+
+
+class DropOldestAdmission(IAdmissionPolicy):
+    ''' Always takes the arrival, evicting the request at the front of a full queue, which has waited longest. '''
+
+    def admit(self, queue, request):
+        queue.append(request)
+        rejected = []
+        while len(queue) > self.capacity:
+            rejected.append(queue.popleft())
+        return rejected
+
+
+class EarlyDropAdmission(IAdmissionPolicy):
+    ''' Random early drop: once the queue is more than threshold full, arrivals are turned away with a
+    probability rising linearly to 1 at capacity, so load is shed before every request has to wait out
+    a full queue. Seeded (with the deployment label) so that runs are repeatable.
+    Use functools.partial(EarlyDropAdmission, threshold=...) in config to change the threshold. '''
+
+    def __init__(self, capacity: int, seed=None, threshold: float = 0.5):
+        super().__init__(capacity, seed)
+        self.threshold = threshold
+        self.rng = random.Random(seed)
+
+    def drop_probability(self, length: int) -> float:
+        # A queue with no room turns everything away, like RejectNewestAdmission
+        if length >= self.capacity:
+            return 1
+        fill = length / self.capacity
+        if fill <= self.threshold:
+            return 0
+        return (fill - self.threshold) / (1 - self.threshold)
+
+    def state(self):
+        return {'rng': self.rng.getstate()}
+
+    def restore_state(self, state):
+        if 'rng' in state:
+            # JSON turns the state's tuples into lists
+            version, internal_state, gauss_next = state['rng']
+            self.rng.setstate((version, tuple(internal_state), gauss_next))
+
+    def admit(self, queue, request):
+        probability = self.drop_probability(len(queue))
+        if probability and self.rng.random() < probability:
+            return [request]
+        queue.append(request)
+        return []
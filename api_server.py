@@ -1,38 +1,57 @@
 import threading
-from typing import List
+from typing import Tuple
 import uuid
 
+import instrumentation
 import metrics
 
+from clock import WallClock
 from deployment import Deployment
 from end_point import EndPoint
 from etcd import Etcd
 from pod import Pod
+from request import Request
+from watch import Watch
 from worker_node import WorkerNode
 
 # The APIServer handles the communication between controllers and the cluster. It houses
 # the methods that can be called for cluster management
+# etcdLock serializes structural changes (creating and removing deployments, pods and endpoints)
+# between the controllers. The hot paths don't need it: getters return immutable snapshots,
+# request queues are guarded by their Deployment's lock and cpu accounting by the WorkerNode's
+# and Pod's locks.
+# clock is what pods run their requests on: a WallClock when the simulation runs in real time,
+# or a VirtualClock in discrete-event mode.
 
 class APIServer:
-    def __init__(self):
+    def __init__(self, clock=None):
         self.etcd = Etcd()
-        self.etcdLock = threading.Lock()
+        self.etcdLock = instrumentation.lock('etcdLock')
+        self.clock = clock if clock is not None else WallClock()
 
-    def GetDeployments(self) -> List[Deployment]:
-        ''' Returns the list of deployments stored in etcd. '''
-        return [*self.etcd.deploymentList]
+    def GetDeployments(self) -> Tuple[Deployment, ...]:
+        ''' Returns a snapshot of the deployments stored in etcd. '''
+        return self.etcd.deploymentList
 
-    def GetWorkers(self) -> List[WorkerNode]:
-        ''' Returns the list of WorkerNodes stored in etcd. '''
-        return [*self.etcd.nodeList]
+    def GetWorkers(self) -> Tuple[WorkerNode, ...]:
+        ''' Returns a snapshot of the WorkerNodes stored in etcd. '''
+        return self.etcd.nodes()
 
-    def GetPending(self) -> List[Pod]:
-        ''' Returns the list of pending pods stored in etcd. '''
-        return [*self.etcd.pendingPodList]
+    def GetPending(self) -> Tuple[Pod, ...]:
+        ''' Returns a snapshot of the pending pods stored in etcd. '''
+        return self.etcd.pods_with_status('PENDING')
 
-    def GetEndPoints(self) -> List[EndPoint]:
-        ''' Returns the list of endpoints stored in etcd. '''
-        return [*self.etcd.endPointList]
+    def GetPodsByStatus(self, status: str) -> Tuple[Pod, ...]:
+        ''' Returns a snapshot of the pods with the given status. '''
+        return self.etcd.pods_with_status(status)
+
+    def GetEndPoints(self) -> Tuple[EndPoint, ...]:
+        ''' Returns a snapshot of the endpoints stored in etcd. '''
+        return self.etcd.endPointList
+
+    # Watch opens a watch on changes to the given kinds of objects in etcd (see watch.py)
+    def Watch(self, kinds=None) -> Watch:
+        return self.etcd.watch(kinds)
 
     def GetClusterResources(self):
         return {
@@ -42,7 +61,7 @@ class APIServer:
     # CreateWorker creates a WorkerNode from a list of arguments and adds it to the etcd nodeList
     def CreateWorker(self, info):
         node = WorkerNode(info)
-        self.etcd.nodeList.append(node)
+        self.etcd.add_node(node)
 
         metrics.node_created(node)
 
@@ -50,75 +69,88 @@ class APIServer:
 
     # CreateDeployment creates a Deployment object from a list of arguments and adds it to the etcd deploymentList
     def CreateDeployment(self, info):
-        deployment = Deployment(info)
-        self.etcd.deploymentList.append(deployment)
+        deployment = Deployment(info, self.etcd.deployment_modified)
+        self.etcd.add_deployment(deployment)
 
         metrics.deployment_created(deployment)
         return deployment
 
     # RemoveDeployment deletes the associated Deployment object from etcd and sets the status of all associated pods to 'TERMINATING'
     def RemoveDeployment(self, deploymentLabel: str):
-        for deployment in self.etcd.deploymentList:
-            if deployment.deploymentLabel == deploymentLabel:
-                # XXX: Stephen has indicated it could be a good idea to set expectedReplicas to 0
-                #      here and then just leave deletion of pods to DepController. Potentially we wind up
-                #      with the Scheduler running before DepController, resulting in a request being routed
-                #      to a Pod which is going to get shut down on the next invocation of DepController.
-                #      Does that matter? Probably not
-                deployment.expectedReplicas = 0
-                metrics.deployment_request_deletion(deployment)
-                break
-        else:
+        deployment = self.etcd.get_deployment(deploymentLabel)
+        if deployment is None:
             print('[APIServer] .. but could not find it!')
+            return
+
+        # XXX: Stephen has indicated it could be a good idea to set expectedReplicas to 0
+        #      here and then just leave deletion of pods to DepController. Potentially we wind up
+        #      with the Scheduler running before DepController, resulting in a request being routed
+        #      to a Pod which is going to get shut down on the next invocation of DepController.
+        #      Does that matter? Probably not
+        deployment.expectedReplicas = 0
+        metrics.deployment_request_deletion(deployment)
+
+    # DeleteDeployment drops a Deployment which has no replicas left from etcd
+    def DeleteDeployment(self, deployment: Deployment):
+        assert deployment.currentReplicas == 0
+
+        self.etcd.remove_deployment(deployment)
+        metrics.deployment_deleted(deployment)
 
     # CreateEndpoint creates an EndPoint object using information from a provided Pod and Node and appends it
     # to the endPointList in etcd
     def CreateEndPoint(self, pod: Pod, worker: WorkerNode):
         endpoint = EndPoint(pod, pod.deploymentLabel, worker)
 
-        assert worker.available_cpu >= pod.assigned_cpu
-        worker.available_cpu -= pod.assigned_cpu
+        with worker.lock:
+            assert worker.available_cpu >= pod.assigned_cpu
+            worker.available_cpu -= pod.assigned_cpu
         metrics.node_cpu(worker)
 
-        self.etcd.endPointList.append(endpoint)
+        self.etcd.add_endpoint(endpoint)
         self.StartPod(pod)
 
     # Removes the endpoint and its associated pod from the cluster
     def RemoveEndPoint(self, endpoint: EndPoint):
         assert not endpoint.pod.is_running()
 
-        endpoint.node.available_cpu += endpoint.pod.assigned_cpu
-        self.etcd.endPointList.remove(endpoint)
+        with endpoint.node.lock:
+            endpoint.node.available_cpu += endpoint.pod.assigned_cpu
+        self.etcd.remove_endpoint(endpoint)
         metrics.node_cpu(endpoint.node)
 
-        # Remove pod from runningPodList
+        # Remove pod from the cluster
         metrics.pod_terminated(endpoint.pod)
-        self.etcd.runningPodList.remove(endpoint.pod)
+        self.etcd.remove_pod(endpoint.pod)
 
-        for deployment in self.etcd.deploymentList:
-            if deployment.deploymentLabel == endpoint.deploymentLabel:
-                deployment.currentReplicas -= 1
-                # TODO record pod got moved from running pod list?
-                metrics.deployment_replicas(deployment)
-                break
-        else:
+        deployment = self.etcd.get_deployment(endpoint.deploymentLabel)
+        if deployment is None:
             print('[APIServer] Failed to find deployment associated with endpoint!', endpoint)
+            return
+
+        with deployment.lock:
+            deployment.currentReplicas -= 1
+        # TODO record pod got moved from running pod list?
+        metrics.deployment_replicas(deployment)
 
     # CheckEndPoint checks that the associated pod is still present on the expected WorkerNode
     def CheckEndPoint(self, endpoint: EndPoint) -> bool:
         return endpoint.pod.status == 'RUNNING'
 
     def GetDeploymentByLabel(self, deploymentLabel: str) -> Deployment:
-        for deployment in self.etcd.deploymentList:
-            if deployment.deploymentLabel == deploymentLabel:
-                return deployment
+        return self.etcd.get_deployment(deploymentLabel)
 
     # GetEndPointsByLabel returns a list of EndPoints associated with a given deployment
-    def GetEndPointsByLabel(self, deploymentLabel: str) -> List[EndPoint]:
-        return list(filter(
-            lambda endpoint: endpoint.deploymentLabel == deploymentLabel,
-            self.etcd.endPointList,
-        ))
+    def GetEndPointsByLabel(self, deploymentLabel: str) -> Tuple[EndPoint, ...]:
+        return self.etcd.endpoints_for_label(deploymentLabel)
+
+    # GetEndPointsByNode returns a list of EndPoints hosted on a given WorkerNode
+    def GetEndPointsByNode(self, nodeLabel: str) -> Tuple[EndPoint, ...]:
+        return self.etcd.endpoints_for_node(nodeLabel)
+
+    # GetEndPointForPod returns the EndPoint a pod has been scheduled to, if any
+    def GetEndPointForPod(self, pod: Pod) -> EndPoint:
+        return self.etcd.endpoint_for_pod(pod)
 
     # CreatePod finds the resource allocations associated with a deployment and creates a pod using those metrics
     def CreatePod(self, deployment: Deployment):
@@ -129,9 +161,16 @@ class APIServer:
         # TODO -- do we adjust currentReplicas now? or only when a pod transitions status from PENDING -> RUNNING?
         assert deployment.currentReplicas < deployment.expectedReplicas
 
-        pod = Pod(f'{deployment.deploymentLabel}/{id_suffix}', deployment.cpuCost, deployment.deploymentLabel)
-        self.etcd.pendingPodList.append(pod)
-        deployment.currentReplicas += 1
+        pod = Pod(
+            f'{deployment.deploymentLabel}/{id_suffix}',
+            deployment.cpuCost,
+            deployment.deploymentLabel,
+            self.clock,
+            deployment.notify_capacity,
+        )
+        self.etcd.add_pod(pod)
+        with deployment.lock:
+            deployment.currentReplicas += 1
 
         metrics.pod_created(pod)
         metrics.deployment_replicas(deployment)
@@ -139,28 +178,30 @@ class APIServer:
     def StartPod(self, pod: Pod):
         assert pod.status == 'PENDING'
 
-        self.etcd.pendingPodList.remove(pod)
-        self.etcd.runningPodList.append(pod)
-        pod.crash.clear()
-        pod.status = 'RUNNING'
+        self.etcd.set_pod_status(pod, 'RUNNING')
 
         metrics.pod_started(pod)
+        # Requests waiting on this deployment can now be routed to the pod
+        pod.notify_capacity()
 
     # TerminatePod finds the pod associated with a given EndPoint and sets it's status to 'TERMINATING'
     # No new requests will be sent to a pod marked 'TERMINATING'.
     def TerminatePod(self, endpoint: EndPoint):
-        if endpoint.pod.status == 'PENDING':
-            # See Section 6 of the report for a discussion about this strange-looking code.
-            self.etcd.pendingPodList.remove(endpoint.pod)
-            self.etcd.runningPodList.append(endpoint.pod)
-
+        # See Section 6 of the report for a discussion about terminating PENDING pods.
         metrics.pod_terminating(endpoint.pod)
-        endpoint.pod.status = 'TERMINATING'
+        self.etcd.set_pod_status(endpoint.pod, 'TERMINATING')
+
+    # RestartPod marks a FAILED pod as PENDING so that the Scheduler starts it again
+    def RestartPod(self, pod: Pod):
+        assert pod.status == 'FAILED'
+
+        self.etcd.set_pod_status(pod, 'PENDING')
+        metrics.pod_restart(pod)
 
     # CrashPod finds a pod from a given deployment and sets its status to 'FAILED'
     # Any resource utilisation on the pod will be reset to the base 0
     def CrashPod(self, deploymentLabel: str):
-        endpoints = self.GetEndPointsByLabel(deploymentLabel)
+        endpoints = self.etcd.endpoints_for_label(deploymentLabel)
         if not endpoints:
             print('[APIServer] Failed to find pod for deployment to crash:', deploymentLabel)
             return
@@ -170,29 +211,25 @@ class APIServer:
             if endpoint.pod.status == 'RUNNING':
                 pod = endpoint.pod
 
-                # NOTE: Should probably call pool.shutdown and then make a new
-                #       ThreadPoolExecutor when the pod gets rescheduled. But then
-                #       we lose the "request crashed" message, so we need to track
-                #       pending request ids and... it's too much work rn
-
                 metrics.pod_crashed(pod)
-                pod.status = 'FAILED'
-                pod.crash.set()
+                self.etcd.set_pod_status(pod, 'FAILED')
+                pod.Crash()
                 break
         else:
             print('[APIServer] Failed to find a suitable pod to crash!', deploymentLabel)
 
-    # PushReq adds the incoming request to the target deployment's handling queue
+    # PushReq adds the incoming request to the target deployment's handling queue, recording the requests
+    # its admission policy turns away when the queue is full
     def PushReq(self, info):
-        metrics.request_created(info[0])
+        request = Request(info)
+        metrics.request_created(request)
         # A2 NOTE: Assuming we don't need to keep the machinery for reqCreator / reqHandle
 
-        for deployment in self.GetDeployments():
-            # Try to find the deployment for this request
-            if deployment.deploymentLabel == info[1]:
-                with deployment.lock:
-                    deployment.pendingReqs.append(info)
-                    deployment.waiting.set()
-        else:
+        # Try to find the deployment for this request
+        deployment = self.etcd.get_deployment(info[1])
+        if deployment is None:
             # TODO -- error couldn't find deployment
-            pass
+            return
+
+        for rejected in deployment.push_request(request):
+            metrics.request_rejected(rejected)
@@ -1,11 +1,14 @@
 import math
-import time
+import threading
+from typing import Optional
 
 import config
+import instrumentation
 from api_server import APIServer
 from controllers import PIDController
+from forecasting import HoltForecaster
 
-SETPOINT_BUFFER = 10 # measured in points, i.e. for setpoint=50 the margin is 40<=x<=60 not 45<=x<=55
+SCALE_COOLDOWN = 4 # seconds to wait after a scaling decision before measuring again
 
 ''' Horizontal pod autoscaler '''
 class HPA:
@@ -23,99 +26,137 @@ class HPA:
         self.set_point = int(info[1])
         self.sync_period = int(info[2])
 
-        # self.controller = PIDController(kp=0.85, ki=0.0013, kd=0.1) # TODO tune
-        self.controller = PIDController(kp=0.9, ki=0.0013, kd=0) # TODO tune
+        # The gains and buffer come from config, sweep.py searches for good values
+        self.controller = PIDController(kp=config.autoscale_kp, ki=config.autoscale_ki, kd=config.autoscale_kd)
+        # measured in points, i.e. for setpoint=50 the margin is 40<=x<=60 not 45<=x<=55
+        self.setpoint_buffer = config.autoscale_setpoint_buffer
 
-
-        # self.controller = PIDController(kp=1.0, ki=1.0, kd=1.0)
         self.measurements = CappedList(max(1, math.floor(self.sync_period / loop_time)))
 
-    def __call__(self):
-        print('HPAScalerStart')
-        time.sleep(config.autoscale_warmup_time)
-        while self.running:
-            # Step 1: Calculate utilization for this step
-            deployment = self.api_server.GetDeploymentByLabel(self.deployment_label)
-            if deployment is None:
-                print(f'HPAScaler: ERROR -- COULD NOT FIND ASSOCIATED DEPLOYMENT')
-
-            endpoints = self.api_server.GetEndPointsByLabel(self.deployment_label)
-            current_utilization = measure_utilization(endpoints, len(deployment.pendingReqs))
-            if current_utilization is not math.inf:
-                # print(f'HPAScaler measuring load {self.deployment_label} {current_utilization}')
-                print(f'HPAScaler({self.deployment_label}): {current_utilization}')
-                self.measurements.append(current_utilization)
-
-            # Step 2: See if we need to trigger an autoscale event
-            if self.measurements.is_full():
-                measured_value = self.measurements.average()
-
-                min_bound = self.set_point - SETPOINT_BUFFER
-                max_bound = self.set_point + SETPOINT_BUFFER
-
-                # Step 2.1 Check if MV is off by >10%
-                print('@@@MAX REPLICAS:', self.get_maximum_replicas(deployment.cpuCost))
-                if measured_value < min_bound or measured_value > max_bound:
-                    print('---')
-                    print(self.deployment_label)
-
-                    print(f'HPAScaler: Calling controller.work. MV:', measured_value, 'SP:', self.set_point)
-                    error = self.controller.work(measured_value - self.set_point)
-                    print(f'HPAScaler: Controller output =>', error)
-
-                    # if error is 100, then that means we should double our expected replicas
-                    # likewise if error is -100, then that means we need to kill all our pods
-                    scaling_factor = error / 100
-
-                    # this is the number of replicas we'll be destroying or creating
-                    scale_magnitude = self.get_scaling_magnitude(
-                        deployment.expectedReplicas,
-                        scaling_factor,
-                    )
-
-                    if scale_magnitude + deployment.expectedReplicas > self.get_maximum_replicas(deployment.cpuCost):
-                        print(f'HPAScaper: Skipping scale by {scale_magnitude} replicas. Would exceed max replicas {self.get_maximum_replicas(deployment.cpuCost)}')
-                    elif scale_magnitude != 0:
-                        print(f'HPAScaler: Maybe scaling deployment by {scale_magnitude} replicas? (ER={deployment.expectedReplicas})')
-
-                        # # calculate the expected usage after scaling
-                        # with deployment.lock:
-                        #     pending_req_count = len(deployment.pendingReqs)
-                        # current_cpu_count = deployment.cpuCost * deployment.currentReplicas
-                        # current_cpu_used = current_cpu_count * measured_value
-                        # new_cpu_count = current_cpu_count + scaling_factor * deployment.cpuCost
-                        # if scale_magnitude > 0:
-                        #     new_cpu_used = current_cpu_used + min(pending_req_count, scaling_factor * deployment.cpuCost)
-                        # else:
-                        #     new_cpu_used = current_cpu_used - scaling_factor * deployment.cpuCost
-                        # estimated_value = new_cpu_used / new_cpu_count
-
-                        # print(f'HPAScaler: Applying scaling decision estimated to change MV ->', estimated_value)
-
-                        deployment.expectedReplicas = deployment.expectedReplicas + scale_magnitude
-                        print(f'HPAScaler: new expectedReplicas=', deployment.expectedReplicas)
-                    else:
-                        print(f'HPAScaler: .. ignoring, results in no scale')
-
-                    print('---')
-
-                    # Clear old measurements and then start cooling down
-                    self.measurements.clear()
-                    time.sleep(4)
+        # Clock times of the next step, and until which the last scaling decision is cooling down
+        self.next_run = 0
+        self.cooldown_until = 0
+
+        # Predictive mode: a forecast of the deployment's arrival rate (requests per second) and the mean
+        # execTime of its finished requests, fed from the deployment's counters as of the last step
+        self.arrival_rate = HoltForecaster(config.autoscale_forecast_alpha, config.autoscale_forecast_beta)
+        self.service_time = None
+        self.last_counts = None
+
+    def step(self, deployment, current_utilization, cluster_cpus, deployment_count, now):
+        ''' Runs one autoscaling step with the measurements the AutoscalerManager took for this tick. '''
+        # Step 1: Record utilization for this step
+        if current_utilization is not math.inf:
+            # print(f'HPAScaler measuring load {self.deployment_label} {current_utilization}')
+            print(f'HPAScaler({self.deployment_label}): {current_utilization}')
+            self.measurements.append(current_utilization)
+
+        # Step 2: In predictive mode, scale for the forecast load unless the forecast has been too far off lately
+        if config.autoscale_predictive:
+            self.observe(deployment, now)
+            demand = self.forecast_demand(deployment)
+            if demand is not None:
+                self.scale_for_demand(deployment, demand, get_maximum_replicas(cluster_cpus, deployment_count, deployment.cpuCost))
+                self.next_run = max(now, self.cooldown_until) + self.time
+                return
+
+        # Step 3: See if we need to trigger an autoscale event
+        if self.measurements.is_full():
+            measured_value = self.measurements.average()
+
+            min_bound = self.set_point - self.setpoint_buffer
+            max_bound = self.set_point + self.setpoint_buffer
+
+            # Step 2.1 Check if MV is off by >10%
+            maximum_replicas = get_maximum_replicas(cluster_cpus, deployment_count, deployment.cpuCost)
+            print('@@@MAX REPLICAS:', maximum_replicas)
+            if measured_value < min_bound or measured_value > max_bound:
+                print('---')
+                print(self.deployment_label)
+
+                print(f'HPAScaler: Calling controller.work. MV:', measured_value, 'SP:', self.set_point)
+                error = self.controller.work(measured_value - self.set_point)
+                print(f'HPAScaler: Controller output =>', error)
+
+                # if error is 100, then that means we should double our expected replicas
+                # likewise if error is -100, then that means we need to kill all our pods
+                scaling_factor = error / 100
+
+                # this is the number of replicas we'll be destroying or creating
+                scale_magnitude = self.get_scaling_magnitude(
+                    deployment.expectedReplicas,
+                    scaling_factor,
+                )
+
+                if scale_magnitude + deployment.expectedReplicas > maximum_replicas:
+                    print(f'HPAScaper: Skipping scale by {scale_magnitude} replicas. Would exceed max replicas {maximum_replicas}')
+                elif scale_magnitude != 0:
+                    print(f'HPAScaler: Maybe scaling deployment by {scale_magnitude} replicas? (ER={deployment.expectedReplicas})')
+                    deployment.expectedReplicas = deployment.expectedReplicas + scale_magnitude
+                    print(f'HPAScaler: new expectedReplicas=', deployment.expectedReplicas)
                 else:
-                    print(f'HPAScaler: MV:', measured_value, 'SP:', self.set_point, '-> no scale')
-
-            time.sleep(self.time)
-        print('HPAScalerShutDown')
-
-    def get_maximum_replicas(self, cpu_cost):
-        deployment_count = len(self.api_server.GetDeployments())
-        cluster_cpus = self.api_server.GetClusterResources()['cpu']
-
-        return math.ceil(min(
-            cluster_cpus / deployment_count + 0.1 * cluster_cpus,
-            cluster_cpus,
-        ) / cpu_cost)
+                    print(f'HPAScaler: .. ignoring, results in no scale')
+
+                print('---')
+
+                # Clear old measurements and then start cooling down
+                self.measurements.clear()
+                self.cooldown_until = now + SCALE_COOLDOWN
+            else:
+                print(f'HPAScaler: MV:', measured_value, 'SP:', self.set_point, '-> no scale')
+
+        self.next_run = max(now, self.cooldown_until) + self.time
+
+    def observe(self, deployment, now):
+        ''' Feeds the arrival rate and service time since the last step to the forecasts. '''
+        counts = (now, deployment.arrivals, deployment.completions, deployment.completed_work)
+        if self.last_counts is not None and now > self.last_counts[0]:
+            last_t, last_arrivals, last_completions, last_completed_work = self.last_counts
+            self.arrival_rate.update((deployment.arrivals - last_arrivals) / (now - last_t))
+
+            completions = deployment.completions - last_completions
+            if completions:
+                service_time = (deployment.completed_work - last_completed_work) / completions
+                if self.service_time is None:
+                    self.service_time = service_time
+                else:
+                    self.service_time += config.autoscale_forecast_alpha * (service_time - self.service_time)
+        self.last_counts = counts
+
+    def forecast_demand(self, deployment) -> Optional[float]:
+        ''' The cpus the deployment is expected to keep busy at its peak over the forecast horizon, or
+        None if the forecast can't be trusted (yet). '''
+        if self.arrival_rate.relative_error() > config.autoscale_forecast_max_error:
+            return None
+
+        service_time = self.service_time
+        if service_time is None:
+            # Nothing has finished yet, go by what has been asked for
+            if not deployment.arrivals:
+                return None
+            service_time = deployment.arrived_work / deployment.arrivals
+
+        horizon = config.autoscale_forecast_horizon
+        # Each request keeps a cpu busy for its execTime, so the busy cpus are the rate times the
+        # service time (Little's law). The requests already queued are spread over the horizon.
+        peak_rate = self.arrival_rate.peak(max(1, horizon / self.time))
+        return peak_rate * service_time + len(deployment.pendingReqs) * service_time / horizon
+
+    def scale_for_demand(self, deployment, demand, maximum_replicas):
+        ''' Scales up as soon as the forecast demand would push utilization over the set point, and down
+        only once it would leave it below the set point buffer. '''
+        if not deployment.expectedReplicas:
+            return # Being deleted
+
+        pod_cpus = deployment.cpuCost * self.set_point / 100
+        target = min(max(1, math.ceil(demand / pod_cpus)), maximum_replicas)
+        forecast_utilization = demand / (deployment.expectedReplicas * deployment.cpuCost) * 100
+
+        if target > deployment.expectedReplicas or (
+            target < deployment.expectedReplicas and forecast_utilization < self.set_point - self.setpoint_buffer
+        ):
+            print(f'HPAScaler({self.deployment_label}): forecast demand {demand:.2f} cpus, scaling {deployment.expectedReplicas} -> {target} replicas')
+            deployment.expectedReplicas = target
 
     def get_scaling_magnitude(self, expected_replicas, scaling_factor):
         # if scaling_factor == 1 -> add 100% replicas, and vice versa
@@ -131,6 +172,77 @@ class HPA:
 
         return scale_magnitude
 
+# Runs every HPA from one loop. Each tick, the deployments, the utilization of every deployment
+# (from a single pass over the endpoints) and the cluster's cpus are read once and shared by all
+# of the HPAs due to step. HPAs step every loop_time seconds after a warmup, and a cooling down
+# HPA's next step is pushed back rather than slept through, so one HPA never holds up another.
+class AutoscalerManager:
+    def __init__(self, api_server, loop_time):
+        self.api_server = api_server
+        self.time = loop_time
+        self.running = True
+        self.hpas = []
+        # Guards hpas, which add() and resume() change from the trace's thread while work() runs on the Autoscaler thread
+        self.lock = threading.Lock()
+        # Set when an HPA is added or the manager is stopped, to cut the threaded loop's wait short
+        self._wake = threading.Event()
+
+    def __call__(self):
+        print('HPAScalerStart')
+        while self.running:
+            self._wake.wait(self.work())
+            self._wake.clear()
+        print('HPAScalerShutDown')
+
+    def stop(self):
+        self.running = False
+        self._wake.set()
+
+    def add(self, hpa: HPA):
+        hpa.next_run = self.api_server.clock.now() + config.autoscale_warmup_time
+        with self.lock:
+            self.hpas.append(hpa)
+        self._wake.set()
+
+    def resume(self, hpa: HPA):
+        ''' Adds an HPA restored from a checkpoint, which keeps its next_run. '''
+        with self.lock:
+            self.hpas.append(hpa)
+        self._wake.set()
+
+    @instrumentation.control_loop()
+    def work(self) -> Optional[float]:
+        ''' Steps every HPA which is due. Returns how long until the next one is, or None if there are no HPAs left. '''
+        now = self.api_server.clock.now()
+        with self.lock:
+            due = [hpa for hpa in self.hpas if hpa.next_run <= now]
+        if due:
+            deployments = {deployment.deploymentLabel: deployment for deployment in self.api_server.GetDeployments()}
+            utilizations = measure_utilizations(self.api_server.GetEndPoints(), deployments)
+            cluster_cpus = self.api_server.GetClusterResources()['cpu']
+
+            for hpa in due:
+                deployment = deployments.get(hpa.deployment_label)
+                if deployment is None:
+                    print(f'HPAScaler: ERROR -- COULD NOT FIND ASSOCIATED DEPLOYMENT')
+                    hpa.running = False
+                    continue
+                hpa.step(deployment, utilizations.get(hpa.deployment_label, math.inf), cluster_cpus, len(deployments), now)
+
+        with self.lock:
+            if due:
+                self.hpas = [hpa for hpa in self.hpas if hpa.running]
+            if not self.hpas:
+                return None
+            return max(0, min([hpa.next_run for hpa in self.hpas]) - now)
+
+
+def get_maximum_replicas(cluster_cpus, deployment_count, cpu_cost):
+    return math.ceil(min(
+        cluster_cpus / deployment_count + 0.1 * cluster_cpus,
+        cluster_cpus,
+    ) / cpu_cost)
+
 def measure_utilization(endpoints, pending_req_count):
     n_discarded = 0
 
@@ -153,21 +265,65 @@ def measure_utilization(endpoints, pending_req_count):
     total_used = total_assigned - total_available + pending_req_count
     return total_used / total_assigned * 100
 
+def measure_utilizations(endpoints, deployments):
+    ''' measure_utilization for every deployment in {label: deployment} at once, in one pass over the endpoints.
+    Deployments without a running or pending pod are left out. '''
+    totals = {}
+    for endpoint in endpoints:
+        status = endpoint.pod.status
+        if status != 'RUNNING' and status != 'PENDING':
+            continue
+        total = totals.get(endpoint.deploymentLabel)
+        if total is None:
+            total = totals[endpoint.deploymentLabel] = [0, 0]
+        total[0] += endpoint.pod.assigned_cpu
+        if status == 'RUNNING':
+            total[1] += endpoint.pod.available_cpu
+
+    utilizations = {}
+    for label, (total_assigned, total_available) in totals.items():
+        deployment = deployments.get(label)
+        if deployment is None or total_assigned == 0:
+            continue
+        total_used = total_assigned - total_available + len(deployment.pendingReqs)
+        utilizations[label] = total_used / total_assigned * 100
+    return utilizations
+
+# The last max_size values appended, in a ring buffer with a running sum so that appending and
+# averaging are both O(1)
 class CappedList:
     def __init__(self, max_size: int):
-        self.data = []
         self.max_size = max_size
+        self.clear()
+
+    def __len__(self):
+        return self.size
 
     def append(self, value):
         if self.is_full():
-            self.data.pop(0)
-        self.data.append(value)
+            self.total += value - self.data[self.start]
+            self.data[self.start] = value
+            self.start = (self.start + 1) % self.max_size
+            if self.start == 0:
+                # Re-sum once per lap so that floating point error can't build up
+                self.total = sum(self.data)
+        else:
+            self.data[(self.start + self.size) % self.max_size] = value
+            self.size += 1
+            self.total += value
 
     def average(self):
-        return sum(self.data) / len(self.data)
+        return self.total / self.size
+
+    def values(self):
+        ''' The values held, oldest first. '''
+        return [self.data[(self.start + i) % self.max_size] for i in range(self.size)]
 
     def clear(self):
-        self.data = []
+        self.data = [0] * self.max_size
+        self.start = 0
+        self.size = 0
+        self.total = 0
 
     def is_full(self):
-        return len(self.data) >= self.max_size
+        return self.size >= self.max_size
@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+
+import config
+import metrics
+from api_server import APIServer
+from autoscalers import measure_utilization, measure_utilizations
+from clock import VirtualClock
+from dep_controller import DepController
+from load_balancing import (
+    FirstFitLoadBalancer,
+    LeastOutstandingRequestsLoadBalancer,
+    PowerOfTwoChoicesLoadBalancer,
+    RoundRobinLoadBalancer,
+    UtilizationAwareLoadBalancer,
+)
+from metrics_sink import MemorySink
+from node_controller import NodeController
+from process_metrics import MetricsProcessor
+from scheduler import Scheduler
+
+# Micro-benchmarks for the control plane's hot paths.
+# Each benchmark runs against a synthetic cluster of a given size: that many nodes and pods, with
+# PODS_PER_DEPLOYMENT pods per deployment, all on a VirtualClock with metrics going to memory.
+# Results are written as JSON so that runs can be compared against a stored baseline:
+#
+#   python benchmarks.py --sizes 100,1000,10000 --output bench.json
+#   python benchmarks.py --baseline bench.json
+
+SIZES = (100, 1000, 10000)
+PODS_PER_DEPLOYMENT = 10
+REPORTS = ('cpu_usage', 'requests_plot', 'requests_summary', 'deployment_distance', 'pod_healthiness', 'pod_usage')
+LOAD_BALANCERS = (
+    FirstFitLoadBalancer,
+    RoundRobinLoadBalancer,
+    UtilizationAwareLoadBalancer,
+    LeastOutstandingRequestsLoadBalancer,
+    PowerOfTwoChoicesLoadBalancer,
+)
+
+def build_cluster(size: int, schedule: bool = True) -> APIServer:
+    ''' size nodes and size pods spread over size / PODS_PER_DEPLOYMENT deployments. The pods are left PENDING unless schedule is set. '''
+    clock = VirtualClock()
+    metrics.reset(clock, MemorySink(), 0)
+    api = APIServer(clock)
+
+    for i in range(size):
+        api.CreateWorker([f'Node_{i}', 1])
+    for i in range(max(1, size // PODS_PER_DEPLOYMENT)):
+        deployment = api.CreateDeployment([f'Dep_{i}', PODS_PER_DEPLOYMENT, 1])
+        for _ in range(PODS_PER_DEPLOYMENT):
+            api.CreatePod(deployment)
+
+    if schedule:
+        Scheduler(api, 1).work()
+    return api
+
+
+def build_backlog(size: int):
+    ''' One deployment with size cpus spread over pods of PODS_PER_DEPLOYMENT cpus each, and size requests queued for it. '''
+    clock = VirtualClock()
+    metrics.reset(clock, MemorySink(), 0)
+    api = APIServer(clock)
+
+    node = api.CreateWorker(['Node_1', size])
+    deployment = api.CreateDeployment(['Dep_A', max(1, size // PODS_PER_DEPLOYMENT), PODS_PER_DEPLOYMENT])
+    for _ in range(max(1, size // PODS_PER_DEPLOYMENT)):
+        api.CreatePod(deployment)
+    for pod in api.GetPending():
+        api.CreateEndPoint(pod, node)
+    for i in range(size):
+        api.PushReq([str(i), 'Dep_A', 1])
+    return api, deployment
+
+
+def write_metrics(size: int, path: str):
+    ''' A metrics file with size nodes, pods and requests, shaped like the simulator's output. '''
+    with open(path, 'w') as fp:
+        def push(**record):
+            fp.write(json.dumps(record) + '\n')
+
+        for i in range(size):
+            t = i * 60 // size
+            push(category='node', event='created', id=f'Node_{i}', t=0)
+            push(category='node', event='cpu', id=f'Node_{i}', assigned_cpu=5, available_cpu=4, t=t)
+            push(category='pod', event='created', id=f'Dep_{i % 10}/{i}', t=t)
+            push(category='pod', event='started', id=f'Dep_{i % 10}/{i}', was_crashed=False, t=t)
+            push(category='pod', event='status', id=f'Dep_{i % 10}/{i}', assigned_cpu=1, available_cpu=i % 2, status='RUNNING', t=t + 1)
+            push(category='deployment', event='replicas', id=f'Dep_{i % 10}', current=i // 10, expected=size // 10, t=t)
+            push(category='request', event='created', id=str(i), t=t)
+            push(category='request', event='started', id=str(i), t=t + 1)
+            push(category='request', event='success' if i % 20 else 'failed', id=str(i), t=t + 3)
+
+
+def measure(fn, repeat: int, number: int = 1, setup=None) -> dict:
+    ''' Times number calls of fn, repeat times. setup() runs before each repeat, outside the timing.
+    Without a setup, fn is called once first to warm up (lazy imports, snapshot caches). '''
+    if setup is None:
+        fn()
+
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+
+    return {
+        'repeat': repeat,
+        'number': number,
+        'min_us': min(timings) * 1e6,
+        'median_us': statistics.median(timings) * 1e6,
+        'mean_us': statistics.fmean(timings) * 1e6,
+    }
+
+
+def benchmark_cluster(size: int, repeat: int):
+    ''' Yields (name, result) for every benchmark against a cluster of the given size. '''
+    api = build_cluster(size)
+    deployment = api.GetDeployments()[0]
+    endpoints = api.GetEndPoints()
+
+    dep_controller = DepController(api, 1)
+    def resync_dep_controller():
+        dep_controller.informer.next_resync = 0
+    yield 'DepController.work (resync)', measure(dep_controller.work, repeat, setup=resync_dep_controller)
+    yield 'DepController.work (no changes)', measure(dep_controller.work, repeat, number=100)
+
+    node_controller = NodeController(api, 1)
+    def resync_node_controller():
+        node_controller.next_sample = 0
+        node_controller.informer.next_resync = 0
+    yield 'NodeController.work', measure(node_controller.work, repeat, setup=resync_node_controller)
+
+    scheduler = Scheduler(api, 1)
+    def resync_scheduler():
+        scheduler.informer.next_resync = 0
+    yield 'Scheduler.work (nothing pending)', measure(scheduler.work, repeat, setup=resync_scheduler)
+
+    # A pass placing a whole cluster's worth of pending pods, on a fresh cluster each time
+    state = {}
+    def pending_cluster():
+        state['scheduler'] = Scheduler(build_cluster(size, schedule=False), 1)
+    yield 'Scheduler.work (all pending)', measure(lambda: state['scheduler'].work(), max(1, repeat // 5), setup=pending_cluster)
+
+    # Routing over size pods, as if one deployment had all of them
+    pods = [endpoint.pod for endpoint in endpoints]
+    for load_balancer in LOAD_BALANCERS:
+        route = load_balancer(api, deployment).route
+        yield f'{load_balancer.__name__}.route', measure(lambda: route(pods), repeat, number=10)
+        pick = load_balancer(api, deployment).pick
+        yield f'{load_balancer.__name__}.pick', measure(pick, repeat, number=100)
+
+    # Draining a backlog of size requests into size free cpus, one request at a time and batched
+    backlog = {}
+    def queue_backlog():
+        api, deployment = build_backlog(size)
+        backlog['load_balancer'] = RoundRobinLoadBalancer(api, deployment)
+    def dispatch_each():
+        while backlog['load_balancer'].dispatch():
+            pass
+    yield 'ILoadBalancer.dispatch (backlog)', measure(dispatch_each, max(1, repeat // 5), setup=queue_backlog)
+    yield 'ILoadBalancer.dispatch_batch (backlog)', measure(lambda: backlog['load_balancer'].dispatch_batch(), max(1, repeat // 5), setup=queue_backlog)
+
+    label = deployment.deploymentLabel
+    yield 'APIServer.GetEndPointsByLabel', measure(lambda: api.GetEndPointsByLabel(label), repeat, number=1000)
+    def invalidate():
+        api.etcd._invalidate(('endpoints', label))
+    yield 'APIServer.GetEndPointsByLabel (rebuilt)', measure(lambda: api.GetEndPointsByLabel(label), repeat, setup=invalidate)
+
+    def push_pop():
+        api.PushReq(['1', label, 1])
+        deployment.pop_request()
+    yield 'APIServer.PushReq + Deployment.pop_request', measure(push_pop, repeat, number=1000)
+
+    yield 'measure_utilization', measure(lambda: measure_utilization(endpoints, 10), repeat, number=10)
+    deployments = {deployment.deploymentLabel: deployment for deployment in api.GetDeployments()}
+    yield 'measure_utilizations', measure(lambda: measure_utilizations(endpoints, deployments), repeat, number=10)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        metrics_path = os.path.join(work_dir, 'metrics.json')
+        write_metrics(size, metrics_path)
+        processor = MetricsProcessor(metrics_path)
+        yield 'MetricsProcessor.__init__', measure(lambda: MetricsProcessor(metrics_path), max(1, repeat // 5))
+        for report in REPORTS:
+            yield f'MetricsProcessor.{report}', measure(getattr(processor, report), max(1, repeat // 5))
+
+
+def run_benchmarks(sizes = SIZES, repeat: int = 5) -> dict:
+    scale_factor = config.cpu_scale_factor
+    config.cpu_scale_factor = 1
+    results = []
+    try:
+        for size in sizes:
+            for name, result in benchmark_cluster(size, repeat):
+                results.append({'name': name, 'size': size, **result})
+    finally:
+        config.cpu_scale_factor = scale_factor
+        metrics.reset()
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    ''' Yields (name, size, baseline median, median, ratio) for every benchmark found in both. '''
+    baseline_medians = {(result['name'], result['size']): result['median_us'] for result in baseline['results']}
+    for result in results['results']:
+        key = (result['name'], result['size'])
+        if key in baseline_medians:
+            yield result['name'], result['size'], baseline_medians[key], result['median_us'], result['median_us'] / baseline_medians[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the control plane hot paths.')
+    parser.add_argument('--sizes', default=','.join([str(size) for size in SIZES]), help='comma separated cluster sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='write the results here as JSON')
+    parser.add_argument('--baseline', help='compare against results written earlier with --output')
+    args = parser.parse_args()
+
+    results = run_benchmarks([int(size) for size in args.sizes.split(',')], args.repeat)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        for name, size, before, after, ratio in compare(results, baseline):
+            print(f'{name:45} {size:>6} {before:12.1f}us -> {after:12.1f}us  x{ratio:.2f}')
+    else:
+        for result in results['results']:
+            print(f"{result['name']:45} {result['size']:>6} {result['median_us']:12.1f}us")
@@ -0,0 +1,198 @@
+import bisect
+import itertools
+import json
+import mmap
+import struct
+import sys
+from typing import Iterator, List
+
+# Traces can be compiled from the text format into a binary one, which the simulator streams
+# through mmap instead of reading the whole file into memory.
+#
+# A compiled trace is a header, then one fixed-width record per command, then a string table and
+# a time index:
+#   header  magic, version, record count, string table offset, index offset
+#   record  opcode (u8), name (u32 index into the string table), two int64 arguments and the
+#           trace time (int64, the sum of the Sleeps before the command)
+#   strings a JSON array with every deployment and node label (and any request id which isn't
+#           a plain integer), so each is stored once however many records use it
+#   index   (t, record number) of the first record at every distinct trace time, for seeking
+#
+# Request ids which are plain integers are stored as arguments; others are interned and their
+# record's opcode has REQUEST_ID_INTERNED set.
+
+MAGIC = b'K8STRACE'
+VERSION = 1
+HEADER = struct.Struct('<8sIQQQ')
+RECORD = struct.Struct('<B3xIqqq')
+INDEX_ENTRY = struct.Struct('<qQ')
+
+# Opcode, and how many integer arguments follow the name
+OPCODES = {
+    'AddNode': (1, 1),
+    'Deploy': (2, 2),
+    'CreateHPA': (3, 2),
+    'DeleteDeployment': (4, 0),
+    'CrashPod': (5, 0),
+    'ReqIn': (6, 2),
+    'Sleep': (7, 1),
+}
+COMMANDS = {opcode: (command, n_args) for command, (opcode, n_args) in OPCODES.items()}
+REQUEST_ID_INTERNED = 0x80
+NO_NAME = 0xFFFFFFFF
+
+def compile_trace(text_path: str, binary_path: str) -> int:
+    ''' Compiles a text trace, one line at a time. Returns the number of records written. '''
+    strings = {}
+    index = []
+    count = 0
+    t = 0
+
+    def intern(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    with open(text_path) as text, open(binary_path, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+
+        for line_number, line in enumerate(text, 1):
+            attributes = line.split()
+            if not attributes:
+                continue
+            if attributes[0] not in OPCODES:
+                raise ValueError(f'{text_path}:{line_number}: unknown command {attributes[0]!r}')
+
+            opcode, _ = OPCODES[attributes[0]]
+            name = NO_NAME
+            args = [0, 0]
+            if attributes[0] == 'Sleep':
+                args[0] = int(attributes[1])
+            elif attributes[0] == 'ReqIn':
+                request_id, name, args[1] = attributes[1], intern(attributes[2]), int(attributes[3])
+                if request_id.isdigit() and str(int(request_id)) == request_id:
+                    args[0] = int(request_id)
+                else:
+                    opcode |= REQUEST_ID_INTERNED
+                    args[0] = intern(request_id)
+            else:
+                name = intern(attributes[1])
+                for i, value in enumerate(attributes[2:]):
+                    args[i] = int(value)
+
+            if not index or index[-1][0] != t:
+                index.append((t, count))
+            out.write(RECORD.pack(opcode, name, args[0], args[1], t))
+            count += 1
+
+            if attributes[0] == 'Sleep':
+                t += args[0]
+
+        strings_offset = out.tell()
+        out.write(json.dumps(list(strings)).encode())
+        index_offset = out.tell()
+        for entry in index:
+            out.write(INDEX_ENTRY.pack(*entry))
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, count, strings_offset, index_offset))
+
+    return count
+
+
+def is_binary_trace(path: str) -> bool:
+    with open(path, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+class BinaryTrace:
+    ''' A compiled trace, memory mapped. Commands come out as the attribute lists run_command takes. '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fp = open(path, 'rb')
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.count, strings_offset, index_offset = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} binary trace')
+
+        self.strings = json.loads(self._map[strings_offset:index_offset].decode())
+        index = memoryview(self._map[index_offset:])
+        self._index_t = index.cast('q')[0::2].tolist()
+        self._index_record = index.cast('Q')[1::2].tolist()
+
+    def __repr__(self):
+        return f'<BinaryTrace {self.path} records={self.count}>'
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        self._fp.close()
+
+    def seek(self, t: int) -> int:
+        ''' Number of the first record at or after trace time t. '''
+        i = bisect.bisect_left(self._index_t, t)
+        return self._index_record[i] if i < len(self._index_record) else self.count
+
+    def records(self, start: int = 0, stop: int = None, chunk_size: int = 1 << 16):
+        ''' Raw (opcode, name, arg0, arg1, t) tuples. The map is read chunk_size records at a time, so only one chunk is ever copied out of it. '''
+        stop = self.count if stop is None else stop
+        for chunk_start in range(start, stop, chunk_size):
+            chunk_stop = min(chunk_start + chunk_size, stop)
+            yield from RECORD.iter_unpack(self._map[HEADER.size + chunk_start * RECORD.size:HEADER.size + chunk_stop * RECORD.size])
+
+    def decode(self, record) -> List[str]:
+        opcode, name, arg0, arg1, _ = record
+        command, n_args = COMMANDS[opcode & ~REQUEST_ID_INTERNED]
+        if command == 'Sleep':
+            return [command, str(arg0)]
+        if command == 'ReqIn':
+            request_id = self.strings[arg0] if opcode & REQUEST_ID_INTERNED else str(arg0)
+            return [command, request_id, self.strings[name], str(arg1)]
+        return [command, self.strings[name], *[str(arg) for arg in (arg0, arg1)[:n_args]]]
+
+    def commands(self, start_t: int = 0) -> Iterator[List[str]]:
+        ''' Streams the commands from trace time start_t onwards. When starting part way through,
+        the commands which set up the cluster (everything but ReqIn, Sleep and CrashPod) before start_t are replayed first. '''
+        start = self.seek(start_t)
+        if start:
+            skipped = (OPCODES['ReqIn'][0], OPCODES['Sleep'][0], OPCODES['CrashPod'][0])
+            for record in self.records(0, start):
+                if record[0] & ~REQUEST_ID_INTERNED not in skipped:
+                    yield self.decode(record)
+
+        for record in self.records(start):
+            yield self.decode(record)
+
+
+def read_trace(path: str, start_t: int = 0, skip: int = 0) -> Iterator[List[str]]:
+    ''' Streams the commands of a text or compiled trace as attribute lists. skip leaves out the first
+    skip commands, e.g. those a checkpoint has already played. A compiled trace jumps straight to that record. '''
+    if is_binary_trace(path):
+        with BinaryTrace(path) as trace:
+            if skip:
+                if start_t:
+                    raise ValueError('Give start_t or skip, not both')
+                for record in trace.records(min(skip, trace.count)):
+                    yield trace.decode(record)
+            else:
+                yield from trace.commands(start_t)
+        return
+
+    if start_t:
+        raise ValueError('Seeking needs a compiled trace, see binary_trace.py')
+    with open(path) as fp:
+        commands = (line.split() for line in fp)
+        yield from itertools.islice((attributes for attributes in commands if attributes), skip, None)
+
+
+if __name__ == '__main__':
+    # python binary_trace.py TRACE.txt TRACE.ktrace
+    print(compile_trace(sys.argv[1], sys.argv[2]), 'records written to', sys.argv[2])
@@ -0,0 +1,270 @@
+import json
+import math
+
+import metrics
+from api_server import APIServer
+from autoscalers import HPA
+from deployment import Deployment
+from end_point import EndPoint
+from pod import Pod
+from request import Request
+from worker_node import WorkerNode
+
+# Checkpoints of a simulation running in virtual time, so that a long trace can be fast-forwarded
+# to an interesting point once and then branched into many runs from there.
+#
+# A checkpoint is a JSON document holding the clock time, the trace cursor (how many commands had
+# been played) and when the next command plays, the nodes, deployments with their pending requests,
+# pods with their endpoints and in-flight requests (with the time they have left), and the HPAs with
+# their measurement windows, PID controller and forecast state. Endpoints are restored in the order
+# they were added in, and events due at the same time (requests finishing, the next command) in the
+# order they were queued in, since both decide which pod a request goes to.
+#
+# Controllers hold no state worth keeping: they are recreated on restore and resync against the
+# restored cluster straight away. Load balancers are recreated too, but carry on from the state they
+# saved (round robin position, random number generators, tie-breaking order), as do the deployments'
+# admission policies, so that a restored run routes and sheds requests like the full run.
+# The HPAs pick up the gains from the config of the restoring run, so branches can try different ones
+# from the same starting point.
+# The restored run's metrics start at the checkpoint: nodes, deployments and pods are recorded as
+# created there, while the requests carried over keep their original creation times.
+
+VERSION = 2
+
+def capture(api_server: APIServer, hpas, cursor: int, trace_event = None, trace_done: bool = False, load_balancers = ()) -> dict:
+    ''' The state of a simulation which has played cursor commands of its trace. trace_event is the
+    clock event which plays the next command, or which stops the run if trace_done. Only consistent
+    between events, i.e. when called from an event on the VirtualClock. '''
+    etcd = api_server.etcd
+    return {
+        'version': VERSION,
+        't': api_server.clock.now(),
+        'cursor': cursor,
+        'trace_event': {
+            't': trace_event.t,
+            'order': trace_event.seq,
+            'done': trace_done,
+        } if trace_event is not None else None,
+        'nodes': [
+            {
+                'label': node.label,
+                'assigned_cpu': node.assigned_cpu,
+                'available_cpu': node.available_cpu,
+                'status': node.status,
+            }
+            for node in etcd.nodes()
+        ],
+        'deployments': [_capture_deployment(deployment) for deployment in etcd.deploymentList],
+        'pods': [
+            _capture_pod(pod, etcd.endpoint_for_pod(pod))
+            for status in list(etcd.podsByStatus)
+            for pod in etcd.pods_with_status(status)
+        ],
+        # Pods by the order their endpoints were added in, which is the order load balancers see them in
+        'endpoints': [endpoint.pod.podName for endpoint in api_server.GetEndPoints()],
+        'hpas': [_capture_hpa(hpa) for hpa in hpas if hpa.running],
+        'load_balancers': {
+            load_balancer.deployment.deploymentLabel: load_balancer.state()
+            for load_balancer in load_balancers
+        },
+    }
+
+
+def _capture_request(request: Request, remaining: float = None, order: int = None) -> dict:
+    state = {
+        'id': request.request_id,
+        'exec_time': request.execTime,
+        'created_at': request.created_at,
+        'started_at': request.started_at,
+    }
+    if remaining is not None:
+        state['remaining'] = remaining
+        state['order'] = order
+    return state
+
+
+def _capture_deployment(deployment: Deployment) -> dict:
+    with deployment.lock:
+        pending = [_capture_request(request) for request in deployment.pendingReqs]
+    return {
+        'label': deployment.deploymentLabel,
+        'cpu_cost': deployment.cpuCost,
+        'current_replicas': deployment.currentReplicas,
+        'expected_replicas': deployment.expectedReplicas,
+        'pending': pending,
+        'arrivals': deployment.arrivals,
+        'arrived_work': deployment.arrived_work,
+        'completions': deployment.completions,
+        'completed_work': deployment.completed_work,
+        'admission': deployment.admission.state() if deployment.admission is not None else None,
+    }
+
+
+def _capture_pod(pod: Pod, endpoint: EndPoint) -> dict:
+    return {
+        'name': pod.podName,
+        'deployment': pod.deploymentLabel,
+        'assigned_cpu': pod.assigned_cpu,
+        'available_cpu': pod.available_cpu,
+        'status': pod.status,
+        'node': endpoint.node.label if endpoint is not None else None,
+        'in_flight': [_capture_request(request, remaining, order) for request, remaining, order in pod.in_flight()],
+    }
+
+
+def _capture_hpa(hpa: HPA) -> dict:
+    forecaster = hpa.arrival_rate
+    return {
+        'deployment': hpa.deployment_label,
+        'set_point': hpa.set_point,
+        'sync_period': hpa.sync_period,
+        'loop_time': hpa.time,
+        'measurements': hpa.measurements.values(),
+        'previous_error': hpa.controller.previous_error,
+        'total_error': hpa.controller.total_error,
+        'next_run': hpa.next_run,
+        'cooldown_until': hpa.cooldown_until,
+        'forecast': {
+            'level': forecaster.level,
+            'trend': forecaster.trend,
+            'count': forecaster.count,
+            'error': forecaster.error,
+            'magnitude': forecaster.magnitude,
+        },
+        'service_time': hpa.service_time,
+        'last_counts': hpa.last_counts,
+    }
+
+
+def save(state: dict, path: str):
+    with open(path, 'w') as fp:
+        json.dump(state, fp)
+
+
+def load(path: str) -> dict:
+    with open(path) as fp:
+        state = json.load(fp)
+    if state.get('version') != VERSION:
+        raise ValueError(f'{path} is not a version {VERSION} checkpoint')
+    return state
+
+
+def restore(state: dict, clock):
+    ''' Rebuilds the cluster from a checkpoint on clock, which should be a VirtualClock at state['t'].
+    Nothing is scheduled until resume() is called. Returns (api_server, hpas, cursor). '''
+    api_server = APIServer(clock)
+    etcd = api_server.etcd
+
+    nodes = {}
+    for node_state in state['nodes']:
+        node = WorkerNode([node_state['label'], 0])
+        node.assigned_cpu = node_state['assigned_cpu']
+        node.available_cpu = node_state['available_cpu']
+        node.status = node_state['status']
+        etcd.add_node(node)
+        nodes[node.label] = node
+        metrics.node_created(node)
+        metrics.node_cpu(node)
+
+    for deployment_state in state['deployments']:
+        label = deployment_state['label']
+        deployment = Deployment([label, 0, deployment_state['cpu_cost']])
+        deployment.currentReplicas = deployment_state['current_replicas']
+        deployment.expectedReplicas = deployment_state['expected_replicas']
+        deployment.pendingReqs.extend([_restore_request(request, label) for request in deployment_state['pending']])
+        deployment.arrivals = deployment_state['arrivals']
+        deployment.arrived_work = deployment_state['arrived_work']
+        deployment.completions = deployment_state['completions']
+        deployment.completed_work = deployment_state['completed_work']
+        # The restoring run's config decides whether there is a policy, and of what kind
+        if deployment.admission is not None and deployment_state['admission'] is not None:
+            deployment.admission.restore_state(deployment_state['admission'])
+        # Only publish replica changes from here on
+        deployment.on_replicas_changed = etcd.deployment_modified
+        etcd.add_deployment(deployment)
+        metrics.deployment_created(deployment)
+        metrics.deployment_replicas(deployment)
+
+    pods = {}
+    for pod_state in state['pods']:
+        label = pod_state['deployment']
+        deployment = etcd.get_deployment(label)
+        pod = Pod(
+            pod_state['name'],
+            pod_state['assigned_cpu'],
+            label,
+            clock,
+            deployment.notify_capacity if deployment is not None else None,
+        )
+        pod.available_cpu = pod_state['available_cpu']
+        pod.status = pod_state['status']
+        etcd.add_pod(pod)
+        metrics.pod_created(pod)
+        if pod.status != 'PENDING':
+            metrics.pod_started(pod)
+        pods[pod.podName] = (pod, pod_state)
+
+    for name in state['endpoints']:
+        pod, pod_state = pods[name]
+        etcd.add_endpoint(EndPoint(pod, pod.deploymentLabel, nodes[pod_state['node']]))
+
+    hpas = []
+    for hpa_state in state['hpas']:
+        hpa = HPA(api_server, hpa_state['loop_time'], [hpa_state['deployment'], hpa_state['set_point'], hpa_state['sync_period']])
+        for value in hpa_state['measurements']:
+            hpa.measurements.append(value)
+        hpa.controller.previous_error = hpa_state['previous_error']
+        hpa.controller.total_error = hpa_state['total_error']
+        hpa.next_run = hpa_state['next_run']
+        hpa.cooldown_until = hpa_state['cooldown_until']
+        for name, value in hpa_state['forecast'].items():
+            setattr(hpa.arrival_rate, name, value)
+        hpa.service_time = hpa_state['service_time']
+        hpa.last_counts = tuple(hpa_state['last_counts']) if hpa_state['last_counts'] is not None else None
+        hpas.append(hpa)
+
+    return api_server, hpas, state['cursor']
+
+
+def resume(state: dict, api_server: APIServer, play):
+    ''' Reschedules the requests which were in flight to finish in the time they had left, and play()
+    (or the end of the run) for when the trace's next command was due. Events due at the same time
+    keep the order they were in. Returns the event scheduled for the trace. '''
+    clock = api_server.clock
+    events = []
+    pods = {
+        pod.podName: pod
+        for status in list(api_server.etcd.podsByStatus)
+        for pod in api_server.etcd.pods_with_status(status)
+    }
+    for pod_state in state['pods']:
+        pod = pods[pod_state['name']]
+        for request_state in pod_state['in_flight']:
+            events.append((request_state['remaining'], request_state['order'], pod, request_state))
+
+    trace_event = state['trace_event']
+    if trace_event is not None:
+        events.append((trace_event['t'] - state['t'], trace_event['order'], None, trace_event))
+    else:
+        events.append((0, math.inf, None, {'done': False}))
+
+    for remaining, _, pod, event_state in sorted(events, key=lambda event: event[:2]):
+        if pod is not None:
+            pod.resume_request(_restore_request(event_state, pod.deploymentLabel), remaining)
+        else:
+            scheduled = clock.call_later(remaining, clock.stop if event_state['done'] else play)
+    return scheduled
+
+
+def restore_load_balancer(state: dict, load_balancer):
+    ''' Carries on from the saved state of the load balancer of the same deployment, if there was one. '''
+    saved = state['load_balancers'].get(load_balancer.deployment.deploymentLabel)
+    if saved is not None:
+        load_balancer.restore_state(saved)
+
+
+def _restore_request(state: dict, deployment_label: str) -> Request:
+    request = Request([state['id'], deployment_label, state['exec_time']])
+    request.created_at = state['created_at']
+    request.started_at = state['started_at']
+    return request
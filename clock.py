@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+# Clocks tell the simulator what time it is and run callbacks when they are due.
+# WallClock follows real time and is what the threaded simulator runs on. Callbacks for every pod
+# share a single timer thread which sleeps until the earliest deadline.
+# VirtualClock is a discrete-event scheduler: callbacks sit in a priority queue ordered by
+# the (virtual) time they are due, and the clock jumps straight to the next event instead
+# of sleeping. Ties are broken by insertion order so runs are deterministic.
+
+class WallClock:
+    def __init__(self):
+        self.start = time.monotonic()
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition()
+        self._local = threading.local()
+        self._thread = None
+
+    def now(self) -> float:
+        ''' Seconds elapsed since the clock was created. '''
+        return time.monotonic() - self.start
+
+    def source(self) -> str:
+        ''' Name of whoever is currently running, as recorded in metrics. '''
+        source = getattr(self._local, 'source', None)
+        if source is not None:
+            return source
+
+        current_thread = threading.current_thread()
+        return 'Simulator' if current_thread.name == 'MainThread' else current_thread.name
+
+    def call_at(self, t: float, callback, *args, source: str = None) -> 'ScheduledEvent':
+        ''' Schedules callback(*args) to run on the timer thread once t seconds have elapsed. '''
+        event = ScheduledEvent(t, next(self._seq), callback, args, source)
+        with self._wakeup:
+            heapq.heappush(self._queue, event)
+            if self._thread is None:
+                self._thread = threading.Thread(name='Timer', target=self._run, daemon=True)
+                self._thread.start()
+            elif self._queue[0] is event:
+                # New earliest deadline, the timer thread needs to recalculate how long to sleep
+                self._wakeup.notify()
+        return event
+
+    def call_later(self, delay: float, callback, *args, source: str = None) -> 'ScheduledEvent':
+        return self.call_at(self.now() + delay, callback, *args, source=source)
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._queue or self._queue[0].t > self.now():
+                    timeout = self._queue[0].t - self.now() if self._queue else None
+                    self._wakeup.wait(timeout)
+                event = heapq.heappop(self._queue)
+
+            if event.cancelled:
+                continue
+
+            self._local.source = event.source
+            try:
+                event.callback(*event.args)
+            except Exception:
+                # Keep the timer alive for everyone else
+                traceback.print_exc()
+            finally:
+                self._local.source = None
+
+
+class ScheduledEvent:
+    __slots__ = ('t', 'seq', 'callback', 'args', 'source', 'cancelled')
+
+    def __init__(self, t, seq, callback, args, source):
+        self.t = t
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.source = source
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.t, self.seq) < (other.t, other.seq)
+
+    def __repr__(self):
+        return f'<ScheduledEvent t={self.t} {self.source}>'
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    def __init__(self, t: float = 0.0):
+        self.t = t
+        self.running = False
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._current_source = None
+        self._after_event = []
+
+    def now(self) -> float:
+        return self.t
+
+    def source(self) -> str:
+        return self._current_source or 'Simulator'
+
+    def call_at(self, t: float, callback, *args, source: str = None) -> ScheduledEvent:
+        ''' Schedules callback(*args) to run at virtual time t. '''
+        event = ScheduledEvent(max(t, self.t), next(self._seq), callback, args, source)
+        heapq.heappush(self._queue, event)
+        return event
+
+    def call_later(self, delay: float, callback, *args, source: str = None) -> ScheduledEvent:
+        ''' Schedules callback(*args) to run delay seconds from now. '''
+        return self.call_at(self.t + delay, callback, *args, source=source)
+
+    def after_event(self, callback):
+        ''' Registers a callback which is run once every event has been processed. '''
+        self._after_event.append(callback)
+
+    def stop(self):
+        self.running = False
+
+    def run(self, until: float = None):
+        ''' Processes events in time order until stop() is called, the queue runs dry or until is reached. '''
+        self.running = True
+        while self.running and self._queue:
+            event = self._queue[0]
+            if until is not None and event.t > until:
+                self.t = until
+                break
+
+            heapq.heappop(self._queue)
+            if event.cancelled:
+                continue
+
+            self.t = event.t
+            self._current_source = event.source
+            try:
+                event.callback(*event.args)
+                for callback in self._after_event:
+                    callback()
+            finally:
+                self._current_source = None
+        self.running = False
@@ -0,0 +1,209 @@
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from process_metrics import load_records
+
+# ColumnarMetrics holds a metrics file as typed numpy columns instead of a list of dicts.
+# String fields (category, event, id, pod, status, ...) are interned: the column holds int32
+# codes into a vocabulary, with -1 where a record has no value. t is an int64 column and every
+# other field is float64 with NaN where a record has no value.
+# Aggregations are done with vectorized numpy operations, and the columns can be cached as a
+# .npz file next to the metrics file so that later loads skip parsing the JSON.
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# Changes to [pending, running, terminating, crashed] pod counts caused by each pod event
+_POD_STATE_DELTAS = {
+    'created': (1, 0, 0, 0),
+    'started': (-1, 1, 0, 0),
+    'crashed': (0, -1, 0, 1),
+    'terminated': (0, 0, -1, 0),
+    'restart': (1, 0, 0, -1),
+}
+_TERMINATING_DELTAS = {
+    'PENDING': (-1, 0, 1, 0),
+    'RUNNING': (0, -1, 1, 0),
+    'FAILED': (0, 0, 1, -1),
+}
+
+class ColumnarMetrics:
+    columns: Dict[str, np.ndarray]
+    vocabularies: Dict[str, np.ndarray]
+
+    def __init__(self, columns, vocabularies):
+        self.columns = columns
+        self.vocabularies = vocabularies
+        self._codes = {
+            name: {value: code for code, value in enumerate(vocabulary)}
+            for name, vocabulary in vocabularies.items()
+        }
+
+    def __len__(self):
+        return len(self.columns['t'])
+
+    @classmethod
+    def from_records(cls, records: List[dict]) -> 'ColumnarMetrics':
+        names = {}
+        for record in records:
+            for name in record:
+                names.setdefault(name, None)
+
+        columns = {}
+        vocabularies = {}
+        for name in names:
+            values = [record.get(name) for record in records]
+            if name == 't':
+                columns[name] = np.array(values, dtype=np.int64)
+            elif any([isinstance(value, str) for value in values]):
+                vocabulary = {}
+                columns[name] = np.array([
+                    -1 if value is None else vocabulary.setdefault(value, len(vocabulary))
+                    for value in values
+                ], dtype=np.int32)
+                vocabularies[name] = np.array(list(vocabulary), dtype=str)
+            else:
+                columns[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+        if 't' not in columns:
+            columns['t'] = np.zeros(0, dtype=np.int64)
+        return cls(columns, vocabularies)
+
+    @classmethod
+    def load(cls, metrics_path: str, cache: bool = True) -> 'ColumnarMetrics':
+        ''' Loads a metrics file, using (and refreshing) the .npz cache next to it when cache is set. '''
+        cache_path = metrics_path + '.npz'
+        if cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(metrics_path):
+            return cls.load_npz(cache_path)
+
+        metrics = cls.from_records(load_records(metrics_path))
+        if cache:
+            metrics.save(cache_path)
+        return metrics
+
+    @classmethod
+    def load_npz(cls, path: str) -> 'ColumnarMetrics':
+        columns = {}
+        vocabularies = {}
+        with np.load(path, allow_pickle=False) as archive:
+            for key in archive.files:
+                kind, name = key.split(':', 1)
+                (columns if kind == 'column' else vocabularies)[name] = archive[key]
+        return cls(columns, vocabularies)
+
+    def save(self, path: str):
+        # Write through a file object so numpy doesn't append another .npz suffix
+        with open(path, 'wb') as fp:
+            np.savez_compressed(fp, **{
+                **{f'column:{name}': column for name, column in self.columns.items()},
+                **{f'vocabulary:{name}': vocabulary for name, vocabulary in self.vocabularies.items()},
+            })
+
+    def code(self, name: str, value: str) -> int:
+        ''' The interned code of a string value, or -1 if it never occurs. '''
+        return self._codes.get(name, {}).get(value, -1)
+
+    def mask(self, category: str, events = None) -> np.ndarray:
+        mask = self.columns['category'] == self.code('category', category)
+        if events is not None:
+            mask &= np.isin(self.columns['event'], [self.code('event', event) for event in events])
+        return mask
+
+    def cpu_usage(self, bucket_size: int = 1):
+        ''' Share of assigned pod cpu in use per time bucket, from the first status each pod reports in the bucket.
+        Returns (bucket start times, usage). Buckets without any assigned cpu are left out. '''
+        rows = np.flatnonzero(self.mask('pod', ('status',)))
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        buckets = self.columns['t'][rows] // bucket_size
+
+        first = _first_per_key(buckets, self.columns['id'][rows])
+        rows, buckets = rows[first], buckets[first]
+
+        unique_buckets, bucket_index = np.unique(buckets, return_inverse=True)
+        assigned = np.bincount(bucket_index, weights=self.columns['assigned_cpu'][rows], minlength=len(unique_buckets))
+        available = np.bincount(bucket_index, weights=self.columns['available_cpu'][rows], minlength=len(unique_buckets))
+
+        has_cpu = assigned > 0
+        return unique_buckets[has_cpu] * bucket_size, (assigned - available)[has_cpu] / assigned[has_cpu]
+
+    def pod_state_counts(self):
+        ''' Number of [pending, running, terminating, crashed] pods at the end of every t with pod events.
+        Returns (t values, counts) where counts has one row per t. '''
+        rows = np.flatnonzero(self.mask('pod'))
+        events = self.columns['event'][rows]
+
+        deltas = np.zeros((len(rows), 4), dtype=np.int64)
+        for event, delta in _POD_STATE_DELTAS.items():
+            deltas[events == self.code('event', event)] = delta
+
+        if 'old_status' in self.columns:
+            terminating = events == self.code('event', 'terminating')
+            old_status = self.columns['old_status'][rows]
+            for status, delta in _TERMINATING_DELTAS.items():
+                deltas[terminating & (old_status == self.code('old_status', status))] = delta
+            deltas[terminating & ~np.isin(old_status, [self.code('old_status', status) for status in _TERMINATING_DELTAS])] = (0, 0, 1, 0)
+
+        counts = np.cumsum(deltas, axis=0)
+        t = self.columns['t'][rows]
+
+        # Keep the last row for each t
+        last = np.flatnonzero(np.append(t[1:] != t[:-1], True)) if len(t) else np.zeros(0, dtype=np.int64)
+        return t[last], counts[last]
+
+    def request_times(self) -> Dict[str, np.ndarray]:
+        ''' created/started/finished t per request id (first event of each kind), NaN where missing. '''
+        rows = np.flatnonzero(self.mask('request'))
+        ids = self.columns['id'][rows]
+        events = self.columns['event'][rows]
+
+        first = _first_per_key(ids, events)
+        rows, ids, events = rows[first], ids[first], events[first]
+
+        n_ids = len(self.vocabularies.get('id', ()))
+        times = {}
+        for event in ('created', 'started', 'success', 'failed'):
+            column = np.full(n_ids, np.nan)
+            selected = events == self.code('event', event)
+            column[ids[selected]] = self.columns['t'][rows[selected]]
+            times[event] = column
+
+        requests = ~np.isnan(times['created'])
+        finished = np.where(np.isnan(times['success']), times['failed'], times['success'])
+        return {
+            'created': times['created'][requests],
+            'started': times['started'][requests],
+            'finished': finished[requests],
+            'success': ~np.isnan(times['success'][requests]),
+        }
+
+    def request_latencies(self) -> Dict[str, np.ndarray]:
+        ''' Queue, service and end-to-end latency of every request which got that far. '''
+        times = self.request_times()
+        latencies = {
+            'queue': times['started'] - times['created'],
+            'service': times['finished'] - times['started'],
+            'end_to_end': times['finished'] - times['created'],
+        }
+        return {name: latency[~np.isnan(latency)] for name, latency in latencies.items()}
+
+    def latency_percentiles(self, percentiles = PERCENTILES) -> Dict[str, Dict[float, float]]:
+        return {
+            name: {
+                p: float(np.percentile(latency, p)) if len(latency) else float('nan')
+                for p in percentiles
+            }
+            for name, latency in self.request_latencies().items()
+        }
+
+
+def _first_per_key(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ''' Indices of the first occurrence of every distinct (a, b) pair, in their original order. '''
+    if len(a) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    b = b.astype(np.int64) + 1 # shift -1 (missing) codes to 0
+    keys = a.astype(np.int64) * (int(b.max()) + 1) + b
+    _, first = np.unique(keys, return_index=True)
+    return np.sort(first)
@@ -1,5 +1,41 @@
-from load_balancing import RoundRobinLoadBalancer, UtilizationAwareLoadBalancer
+from admission import DropOldestAdmission, EarlyDropAdmission, RejectNewestAdmission
+from load_balancing import (
+    LeastOutstandingRequestsLoadBalancer,
+    PowerOfTwoChoicesLoadBalancer,
+    RoundRobinLoadBalancer,
+    UtilizationAwareLoadBalancer,
+)
+from placement import BestFitPlacement, FirstFitPlacement, MostAllocatedPlacement, SpreadPlacement
 
 autoscale_warmup_time = 10
+# HPA controller gains, and how far (in points) the measured utilization may drift from the set point before scaling
+autoscale_kp = 0.9
+autoscale_ki = 0.0013
+autoscale_kd = 0
+autoscale_setpoint_buffer = 10
+# Predictive HPA: forecast each deployment's arrival rate (Holt's linear smoothing, see forecasting.py) and scale for
+# the peak expected over the next autoscale_forecast_horizon seconds. Falls back to the PID controller while the
+# forecast's relative error is above autoscale_forecast_max_error.
+autoscale_predictive = False
+autoscale_forecast_alpha = 0.5
+autoscale_forecast_beta = 0.3
+autoscale_forecast_horizon = 10
+autoscale_forecast_max_error = 0.5
+# Seconds between full rescans by the controllers, which otherwise only react to watch events
+controller_resync_period = 30
 cpu_scale_factor = 5
 load_balancer = RoundRobinLoadBalancer
+# Have load balancers route every request they have spare pod cpu for in one go rather than one at a time
+batch_dispatch = False
+placement_policy = FirstFitPlacement
+# How many pending requests a deployment queues before admission_policy sheds load (None for no limit), with
+# overrides by deployment label. Shed requests are recorded as request.rejected.
+admission_queue_capacity = None
+admission_queue_capacities = {}
+admission_policy = RejectNewestAdmission
+# 0 = silent, 1 = echo every metrics record to the console
+metrics_verbosity = 1
+# Record etcdLock wait/hold times and control loop timings (see instrumentation.py), and print them every
+# instrumentation_report_interval seconds if that is set
+instrumentation = False
+instrumentation_report_interval = 0
@@ -1,4 +1,6 @@
+from collections import deque
 import threading
+from typing import List
 
 import config
 from request import Request
@@ -9,30 +11,128 @@ from request import Request
 # the Deployment.
 # expectedReplicas is the setpoint for the number of pods.
 # cpuCost is the amount of cpu that a pod must be assigned.
-# pendingReqs is a list of requests which are waiting to be handled for this deployment
+# pendingReqs is a FIFO queue of Request objects which are waiting to be handled for this deployment
+# admission is the policy which bounds pendingReqs (None when the queue is unbounded), see admission.py
+# changed is notified whenever a request arrives or a pod of this deployment may have freed up cpu.
+# capacityVersion counts the latter so a load balancer can sleep until capacity changes.
+# on_changed is called (without the lock held) whenever changed is notified, so that a simulation in
+# virtual time only has to look at the load balancers of deployments which changed.
+# capacity_listeners are called with the pod whenever one of its pods frees up cpu.
+# arrivals, completions, arrived_work and completed_work count the requests pushed and finished
+# (and the sum of their execTimes) so that the predictive HPA can forecast the load.
+# on_replicas_changed is called whenever currentReplicas or expectedReplicas is set, so that etcd
+# can tell the controllers watching it.
 
 class Deployment:
-    def __init__(self, INFOLIST):
+    def __init__(self, INFOLIST, on_replicas_changed=None):
         self.deploymentLabel = INFOLIST[0]
-        self.currentReplicas = 0
-        self.expectedReplicas = int(INFOLIST[1]) * config.cpu_scale_factor
+        self._currentReplicas = 0
+        self._expectedReplicas = int(INFOLIST[1]) * config.cpu_scale_factor
         self.cpuCost = int(INFOLIST[2])
+        self.on_replicas_changed = on_replicas_changed
 
-        self.pendingReqs = []
+        self.pendingReqs = deque()
+        capacity = config.admission_queue_capacities.get(self.deploymentLabel, config.admission_queue_capacity)
+        self.admission = config.admission_policy(capacity, self.deploymentLabel) if capacity is not None else None
         self.lock = threading.Lock()
-        self.waiting = threading.Event()
+        self.changed = threading.Condition(self.lock)
+        self.capacityVersion = 0
+        self.capacity_listeners = []
+        self.on_changed = None
+
+        self.arrivals = 0
+        self.arrived_work = 0
+        self.completions = 0
+        self.completed_work = 0
 
     def __repr__(self):
         return f'<Deployment {self.deploymentLabel}>'
 
-    def pop_request(self):
+    @property
+    def currentReplicas(self) -> int:
+        return self._currentReplicas
+
+    @currentReplicas.setter
+    def currentReplicas(self, value: int):
+        self._currentReplicas = value
+        self._replicas_changed()
+
+    @property
+    def expectedReplicas(self) -> int:
+        return self._expectedReplicas
+
+    @expectedReplicas.setter
+    def expectedReplicas(self, value: int):
+        self._expectedReplicas = value
+        self._replicas_changed()
+
+    def _replicas_changed(self):
+        if self.on_replicas_changed is not None:
+            self.on_replicas_changed(self)
+
+    def push_request(self, request: Request) -> List[Request]:
+        ''' Queues a request, subject to the admission policy. Returns the requests that were turned away. '''
+        with self.lock:
+            # Arrivals count the offered load, rejected or not, for the predictive HPA
+            self.arrivals += 1
+            self.arrived_work += request.execTime
+            if self.admission is None:
+                self.pendingReqs.append(request)
+                rejected = []
+            else:
+                rejected = self.admission.admit(self.pendingReqs, request)
+            self.changed.notify_all()
+        self._changed()
+        return rejected
+
+    def requeue(self, request: Request):
+        ''' Puts a request that could not be handled back at the front of the queue. '''
+        with self.lock:
+            self.pendingReqs.appendleft(request)
+            self.changed.notify_all()
+        self._changed()
+
+    def pop_request(self) -> Request:
         with self.lock:
             if self.pendingReqs:
-                req = self.pendingReqs.pop(0)
-                has_more_reqs = len(self.pendingReqs) > 0
-
-                if has_more_reqs:
-                    self.waiting.set()
-                else:
-                    self.waiting.clear()
-                return Request(req)
+                return self.pendingReqs.popleft()
+
+    def pop_requests(self, count: int) -> List[Request]:
+        ''' Takes up to count requests off the front of the queue. '''
+        with self.lock:
+            count = min(count, len(self.pendingReqs))
+            return [self.pendingReqs.popleft() for _ in range(count)]
+
+    def requeue_all(self, requests):
+        ''' requeue for several requests, which keep their order at the front of the queue. '''
+        with self.lock:
+            self.pendingReqs.extendleft(reversed(requests))
+            self.changed.notify_all()
+        self._changed()
+
+    def notify_capacity(self, pod=None, finished: Request = None):
+        ''' Called when a pod of this deployment starts or finishes a request (given as finished). '''
+        with self.lock:
+            if finished is not None:
+                self.completions += 1
+                self.completed_work += finished.execTime
+            self.capacityVersion += 1
+            self.changed.notify_all()
+        self._changed()
+
+        if pod is not None:
+            for listener in self.capacity_listeners:
+                listener(pod)
+
+    def _changed(self):
+        if self.on_changed is not None:
+            self.on_changed()
+
+    def wake(self):
+        with self.lock:
+            self.changed.notify_all()
+
+    def wait_until(self, predicate):
+        ''' Blocks until predicate() holds. predicate is evaluated with the deployment lock held. '''
+        with self.lock:
+            self.changed.wait_for(predicate)
@@ -1,25 +1,199 @@
-from typing import List
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 from deployment import Deployment
 from end_point import EndPoint
 from pod import Pod
 from request import Request
+from watch import Watch, WatchEvent
 from worker_node import WorkerNode
 
 class Etcd:
-    '''Etcd is the storage component of the cluster that allows for comparison between expected configuration and real time information.'''
+    '''Etcd is the storage component of the cluster that allows for comparison between expected configuration and real time information.
 
-    deploymentList: List[Deployment]
-    endPointList: List[EndPoint]
+    Besides the primary collections, etcd keeps secondary indexes so the APIServer can answer
+    lookups by deployment label, pod, node or pod status without scanning. The indexes are only
+    consistent if every mutation goes through the methods below. Dicts mapping to None are used
+    as insertion-ordered sets.
+
+    Reads are served from immutable tuple snapshots. A mutation drops the snapshots it affects and
+    the next read rebuilds them, so readers never take a lock unless a snapshot is stale and never
+    see a collection change underneath them.
+
+    Every mutation bumps resourceVersion and is published to the open watches, see watch.py.
+    '''
+
+    # Deployments keyed by deploymentLabel
+    deployments: Dict[str, Deployment]
+    # EndPoints keyed by the pod they hold
+    endPoints: Dict[Pod, EndPoint]
+    endPointsByLabel: Dict[str, Dict[EndPoint, None]]
+    endPointsByNode: Dict[str, Dict[EndPoint, None]]
     # List of the nodes within the cluster
     nodeList: List[WorkerNode]
-    # List of pods created by the deployment controller which are waiting to be scheduled
-    pendingPodList: List[Pod]
-    runningPodList: List[Pod]
+    # Pods keyed by status. PENDING pods are the ones created by the deployment controller which are waiting to be scheduled
+    podsByStatus: Dict[str, Dict[Pod, None]]
 
     def __init__(self):
-        self.pendingPodList = []
-        self.runningPodList = []
-        self.deploymentList = []
+        self.deployments = {}
+        self.endPoints = {}
+        self.endPointsByLabel = {}
+        self.endPointsByNode = {}
         self.nodeList = []
-        self.endPointList = []
+        self.podsByStatus = {}
+
+        # Guards the collections against snapshot rebuilds. Only ever held for a single update or rebuild.
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+        self.resourceVersion = 0
+        self._watches = []
+
+    @property
+    def deploymentList(self) -> Tuple[Deployment, ...]:
+        return self._snapshot(('deployments',), self.deployments.values)
+
+    @property
+    def endPointList(self) -> Tuple[EndPoint, ...]:
+        return self._snapshot(('endpoints',), self.endPoints.values)
+
+    @property
+    def pendingPodList(self) -> Tuple[Pod, ...]:
+        return self.pods_with_status('PENDING')
+
+    @property
+    def runningPodList(self) -> List[Pod]:
+        ''' Every pod which has left the PENDING state, in the order they were indexed. '''
+        with self._lock:
+            return [
+                pod
+                for status, pods in self.podsByStatus.items() if status != 'PENDING'
+                for pod in pods
+            ]
+
+    def _snapshot(self, key: tuple, build: Callable[[], Iterable]) -> tuple:
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            with self._lock:
+                snapshot = tuple(build())
+                self._snapshots[key] = snapshot
+        return snapshot
+
+    def _invalidate(self, *keys: tuple):
+        for key in keys:
+            self._snapshots.pop(key, None)
+
+    # Watches
+    def watch(self, kinds: Iterable[str] = None) -> Watch:
+        ''' Opens a watch for changes to the given kinds of objects (all of them by default). '''
+        watch = Watch(kinds)
+        with self._lock:
+            self._watches = [existing for existing in self._watches if not existing.closed] + [watch]
+            watch.resource_version = self.resourceVersion
+        return watch
+
+    def _publish(self, event_type: str, obj, previous = None):
+        # Called with _lock held, so events reach every watch in resource version order
+        self.resourceVersion += 1
+        event = WatchEvent(event_type, type(obj).__name__, obj, self.resourceVersion, previous)
+        for watch in self._watches:
+            if watch.wants(event):
+                watch.push(event)
+
+    # Deployments
+    def add_deployment(self, deployment: Deployment):
+        with self._lock:
+            self.deployments[deployment.deploymentLabel] = deployment
+            self._invalidate(('deployments',))
+            self._publish('ADDED', deployment)
+
+    def remove_deployment(self, deployment: Deployment):
+        with self._lock:
+            if self.deployments.get(deployment.deploymentLabel) is deployment:
+                del self.deployments[deployment.deploymentLabel]
+                self._invalidate(('deployments',))
+                self._publish('DELETED', deployment)
+
+    def deployment_modified(self, deployment: Deployment):
+        ''' Publishes a change to the replica counts of a deployment. '''
+        with self._lock:
+            self._publish('MODIFIED', deployment)
+
+    def get_deployment(self, deploymentLabel: str) -> Optional[Deployment]:
+        return self.deployments.get(deploymentLabel)
+
+    # Nodes
+    def add_node(self, node: WorkerNode):
+        with self._lock:
+            self.nodeList.append(node)
+            self._invalidate(('nodes',))
+            self._publish('ADDED', node)
+
+    def nodes(self) -> Tuple[WorkerNode, ...]:
+        return self._snapshot(('nodes',), lambda: self.nodeList)
+
+    # EndPoints
+    def add_endpoint(self, endpoint: EndPoint):
+        with self._lock:
+            self.endPoints[endpoint.pod] = endpoint
+            self.endPointsByLabel.setdefault(endpoint.deploymentLabel, {})[endpoint] = None
+            self.endPointsByNode.setdefault(endpoint.node.label, {})[endpoint] = None
+            self._invalidate_endpoint(endpoint)
+            self._publish('ADDED', endpoint)
+
+    def remove_endpoint(self, endpoint: EndPoint):
+        with self._lock:
+            del self.endPoints[endpoint.pod]
+            _discard(self.endPointsByLabel, endpoint.deploymentLabel, endpoint)
+            _discard(self.endPointsByNode, endpoint.node.label, endpoint)
+            self._invalidate_endpoint(endpoint)
+            self._publish('DELETED', endpoint)
+
+    def _invalidate_endpoint(self, endpoint: EndPoint):
+        self._invalidate(
+            ('endpoints',),
+            ('endpoints', endpoint.deploymentLabel),
+            ('node_endpoints', endpoint.node.label),
+        )
+
+    def endpoint_for_pod(self, pod: Pod) -> Optional[EndPoint]:
+        return self.endPoints.get(pod)
+
+    def endpoints_for_label(self, deploymentLabel: str) -> Tuple[EndPoint, ...]:
+        return self._snapshot(('endpoints', deploymentLabel), lambda: self.endPointsByLabel.get(deploymentLabel, ()))
+
+    def endpoints_for_node(self, nodeLabel: str) -> Tuple[EndPoint, ...]:
+        return self._snapshot(('node_endpoints', nodeLabel), lambda: self.endPointsByNode.get(nodeLabel, ()))
+
+    # Pods
+    def add_pod(self, pod: Pod):
+        with self._lock:
+            self.podsByStatus.setdefault(pod.status, {})[pod] = None
+            self._invalidate(('pods', pod.status))
+            self._publish('ADDED', pod)
+
+    def remove_pod(self, pod: Pod):
+        with self._lock:
+            _discard(self.podsByStatus, pod.status, pod)
+            self._invalidate(('pods', pod.status))
+            self._publish('DELETED', pod)
+
+    def set_pod_status(self, pod: Pod, status: str):
+        with self._lock:
+            previous = pod.status
+            _discard(self.podsByStatus, previous, pod)
+            self._invalidate(('pods', previous), ('pods', status))
+            pod.status = status
+            self.podsByStatus.setdefault(status, {})[pod] = None
+            self._publish('MODIFIED', pod, previous)
+
+    def pods_with_status(self, status: str) -> Tuple[Pod, ...]:
+        return self._snapshot(('pods', status), lambda: self.podsByStatus.get(status, ()))
+
+
+def _discard(index: dict, key, value):
+    bucket = index.get(key)
+    if bucket is not None:
+        bucket.pop(value, None)
+        if not bucket:
+            del index[key]
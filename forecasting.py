@@ -0,0 +1,59 @@
+import math
+
+# Online forecasting for the predictive HPA.
+# HoltForecaster is Holt's linear (double exponential) smoothing: a level and a trend, each an
+# exponentially weighted average, so a ramp is followed without lag and the rising side of a sine is
+# extrapolated ahead of its peak. It also tracks how far off its one step ahead forecasts have been,
+# so callers can tell when not to trust it.
+
+class HoltForecaster:
+    def __init__(self, alpha: float, beta: float):
+        # alpha smooths the level, beta the trend. Both in (0, 1], higher reacts faster.
+        self.alpha = alpha
+        self.beta = beta
+
+        self.level = None
+        self.trend = 0.0
+        self.count = 0
+        # Exponentially weighted mean absolute one step ahead error, and of the observations themselves
+        self.error = 0.0
+        self.magnitude = 0.0
+
+    def __repr__(self):
+        return f'<HoltForecaster level={self.level} trend={self.trend} error={self.relative_error()}>'
+
+    def update(self, value: float):
+        self.count += 1
+        if self.level is None:
+            self.level = value
+            self.magnitude = abs(value)
+            return
+
+        error = abs(value - (self.level + self.trend))
+        if self.count == 2:
+            self.error = error
+        else:
+            self.error += self.alpha * (error - self.error)
+        self.magnitude += self.alpha * (abs(value) - self.magnitude)
+
+        previous_level = self.level
+        self.level = self.alpha * value + (1 - self.alpha) * (self.level + self.trend)
+        self.trend = self.beta * (self.level - previous_level) + (1 - self.beta) * self.trend
+
+    def forecast(self, steps: float = 1) -> float:
+        ''' The value expected steps updates from now, never negative. '''
+        if self.level is None:
+            return 0.0
+        return max(0.0, self.level + steps * self.trend)
+
+    def peak(self, steps: float) -> float:
+        ''' The highest value expected over the next steps updates. The forecast is linear, so it is at one of the ends. '''
+        return max(self.forecast(1), self.forecast(steps))
+
+    def relative_error(self) -> float:
+        ''' Recent forecast error relative to the recent observations. Infinite until there have been two updates. '''
+        if self.count < 2:
+            return math.inf
+        if self.magnitude == 0:
+            return 0.0 if self.error == 0 else math.inf
+        return self.error / self.magnitude
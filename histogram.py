@@ -0,0 +1,71 @@
+import math
+
+# LatencyHistogram is a log-bucketed histogram in the spirit of HdrHistogram. Bucket boundaries
+# grow geometrically from lowest to highest, so every recorded value is kept with a bounded
+# relative error while memory stays fixed no matter how many values are recorded.
+# Values below lowest land in the first bucket and values above highest in the last one.
+
+class LatencyHistogram:
+    def __init__(self, lowest: float = 1e-6, highest: float = 3600.0, relative_error: float = 0.01):
+        self.lowest = lowest
+        self.highest = highest
+        self.relative_error = relative_error
+
+        self._log_base = math.log1p(relative_error)
+        self.counts = [0] * (self._index(highest) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __repr__(self):
+        return f'<LatencyHistogram n={self.count}>'
+
+    def _index(self, value: float) -> int:
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) / self._log_base) + 1
+
+    def _value_at(self, index: int) -> float:
+        ''' Upper bound of a bucket. '''
+        return self.lowest * math.exp(index * self._log_base)
+
+    def record(self, value: float):
+        index = min(self._index(value), len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        ''' The value at percentile p (0-100), within relative_error of the recorded value. '''
+        if self.count == 0:
+            return math.nan
+
+        rank = max(1, math.ceil(p / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                if index == 0:
+                    # Everything at or below lowest
+                    return self.min
+                # Don't report past the real extremes
+                return min(max(self._value_at(index), self.min), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    def summary(self) -> dict:
+        return {
+            'count': self.count,
+            'min': self.min if self.count else math.nan,
+            'max': self.max if self.count else math.nan,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
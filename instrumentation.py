@@ -0,0 +1,137 @@
+import functools
+import threading
+import time
+
+import metrics
+from clock import WallClock
+from histogram import LatencyHistogram
+
+# Instrumentation of the simulator itself, for finding out why a run is slow.
+# Locks made with lock() record how long each acquirer (named by the clock's source: a thread name,
+# or the event running on a VirtualClock) waited for them and then held them. Control loop
+# iterations decorated with control_loop() record how long they took, and how late they started
+# relative to when the previous iteration asked to run again.
+# Durations are real (perf_counter) seconds even on a VirtualClock, lags are in clock seconds.
+#
+# Everything is off unless reset() is called with enabled=True: lock() then returns a plain
+# threading.Lock and decorated methods only pay for a global lookup.
+
+_enabled = False
+_clock = WallClock()
+# LatencyHistograms keyed by (kind, name), e.g. ('lock.wait', 'etcdLock/Scheduler')
+_stats = {}
+_stats_lock = threading.Lock()
+
+def reset(clock=None, enabled: bool = False):
+    ''' Clears the stats recorded so far. Locks made before enabling stay uninstrumented. '''
+    global _enabled, _clock
+    _enabled = enabled
+    _clock = clock if clock is not None else WallClock()
+    with _stats_lock:
+        _stats.clear()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def record(kind: str, name: str, seconds: float):
+    with _stats_lock:
+        histogram = _stats.get((kind, name))
+        if histogram is None:
+            histogram = _stats[(kind, name)] = LatencyHistogram()
+        histogram.record(seconds)
+
+
+def summary() -> dict:
+    ''' {(kind, name): summary} of everything recorded so far. '''
+    with _stats_lock:
+        return {key: histogram.summary() for key, histogram in _stats.items()}
+
+
+def report() -> str:
+    ''' A table of the recorded stats, slowest total first. '''
+    with _stats_lock:
+        rows = sorted(_stats.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [f'{"kind":<14} {"name":<48} {"count":>8} {"total s":>10} {"mean ms":>10} {"p99 ms":>10} {"max ms":>10}']
+        for (kind, name), histogram in rows:
+            lines.append(
+                f'{kind:<14} {name:<48} {histogram.count:>8} {histogram.total:>10.3f} '
+                f'{histogram.mean() * 1e3:>10.3f} {histogram.percentile(99) * 1e3:>10.3f} {histogram.max * 1e3:>10.3f}'
+            )
+    return '\n'.join(lines)
+
+
+def dump():
+    ''' Pushes the summaries into the metrics output. '''
+    for (kind, name), stats in summary().items():
+        metrics.instrumentation(kind, name, stats)
+
+
+def lock(name: str):
+    ''' A lock which records wait and hold times under name if instrumentation is enabled. '''
+    return InstrumentedLock(name) if _enabled else threading.Lock()
+
+
+class InstrumentedLock:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._acquired_at = None
+        self._holder = None
+
+    def __repr__(self):
+        return f'<InstrumentedLock {self.name}>'
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        source = _clock.source()
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            self._holder = source
+            record('lock.wait', f'{self.name}/{source}', self._acquired_at - start)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        holder = self._holder
+        self._lock.release()
+        record('lock.hold', f'{self.name}/{holder}', held)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def control_loop(label=None, returns_delay: bool = True):
+    ''' Decorates the method running one iteration of a control loop. The loop is named after the
+    class, plus label(self) if given. If the method returns a delay, the next iteration is expected
+    that long after this one finished and any later start is recorded as lag. Pass returns_delay=False
+    for methods returning a number which isn't one. '''
+    def decorate(work):
+        @functools.wraps(work)
+        def timed_work(self, *args, **kwargs):
+            if not _enabled:
+                return work(self, *args, **kwargs)
+
+            name = type(self).__name__ if label is None else f'{type(self).__name__}({label(self)})'
+            due = getattr(self, '_loop_due', None)
+            if due is not None:
+                record('loop.lag', name, max(0, _clock.now() - due))
+
+            start = time.perf_counter()
+            result = work(self, *args, **kwargs)
+            record('loop.duration', name, time.perf_counter() - start)
+
+            if returns_delay and isinstance(result, (int, float)) and not isinstance(result, bool):
+                self._loop_due = _clock.now() + result
+            return result
+        return timed_work
+    return decorate
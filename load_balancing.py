@@ -1,43 +1,176 @@
 from abc import ABCMeta, abstractmethod
+from collections import deque
+import heapq
+import itertools
+import math
+import random
+import threading
 import time
 
+import instrumentation
 import metrics
 
+# The pods a batch is spread over, which next_pod() picks from like a list. Pods are dropped as they
+# fill up, so membership tests, adding and removal are O(1): the last pod takes the removed one's place.
+class CandidatePods:
+    def __init__(self, pods):
+        self._pods = list(pods)
+        self._index = {pod: i for i, pod in enumerate(self._pods)}
+
+    def __len__(self):
+        return len(self._pods)
+
+    def __getitem__(self, i):
+        return self._pods[i]
+
+    def __iter__(self):
+        return iter(self._pods)
+
+    def __contains__(self, pod):
+        return pod in self._index
+
+    def add(self, pod):
+        self._index[pod] = len(self._pods)
+        self._pods.append(pod)
+
+    def remove(self, pod):
+        i = self._index.pop(pod)
+        last = self._pods.pop()
+        if last is not pod:
+            self._pods[i] = last
+            self._index[last] = i
+
 class ILoadBalancer:
     __metaclass__ = ABCMeta
 
-    def __init__(self, api_server, deployment):
+    def __init__(self, api_server, deployment, batch: bool = False):
         self.api_server = api_server
         self.deployment = deployment
         self.running = True
+        # Route as many requests as there is spare cpu for at a time, see dispatch_batch
+        self.batch = batch
+
+        # capacityVersion of the deployment when dispatch last found no pod with spare cpu.
+        # Until that changes there is no point looking again.
+        self.blocked_at = None
 
     def __call__(self):
         print('LoadBalancer start')
         while self.running:
-            self.deployment.waiting.wait()
+            self.deployment.wait_until(lambda: not self.running or self.ready())
+            if self.running:
+                self.step()
+
+        print('LoadBalancer shutdown')
 
-            with self.api_server.etcdLock:
-                candidate_endpoints = list(filter(
-                    lambda endpoint: self.api_server.CheckEndPoint(endpoint),
-                    self.api_server.GetEndPointsByLabel(self.deployment.deploymentLabel),
-                ))
+    def stop(self):
+        self.running = False
+        self.deployment.wake()
 
-            pods = [endpoint.pod for endpoint in candidate_endpoints]
-            if pods:
-                pod = self.route(pods)
-                if not pod or pod.available_cpu == 0:
-                    # No available pod
-                    continue
+    def ready(self) -> bool:
+        ''' Whether a request is waiting and there may be a pod with spare cpu to route it to. '''
+        return len(self.deployment.pendingReqs) > 0 and self.deployment.capacityVersion != self.blocked_at
 
-                request = self.deployment.pop_request()
-                if not request:
-                    continue # No request waiting
+    @instrumentation.control_loop(lambda load_balancer: load_balancer.deployment.deploymentLabel)
+    def dispatch(self) -> bool:
+        ''' Routes the next pending request to a pod. Returns False if nothing could be routed. '''
+        # Read before looking at the pods so that capacity freed during the scan still wakes us up
+        capacity_version = self.deployment.capacityVersion
 
-                # print(f'LoadBalancer {request} @ {pod}')
-                metrics.request_routed(pod, request)
-                pod.HandleRequest(request)
+        pod = self.pick()
+        if not pod or pod.available_cpu == 0:
+            # No available pod, wait for one to free up
+            self.blocked_at = capacity_version
+            return False
 
-        print('LoadBalancer shutdown')
+        request = self.deployment.pop_request()
+        if not request:
+            return False # No request waiting
+
+        # print(f'LoadBalancer {request} @ {pod}')
+        self.blocked_at = None
+        if not pod.HandleRequest(request, record=False):
+            # The pod crashed or filled up since the snapshot was taken, the request is routed again later
+            self.deployment.requeue(request)
+        else:
+            metrics.requests_dispatched([(pod, request)])
+            self.started(pod)
+        return True
+
+    def step(self):
+        ''' Routes one request, or a batch of them in batch mode. Returns whether any were. '''
+        return self.dispatch_batch() > 0 if self.batch else self.dispatch()
+
+    # Returns a count rather than a delay, so no lag is recorded
+    @instrumentation.control_loop(lambda load_balancer: load_balancer.deployment.deploymentLabel, returns_delay=False)
+    def dispatch_batch(self) -> int:
+        ''' Routes as many pending requests as the pods have spare cpu for, all from one endpoint
+        snapshot, and records their metrics in one go. Returns how many were started. '''
+        capacity_version = self.deployment.capacityVersion
+
+        pods = CandidatePods(self.candidates())
+        requests = self.deployment.pop_requests(sum([pod.available_cpu for pod in pods]))
+        if not requests:
+            if not pods:
+                # No available pod, wait for one to free up
+                self.blocked_at = capacity_version
+            return 0
+
+        dispatched = []
+        pending = deque(requests)
+        while pending:
+            pod = self.next_pod(pods)
+            if pod is None:
+                break
+
+            started = pod.HandleRequest(pending[0], record=False)
+            if started:
+                dispatched.append((pod, pending.popleft()))
+                self.started(pod)
+            if not started or not pod.has_capacity():
+                if pod in pods:
+                    pods.remove(pod)
+                elif not started:
+                    break
+
+        # Until capacity changes there is nothing more to do if every pod is full
+        self.blocked_at = capacity_version if pending or not pods else None
+        if pending:
+            # Pods crashed or filled up since the snapshot was taken
+            self.deployment.requeue_all(pending)
+        metrics.requests_dispatched(dispatched)
+        return len(dispatched)
+
+    def candidates(self):
+        ''' The RUNNING pods with spare cpu. '''
+        # A snapshot, so no need for etcdLock. Pod.HandleRequest re-checks the pod before starting.
+        candidate_endpoints = list(filter(
+            lambda endpoint: self.api_server.CheckEndPoint(endpoint),
+            self.api_server.GetEndPointsByLabel(self.deployment.deploymentLabel),
+        ))
+
+        return [endpoint.pod for endpoint in candidate_endpoints if endpoint.pod.has_capacity()]
+
+    def pick(self):
+        ''' The pod to route the next request to, or None if no pod has spare cpu. '''
+        pods = self.candidates()
+        return self.route(pods) if pods else None
+
+    def next_pod(self, pods):
+        ''' pick() for the next request of a batch. pods are the candidates which still have spare cpu. '''
+        return self.route(pods) if pods else None
+
+    def started(self, pod):
+        ''' Called once a request routed to pod has started. '''
+        pass
+
+    def state(self) -> dict:
+        ''' What a checkpoint needs for a restored load balancer to route like this one would. '''
+        return {}
+
+    def restore_state(self, state: dict):
+        ''' Carries on from state(), which may come from a different kind of load balancer. '''
+        pass
 
     @abstractmethod
     def route(self, pods): raise NotImplementedError
@@ -64,6 +197,12 @@ class RoundRobinLoadBalancer(ILoadBalancer):
         self.current_index += 1
         return pod
 
+    def state(self):
+        return {'current_index': self.current_index}
+
+    def restore_state(self, state):
+        self.current_index = state.get('current_index', 0)
+
 
 class UtilizationAwareLoadBalancer(ILoadBalancer):
     # Send request to lowest utilized pod
@@ -75,3 +214,170 @@ class UtilizationAwareLoadBalancer(ILoadBalancer):
         )
 
         return pods_by_cpu[0]
+
+
+def outstanding_requests(pod) -> int:
+    return pod.assigned_cpu - pod.available_cpu
+
+
+# Routes to the pod with the fewest requests in flight. The pods are kept in a heap keyed by their
+# outstanding requests, which is updated when a request starts or finishes on one of them instead
+# of every pod being looked at for every request. The heap is rebuilt when the deployment's
+# endpoints change.
+# Entries are never updated in place: a pod whose load changed gets a new entry and its old ones
+# are dropped as they surface. Pods without spare cpu are dropped too, and come back once a
+# request finishes on them or they (re)start running.
+# Ties go to the pod whose entry is oldest. Rebuilding keeps that order, so that it is the same
+# however often the heap has been swept, and a checkpoint can hand it to a restored balancer.
+class LeastOutstandingRequestsLoadBalancer(ILoadBalancer):
+    def __init__(self, api_server, deployment, batch=False):
+        super().__init__(api_server, deployment, batch)
+        self._lock = threading.Lock() # requests finish on the clock's thread
+        self._heap = []
+        self._counter = itertools.count()
+        # Endpoint snapshot the heap was built from, its endpoints by pod, and each pod's live entry
+        self._endpoints = None
+        self._members = {}
+        self._entries = {}
+
+        deployment.capacity_listeners.append(self.started)
+
+    def route(self, pods):
+        return min(pods, key=outstanding_requests)
+
+    def started(self, pod):
+        with self._lock:
+            if pod in self._members:
+                self._push(pod)
+
+    def _push(self, pod):
+        entry = (outstanding_requests(pod), next(self._counter), pod)
+        self._entries[pod] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _rebuild(self, endpoints, names = None):
+        ''' Rebuilds the heap from endpoints. Ties keep the order of the current entries, or of names if given. '''
+        if names is not None:
+            rank = {name: i for i, name in enumerate(names)}
+            order = lambda pod: rank.get(pod.podName, math.inf)
+        else:
+            previous = self._entries
+            order = lambda pod: previous[pod][1] if pod in previous else math.inf
+
+        self._endpoints = endpoints
+        self._members = {endpoint.pod: endpoint for endpoint in endpoints}
+        self._entries = {}
+        self._heap = []
+        for pod in sorted(self._members, key=order):
+            entry = (outstanding_requests(pod), next(self._counter), pod)
+            self._entries[pod] = entry
+            self._heap.append(entry)
+        heapq.heapify(self._heap)
+
+    def pick(self):
+        endpoints = self.api_server.GetEndPointsByLabel(self.deployment.deploymentLabel)
+        with self._lock:
+            # Snapshots are only replaced when the endpoints change. Stale entries are also swept
+            # out once they outnumber the live ones.
+            if endpoints is not self._endpoints or len(self._heap) > 2 * len(self._members) + 16:
+                self._rebuild(endpoints)
+
+            while self._heap:
+                entry = self._heap[0]
+                load, _, pod = entry
+                if self._entries.get(pod) is not entry:
+                    heapq.heappop(self._heap)
+                elif load != outstanding_requests(pod):
+                    # Changed without telling us, e.g. it crashed
+                    heapq.heappop(self._heap)
+                    self._push(pod)
+                elif not self.api_server.CheckEndPoint(self._members[pod]) or not pod.has_capacity():
+                    heapq.heappop(self._heap)
+                    del self._entries[pod]
+                else:
+                    return pod
+        return None
+
+    def next_pod(self, pods):
+        return self.pick()
+
+    def state(self):
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry[1])
+            return {'order': [pod.podName for _, _, pod in entries]}
+
+    def restore_state(self, state):
+        if 'order' in state:
+            # Straight away, so that requests finishing before the first pick move their pods back like they would have
+            with self._lock:
+                self._rebuild(self.api_server.GetEndPointsByLabel(self.deployment.deploymentLabel), state['order'])
+
+
+# Samples two pods at random and routes to whichever has fewer requests in flight. That costs the
+# same however many pods there are, and spreads load nearly as well as always picking the least
+# loaded pod. The samples are drawn from the RUNNING pods with spare cpu, which are kept in a
+# CandidatePods as requests start and finish (and pods start) rather than looked for on every pick.
+# Pods which crashed or stopped running since are dropped when they are drawn.
+# The order of the pods decides what the rng draws, so a checkpoint saves it along with the rng.
+class PowerOfTwoChoicesLoadBalancer(ILoadBalancer):
+    def __init__(self, api_server, deployment, batch=False):
+        super().__init__(api_server, deployment, batch)
+        # Seeded so that runs are repeatable
+        self.rng = random.Random(deployment.deploymentLabel)
+        self._lock = threading.Lock() # requests finish on the clock's thread
+        # Filled from candidates() on the first pick
+        self._available = None
+
+        deployment.capacity_listeners.append(self.started)
+
+    def route(self, pods):
+        return min(pods, key=outstanding_requests)
+
+    def next_pod(self, pods):
+        if not pods:
+            return None
+        return self.route([self.rng.choice(pods), self.rng.choice(pods)])
+
+    def started(self, pod):
+        with self._lock:
+            if self._available is None:
+                return
+            if self._is_available(pod):
+                if pod not in self._available:
+                    self._available.add(pod)
+            elif pod in self._available:
+                self._available.remove(pod)
+
+    def _is_available(self, pod) -> bool:
+        endpoint = self.api_server.GetEndPointForPod(pod)
+        return endpoint is not None and self.api_server.CheckEndPoint(endpoint) and pod.has_capacity()
+
+    def state(self):
+        with self._lock:
+            available = [pod.podName for pod in self._available] if self._available is not None else None
+        return {'rng': self.rng.getstate(), 'available': available}
+
+    def restore_state(self, state):
+        if 'rng' in state:
+            # JSON turns the state's tuples into lists
+            version, internal_state, gauss_next = state['rng']
+            self.rng.setstate((version, tuple(internal_state), gauss_next))
+        if state.get('available') is not None:
+            pods = {endpoint.pod.podName: endpoint.pod for endpoint in self.api_server.GetEndPointsByLabel(self.deployment.deploymentLabel)}
+            with self._lock:
+                self._available = CandidatePods([pods[name] for name in state['available'] if name in pods])
+
+    def pick(self):
+        with self._lock:
+            if self._available is None:
+                self._available = CandidatePods(self.candidates())
+
+            samples = []
+            while self._available and len(samples) < 2:
+                pod = self.rng.choice(self._available)
+                if self._is_available(pod):
+                    samples.append(pod)
+                else:
+                    self._available.remove(pod)
+
+        return self.route(samples) if samples else None
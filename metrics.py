@@ -1,39 +1,110 @@
-# import datetime.datetime
-from datetime import datetime
 import json
 import math
 import threading
 
-_records = []
-_START_TIME = datetime.now()
+from clock import WallClock
+from histogram import LatencyHistogram
+from metrics_sink import MemorySink
+
+_clock = WallClock()
+_sink = MemorySink()
+# 0 = silent, 1 = echo every record to the console
+_verbosity = 1
+
+# Request latency histograms, keyed by deployment label ('*' for every deployment) and then kind
+LATENCY_KINDS = ('queue', 'service', 'end_to_end')
+ALL_DEPLOYMENTS = '*'
+_histograms = {}
+_histograms_lock = threading.Lock()
 
 def _t_delta():
-    dt = datetime.now()
-    return math.floor((dt - _START_TIME).total_seconds())
+    return math.floor(_clock.now())
+
+
+def reset(clock=None, sink=None, verbosity: int = 1):
+    ''' Starts recording into a new sink (in memory by default) and restarts the clock. Pass a VirtualClock to record virtual time. '''
+    global _clock, _sink, _verbosity
+    _sink.close()
+    _clock = clock if clock is not None else WallClock()
+    _sink = sink if sink is not None else MemorySink()
+    _verbosity = verbosity
+    with _histograms_lock:
+        _histograms.clear()
 
 
 _empty_data = {}
 def _push(category, event, id, data=_empty_data):
-    current_thread = threading.current_thread()
     t = _t_delta()
 
-    _records.append({
+    _sink.write({
         **data,
         'category': category, # e.g. 'pod' or 'deployment'
         'event': event,       # e.g. 'started'
         'id': id,             # e.g. 'DEPLOYMENT_AD'
         # 'type': event_type,
-        'source': 'Simulator' if current_thread.name == 'MainThread' else current_thread.name,
+        'source': _clock.source(),
         't': t,
     })
 
-    stringified_data = '' if data is _empty_data else f' {json.dumps(data)}'
-    print(f'[t={t}\t] {category}.{event} @ {id}{stringified_data}')
+    if _verbosity > 0:
+        stringified_data = '' if data is _empty_data else f' {json.dumps(data)}'
+        print(f'[t={t}\t] {category}.{event} @ {id}{stringified_data}')
+
+
+def _push_many(records):
+    ''' Pushes (category, event, id, data) records in one write to the sink. '''
+    t = _t_delta()
+    source = _clock.source()
+    _sink.write_many([
+        {**data, 'category': category, 'event': event, 'id': id, 'source': source, 't': t}
+        for category, event, id, data in records
+    ])
+
+    if _verbosity > 0:
+        for category, event, id, data in records:
+            print(f'[t={t}\t] {category}.{event} @ {id} {json.dumps(data)}')
+
+
+def flush():
+    ''' Blocks until every record pushed so far has reached the sink's output. '''
+    _sink.flush()
+
 
+def dump():
+    ''' Records the latency summaries, then flushes and closes the sink. Records pushed afterwards are lost until the next reset. '''
+    for deployment_label, summaries in latency_summary().items():
+        for kind, summary in summaries.items():
+            _push('latency', kind, deployment_label, summary)
+    _sink.close()
 
-def dump(output_file):
-    with open(output_file, 'w') as fp:
-        fp.write(json.dumps(_records, indent=2, separators=(',', ': ')))
+
+def instrumentation(kind, name, summary):
+    ''' Summary of a lock or control loop statistic, see instrumentation.py. '''
+    _push('instrumentation', kind, name, summary)
+
+
+def _record_latency(deployment_label, kind, seconds):
+    with _histograms_lock:
+        _record_latency_locked(deployment_label, kind, seconds)
+
+def _record_latency_locked(deployment_label, kind, seconds):
+    for label in (ALL_DEPLOYMENTS, deployment_label):
+        histograms = _histograms.setdefault(label, {})
+        if kind not in histograms:
+            histograms[kind] = LatencyHistogram()
+        histograms[kind].record(seconds)
+
+
+def latency_summary(deployment_label=None):
+    ''' Latency statistics recorded so far: {deployment label: {kind: summary}}, or {kind: summary} for one deployment. '''
+    with _histograms_lock:
+        if deployment_label is not None:
+            return {kind: histogram.summary() for kind, histogram in _histograms.get(deployment_label, {}).items()}
+
+        return {
+            label: {kind: histogram.summary() for kind, histogram in histograms.items()}
+            for label, histograms in _histograms.items()
+        }
 
 
 # Deployment lifecycle
@@ -106,10 +177,22 @@ def pod_status(pod):
 #          |         |             |
 #          |         |---------------->failed
 #          |--> not_routed
-def request_created(request_id):
-    _push('request', 'created', request_id)
+#          |--> rejected (by the deployment's admission policy, on arrival or evicted from the queue later)
+# Requests are stamped with the (sub-second) clock time they were created and started at, which
+# feeds the queue (created -> started), service (started -> finished) and end-to-end latency histograms.
+def _request_finished(request):
+    now = _clock.now()
+    if request.started_at is not None:
+        _record_latency(request.deploymentLabel, 'service', now - request.started_at)
+    if request.created_at is not None:
+        _record_latency(request.deploymentLabel, 'end_to_end', now - request.created_at)
+
+def request_created(request):
+    request.created_at = _clock.now()
+    _push('request', 'created', request.request_id)
 
 def request_failed(pod, request):
+    _request_finished(request)
     _push('request', 'failed', request.request_id, {
         'pod': pod.podName,
     })
@@ -117,17 +200,41 @@ def request_failed(pod, request):
 def request_not_routed(request):
     _push('request', 'not_routed', request.request_id)
 
+def request_rejected(request):
+    _push('request', 'rejected', request.request_id, {
+        'deployment': request.deploymentLabel,
+    })
+
 def request_routed(pod, request):
     _push('request', 'routed', request.request_id, {
         'pod': pod.podName,
     })
 
 def request_started(pod, request):
+    request.started_at = _clock.now()
+    if request.created_at is not None:
+        _record_latency(request.deploymentLabel, 'queue', request.started_at - request.created_at)
     _push('request', 'started', request.request_id, {
         'pod': pod.podName,
     })
 
+def requests_dispatched(dispatched):
+    ''' request_routed and request_started for a batch of (pod, request) which have been started, recorded together. '''
+    now = _clock.now()
+    records = []
+    with _histograms_lock:
+        for pod, request in dispatched:
+            request.started_at = now
+            if request.created_at is not None:
+                _record_latency_locked(request.deploymentLabel, 'queue', now - request.created_at)
+
+            data = {'pod': pod.podName}
+            records.append(('request', 'routed', request.request_id, data))
+            records.append(('request', 'started', request.request_id, data))
+    _push_many(records)
+
 def request_success(pod, request):
+    _request_finished(request)
     _push('request', 'success', request.request_id, {
         'pod': pod.podName,
     })
@@ -0,0 +1,118 @@
+import gzip
+import json
+import queue
+import threading
+
+# Sinks receive every metrics record pushed by the simulator.
+# MemorySink keeps them in a list, which is handy for tests and small experiments.
+# JsonLinesSink streams them to disk as one JSON object per line. Records are buffered into batches
+# which a background writer thread serializes, so the simulator threads (often holding etcdLock)
+# only pay for a list append. The queue of batches is bounded: if the writer falls behind, pushing
+# blocks instead of letting memory grow without limit.
+# Records reach the file in the order they were written: a batch is queued under _order_lock, which is
+# taken before the buffer's lock is let go, so writers blocked on a full queue can't overtake each other.
+
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+
+    def write_many(self, records):
+        self.records.extend(records)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    def __init__(self, path: str, compress: bool = None, batch_size: int = 1024, max_batches: int = 64):
+        ''' Streams records to path. The file is gzipped if compress is set, or by default if path ends in .gz '''
+        if compress is None:
+            compress = path.endswith('.gz')
+
+        self.path = path
+        self.batch_size = batch_size
+
+        self._fp = gzip.open(path, 'wt') if compress else open(path, 'w')
+        self._closed = False
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._order_lock = threading.Lock()
+        self._batches = queue.Queue(maxsize=max_batches)
+        self._writer = threading.Thread(name='MetricsWriter', target=self._run, daemon=True)
+        self._writer.start()
+
+    def __repr__(self):
+        return f'<JsonLinesSink {self.path}>'
+
+    def write(self, record: dict):
+        with self._lock:
+            if self._closed:
+                # e.g. requests finishing after the simulation was shut down
+                return
+            self._buffer.append(record)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch = self._take_buffer()
+
+        self._put(batch)
+
+    def write_many(self, records):
+        ''' write() for a list of records, taking the lock once. '''
+        with self._lock:
+            if self._closed:
+                return
+            self._buffer.extend(records)
+            if len(self._buffer) < self.batch_size:
+                return
+            batch = self._take_buffer()
+
+        self._put(batch)
+
+    def flush(self):
+        ''' Blocks until every record written so far is on disk. '''
+        with self._lock:
+            batch = self._take_buffer()
+
+        self._put(batch)
+        self._batches.join()
+        self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self.flush()
+        self._batches.put(None)
+        self._writer.join()
+        self._fp.close()
+
+    def _take_buffer(self) -> list:
+        ''' Called with _lock held. Empties the buffer and takes _order_lock, which _put() lets go of. '''
+        batch, self._buffer = self._buffer, []
+        self._order_lock.acquire()
+        return batch
+
+    def _put(self, batch):
+        try:
+            if batch:
+                self._batches.put(batch)
+        finally:
+            self._order_lock.release()
+
+    def _run(self):
+        while True:
+            batch = self._batches.get()
+            try:
+                if batch is None:
+                    return
+                self._fp.write(''.join([json.dumps(record) + '\n' for record in batch]))
+            finally:
+                self._batches.task_done()
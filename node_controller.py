@@ -2,7 +2,10 @@ import threading
 import time
 
 from api_server import APIServer
+import config
+import instrumentation
 import metrics
+from watch import Informer
 
 # NodeController is a control loop that monitors the status of WorkerNode objects in the cluster and ensures that the EndPoint objects stored in etcd are up to date.
 # The NodeController will remove stale EndPoints and update to show changes in others
@@ -13,26 +16,46 @@ class NodeController:
         self.apiServer = APISERVER
         self.running = True
         self.time = LOOPTIME
+        self.informer = Informer(APISERVER, ('Pod',), config.controller_resync_period)
+        # Pod statuses are sampled for the metrics every LOOPTIME, failed pods are restarted as soon as they are seen
+        self.next_sample = APISERVER.clock.now()
 
     def __call__(self):
         print("NodeController start")
         while self.running:
+            self.informer.wait(self.work())
+        print("NodeContShutdown")
+
+    def stop(self):
+        self.running = False
+        self.informer.close()
+
+    @instrumentation.control_loop()
+    def work(self) -> float:
+        ''' Returns how long it can wait for the next change before running again. '''
+        # Check information on each WorkerNode in etcd
+        # Update EndPoints when they are no longer valid -- TODO what does that mean?
+        now = self.apiServer.clock.now()
+        if now >= self.next_sample:
+            # Reading from a snapshot, so nobody gets blocked while every pod reports its status
+            for endpoint in self.apiServer.GetEndPoints():
+                # print('[NodeController]', endpoint.pod.podName, endpoint.pod.status)
+                metrics.pod_status(endpoint.pod)
+            self.next_sample = now + self.time
+
+        # Restart failed pods
+        events, resync = self.informer.poll()
+        if resync:
+            failed = self.apiServer.GetPodsByStatus('FAILED')
+        else:
+            failed = [event.obj for event in events if event.type == 'MODIFIED' and event.obj.status == 'FAILED']
+
+        if failed:
             with self.apiServer.etcdLock:
-                # Check information on each WorkerNode in etcd
-                # Update EndPoints when they are no longer valid -- TODO what does that mean?
-
-                # Restart failed pods
-                for endpoint in self.apiServer.GetEndPoints():
-                    # print('[NodeController]', endpoint.pod.podName, endpoint.pod.status)
-                    metrics.pod_status(endpoint.pod)
-                    if endpoint.pod.status == 'FAILED':
+                for pod in failed:
+                    if pod.status == 'FAILED' and self.apiServer.GetEndPointForPod(pod) is not None:
                         # Restart this pod by marking it as PENDING
-                        # print(f'[NodeController] Marking failed pod as pending for rescheduling {endpoint.pod}')
-                        endpoint.pod.status = 'PENDING'
-                        self.apiServer.etcd.runningPodList.remove(endpoint.pod)
-                        self.apiServer.etcd.pendingPodList.append(endpoint.pod)
-
-                        metrics.pod_restart(endpoint.pod)
+                        # print(f'[NodeController] Marking failed pod as pending for rescheduling {pod}')
+                        self.apiServer.RestartPod(pod)
 
-            time.sleep(self.time)
-        print("NodeContShutdown")
+        return min(self.next_sample - now, self.informer.until_resync())
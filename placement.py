@@ -0,0 +1,135 @@
+from abc import ABCMeta, abstractmethod
+import bisect
+
+# Placement policies decide which WorkerNode the Scheduler puts a pod on.
+# Each policy keeps its own index of nodes by free cpu so that a placement costs O(log n) rather
+# than a scan over every node. The Scheduler calls refresh() with the current nodes at the start of
+# a pass (cheap when nothing changed) and update() whenever it changes a node's available_cpu.
+
+class IPlacementPolicy:
+    __metaclass__ = ABCMeta
+
+    def __init__(self):
+        # Insertion order of each node, used to break ties like the node list would
+        self._order = {}
+
+    def refresh(self, nodes):
+        for node in nodes:
+            if node not in self._order:
+                self._order[node] = len(self._order)
+            self.update(node)
+
+    @abstractmethod
+    def update(self, node): raise NotImplementedError
+
+    @abstractmethod
+    def pick(self, cpu: int): raise NotImplementedError
+
+
+class SortedPlacementPolicy(IPlacementPolicy):
+    ''' Keeps nodes in a list sorted by key(node), with ties broken by node order. '''
+
+    def __init__(self):
+        super().__init__()
+        self._entries = []
+        self._entry_for_node = {}
+
+    @abstractmethod
+    def key(self, node): raise NotImplementedError
+
+    def update(self, node):
+        entry = (self.key(node), self._order[node], node)
+        old_entry = self._entry_for_node.get(node)
+        if old_entry is not None:
+            if old_entry[:2] == entry[:2]:
+                return
+            # (key, order) sorts just before the full entry
+            del self._entries[bisect.bisect_left(self._entries, old_entry[:2])]
+
+        bisect.insort(self._entries, entry)
+        self._entry_for_node[node] = entry
+
+
+class FirstFitPlacement(IPlacementPolicy):
+    ''' The first node (in the order nodes were added) with enough free cpu.
+    Backed by a max segment tree over node order so the leftmost fit is found in O(log n). '''
+
+    def __init__(self):
+        super().__init__()
+        self._size = 1
+        self._tree = [-1] * 2
+        self._nodes = [None]
+
+    def update(self, node):
+        position = self._order[node]
+        if position >= self._size:
+            self._grow(position + 1)
+
+        i = position + self._size
+        if self._nodes[position] is node and self._tree[i] == node.available_cpu:
+            return
+
+        self._nodes[position] = node
+        self._tree[i] = node.available_cpu
+        i //= 2
+        while i >= 1:
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+            i //= 2
+
+    def _grow(self, size: int):
+        nodes = [node for node in self._nodes if node is not None]
+        while self._size < size:
+            self._size *= 2
+        self._tree = [-1] * (2 * self._size)
+        self._nodes = [None] * self._size
+        for node in nodes:
+            self.update(node)
+
+    def pick(self, cpu: int):
+        if self._tree[1] < cpu:
+            return None
+
+        i = 1
+        while i < self._size:
+            i = 2 * i if self._tree[2 * i] >= cpu else 2 * i + 1
+        return self._nodes[i - self._size]
+
+
+class BestFitPlacement(SortedPlacementPolicy):
+    ''' The node with the least free cpu that still fits the pod. Packs nodes tightly and keeps
+    large holes free for large pods. '''
+
+    def key(self, node):
+        return node.available_cpu
+
+    def pick(self, cpu: int):
+        i = bisect.bisect_left(self._entries, (cpu, -1))
+        if i < len(self._entries):
+            return self._entries[i][-1]
+
+
+class SpreadPlacement(SortedPlacementPolicy):
+    ''' Worst fit: the node with the most free cpu. Spreads pods evenly over the cluster. '''
+
+    def key(self, node):
+        return node.available_cpu
+
+    def pick(self, cpu: int):
+        if self._entries and self._entries[-1][0] >= cpu:
+            # Of the nodes with the most free cpu, take the first one added
+            i = bisect.bisect_left(self._entries, (self._entries[-1][0], -1))
+            return self._entries[i][-1]
+
+
+class MostAllocatedPlacement(SortedPlacementPolicy):
+    ''' The node with the highest share of its cpu already allocated that still fits the pod, like
+    the MostAllocated scoring strategy of kube-scheduler. Nodes are sorted by free share, so the
+    scan stops at the first node with enough free cpu. '''
+
+    def key(self, node):
+        return node.available_cpu / node.assigned_cpu if node.assigned_cpu else 1
+
+    def pick(self, cpu: int):
+        for _, _, node in self._entries:
+            if node.available_cpu >= cpu:
+                return node
@@ -1,5 +1,3 @@
-import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor
 import threading
 
 import metrics
@@ -11,18 +9,23 @@ from request import Request
 # available_cpu is how many cpu threads are currently available
 # deploymentLabel is the label of the Deployment that the Pod is managed by
 # status is a string that communicates the Pod's availability. ['PENDING','RUNNING', 'TERMINATING', 'FAILED']
-# the pool is the threads that are available for request handling on the pod
+# clock runs request completions. It is shared by every pod, so a request in flight costs a heap
+# entry rather than a thread: a WallClock in real time, or a VirtualClock in discrete-event mode.
+# on_capacity(pod, finished) is called whenever the pod frees up cpu, so load balancers can wait for
+# it, with the finished request if that's what freed it
 class Pod:
-    def __init__(self, NAME, ASSIGNED_CPU, DEPLABEL):
+    def __init__(self, NAME, ASSIGNED_CPU, DEPLABEL, clock, on_capacity=None):
         self.podName = NAME
         self.assigned_cpu = ASSIGNED_CPU
         self.available_cpu = ASSIGNED_CPU
         self.deploymentLabel = DEPLABEL
         self.status = 'PENDING'
-        self.crash = threading.Event()
-        self.pool = ThreadPoolExecutor(max_workers=ASSIGNED_CPU)
+        self.clock = clock
+        self.on_capacity = on_capacity
 
-        self._futures = []
+        self.lock = threading.Lock()
+        # Completion events of the requests in flight
+        self._scheduled = {}
 
     def __repr__(self):
         return f'<Pod {self.podName}>'
@@ -32,19 +35,60 @@ class Pod:
         return self.available_cpu > 0
 
     def is_running(self):
-        return not all([f.done() for f in self._futures])
+        return len(self._scheduled) > 0
 
-    def HandleRequest(self, request: Request):
-        def handler():
-            metrics.request_started(self, request)
+    def notify_capacity(self, finished: Request = None):
+        if self.on_capacity is not None:
+            self.on_capacity(self, finished)
+
+    def Crash(self):
+        # Every in-flight request fails straight away
+        with self.lock:
+            scheduled = self._scheduled
+            self._scheduled = {}
+            self.available_cpu += len(scheduled)
+
+        for request, event in scheduled.items():
+            event.cancel()
+            metrics.request_failed(self, request)
+
+    def HandleRequest(self, request: Request, record: bool = True) -> bool:
+        ''' Starts the request unless the pod is no longer RUNNING or has no cpu left, in which case it returns False.
+        Unless record is set, recording the start is left to the caller (see metrics.requests_dispatched). '''
+        with self.lock:
+            # Checked under the lock since load balancers pick pods from a snapshot without holding etcdLock
+            if self.status != 'RUNNING' or self.available_cpu <= 0:
+                return False
+
+            if record:
+                metrics.request_started(self, request)
 
             self.available_cpu -= 1
-            crashed = self.crash.wait(timeout=request.execTime)
-            self.available_cpu += 1
+            self._scheduled[request] = self.clock.call_later(
+                request.execTime,
+                self._finish,
+                request,
+                source=self.podName,
+            )
+        return True
+
+    def in_flight(self):
+        ''' (request, seconds until it finishes, the finishing event's place in the clock's queue) for every request in flight. '''
+        with self.lock:
+            now = self.clock.now()
+            return [(request, max(0, event.t - now), event.seq) for request, event in self._scheduled.items()]
 
-            if crashed:
-                metrics.request_failed(self, request)
-            else:
-                metrics.request_success(self, request)
+    def resume_request(self, request: Request, remaining: float):
+        ''' Carries on with a request restored from a checkpoint. available_cpu is expected to account for it already. '''
+        with self.lock:
+            self._scheduled[request] = self.clock.call_later(remaining, self._finish, request, source=self.podName)
+
+    def _finish(self, request: Request):
+        with self.lock:
+            if self._scheduled.pop(request, None) is None:
+                # Already failed by a crash
+                return
+            self.available_cpu += 1
 
-        self._futures.append(self.pool.submit(handler))
+        metrics.request_success(self, request)
+        self.notify_capacity(request)
@@ -1,8 +1,32 @@
 from collections import defaultdict
+import gzip
 import json
 import os
 from os.path import join as joinpath
 
+from metrics import ALL_DEPLOYMENTS
+
+# Keys of the percentiles in LatencyHistogram.summary(), and the percentile they stand for
+HISTOGRAM_PERCENTILES = (('p50', 50), ('p90', 90), ('p99', 99), ('p999', 99.9))
+
+def load_records(metrics_path):
+    ''' Reads a metrics file written as JSON Lines (optionally gzipped) or as a single JSON array. '''
+    opener = gzip.open if metrics_path.endswith('.gz') else open
+    with opener(metrics_path, 'rt') as fp:
+        first = fp.read(1)
+        while first.isspace():
+            first = fp.read(1)
+
+        if first == '[':
+            return json.loads(first + fp.read())
+
+        records = []
+        if first:
+            records.append(json.loads(first + fp.readline()))
+        records.extend([json.loads(line) for line in fp if line.strip()])
+        return records
+
+
 def find_all_names(data, category):
     names = set()
     for datum in data:
@@ -26,7 +50,19 @@ def select_events(data, selector: dict):
 
 class MetricsProcessor:
     def __init__(self, metrics_path = './metrics.json'):
-        self.data = json.loads(open(metrics_path, 'r').read())
+        self.metrics_path = metrics_path
+        self.data = []
+        # Latency histogram summaries written at the end of a run, keyed by deployment label then kind
+        self.latency = defaultdict(dict)
+        # Lock and control loop summaries (when the run was instrumented), keyed by kind then name
+        self.instrumentation = defaultdict(dict)
+        for datum in load_records(metrics_path):
+            if datum['category'] == 'latency':
+                self.latency[datum['id']][datum['event']] = datum
+            elif datum['category'] == 'instrumentation':
+                self.instrumentation[datum['event']][datum['id']] = datum
+            else:
+                self.data.append(datum)
         self.all_node_names = find_all_names(self.data, 'node')
         self.all_request_ids = find_all_names(self.data, 'request')
 
@@ -57,19 +93,19 @@ class MetricsProcessor:
             ['Request ID', 'Created At', 'Started At', 'Finished At', 'Success?'],
         ]
 
-        def find_event(events, event_type):
-            for event in events:
-                if event['event'] == event_type:
-                    return event
-            return None
+        # Request ids are not unique, so keep the first event of each type per id
+        events_by_id = defaultdict(dict)
+        for datum in self.data:
+            if datum['category'] == 'request':
+                events_by_id[datum['id']].setdefault(datum['event'], datum)
 
         for request_id in self.all_request_ids:
-            events = select_events(self.data, {'category': 'request', 'id': request_id})
+            events = events_by_id[request_id]
 
-            did_succeed = find_event(events, 'success') is not None
-            creation_event = find_event(events, 'created')
-            started_event = find_event(events, 'started') or {}
-            finished_event = find_event(events, 'success') or find_event(events, 'failed') or {}
+            did_succeed = 'success' in events
+            creation_event = events.get('created')
+            started_event = events.get('started') or {}
+            finished_event = events.get('success') or events.get('failed') or {}
 
             requests.append([request_id, creation_event['t'], started_event.get('t'), finished_event.get('t'), did_succeed])
 
@@ -92,41 +128,86 @@ class MetricsProcessor:
                 queue_latency += request_info[2] - request_info[1]
                 queue_latency_n += 1
 
+        # Counted over the same request ids as 'Request count'
+        rejected_ids = self.request_ids_with('rejected')
+        successful_ids = self.request_ids_with('success')
+
         return [
-            ['Average request latency', queue_latency / queue_latency_n],
+            ['Average request latency', queue_latency / queue_latency_n if queue_latency_n else 0],
             ['Error count', error_count],
-            ['Error rate (%)', error_count / len(requests_plot)],
+            ['Error rate (%)', error_count / len(requests_plot) if requests_plot else 0],
+            ['Rejected count', len(rejected_ids)],
+            ['Rejection rate (%)', len(rejected_ids) / len(self.all_request_ids) if self.all_request_ids else 0],
+            ['Goodput (successes/s)', len(successful_ids) / max_t],
             ['Request count', len(self.all_request_ids)],
             ['Requests/s', len(self.all_request_ids) / max_t],
             ['Run time', max_t],
+            *self.latency_percentiles(),
         ]
 
+    def request_ids_with(self, event):
+        ''' The ids in all_request_ids which have an event of the given kind. '''
+        return {datum['id'] for datum in self.data if datum['category'] == 'request' and datum['event'] == event} & self.all_request_ids
+
+    def latency_percentiles(self):
+        ''' Request latency percentiles, from the histograms dumped at the end of the run: for every
+        deployment together, then for each one. Metrics files without them fall back to the 1s resolution
+        of the records' t, and leave the percentiles out when numpy isn't installed. '''
+        if self.latency:
+            return self.histogram_percentiles()
+
+        try:
+            from columnar_metrics import ColumnarMetrics
+        except ImportError:
+            return []
+
+        percentiles = ColumnarMetrics.from_records(self.data).latency_percentiles()
+        rows = []
+        for name, label in (('queue', 'Queue latency'), ('end_to_end', 'End-to-end latency')):
+            for p, value in percentiles[name].items():
+                rows.append([f'{label} p{p:g}', value])
+        return rows
+
+    def histogram_percentiles(self):
+        rows = []
+        # Every deployment ('*') first
+        labels = sorted(self.latency, key=lambda label: (label != ALL_DEPLOYMENTS, label))
+        for deployment_label in labels:
+            suffix = '' if deployment_label == ALL_DEPLOYMENTS else f' ({deployment_label})'
+            for kind, name in (('queue', 'Queue latency'), ('service', 'Service latency'), ('end_to_end', 'End-to-end latency')):
+                summary = self.latency[deployment_label].get(kind)
+                if summary is None:
+                    continue
+                for key, p in HISTOGRAM_PERCENTILES:
+                    rows.append([f'{name} p{p:g}{suffix}', summary[key]])
+        return rows
+
+    def instrumentation_table(self):
+        ''' The lock and control loop stats of an instrumented run (see instrumentation.py), the most
+        time spent first. Durations are in ms, except loop.lag which is in clock seconds. '''
+        rows = [['Kind', 'Name', 'Count', 'Total', 'Mean', 'p50', 'p99', 'Max']]
+        stats = [(kind, name, summary) for kind, by_name in self.instrumentation.items() for name, summary in by_name.items()]
+        stats.sort(key=lambda row: row[2]['count'] * row[2]['mean'], reverse=True)
+        for kind, name, summary in stats:
+            scale = 1 if kind == 'loop.lag' else 1e3
+            rows.append([
+                kind, name, summary['count'], summary['count'] * summary['mean'] * scale,
+                *[summary[key] * scale for key in ('mean', 'p50', 'p99', 'max')],
+            ])
+        return rows
+
     def deployment_distance(self):
         rows = [['t', 'Distance', 'Current', 'Expected', 'Dep #']]
-        seen_t_values = set()
-        for row in self.data:
-            t = row['t']
-            if t in seen_t_values: continue
-            seen_t_values.add(t)
-
-            dep_count = 0
-            current_count = 0
-            expected_count = 0
-
-            seen_dep_names = set()
-            for row2 in self.data:
-                if row2['category'] != 'deployment': continue
-                if row2['id'] in seen_dep_names: continue
-                if row2['t'] < t: continue
-                if row2['t'] > t: break
-
-                if row2['event'] == 'created' or row2['event'] == 'replicas':
-                    dep_count += 1
-                    current_count += row2['current']
-                    expected_count += row2['expected']
-                    seen_dep_names.add(row2['id'])
-
-            rows.append([t, expected_count - current_count, current_count, expected_count, dep_count])
+
+        # The first replica count reported by each deployment at each t
+        replicas_at = first_events_by_t(self.data, 'deployment', ('created', 'replicas'))
+
+        for t in distinct_t_values(self.data):
+            deployments = replicas_at.get(t, {}).values()
+            current_count = sum([row['current'] for row in deployments])
+            expected_count = sum([row['expected'] for row in deployments])
+
+            rows.append([t, expected_count - current_count, current_count, expected_count, len(deployments)])
 
         return rows
 
@@ -171,34 +252,32 @@ class MetricsProcessor:
 
     def pod_usage(self):
         rows = [['t', 'CPU Usage (% of total)']]
-        seen_t_values = set()
-        for row in self.data:
-            t = row['t']
-            if t in seen_t_values: continue
-            seen_t_values.add(t)
-
-            assigned_cpu = 0
-            available_cpu = 0
-            pod_count = 0
-
-            seen_pod_names = set()
-            for row2 in self.data:
-                if row2['category'] != 'pod': continue
-                if row2['id'] in seen_pod_names: continue
-                if row2['t'] < t: continue
-                if row2['t'] > t: break
-
-                if row2['event'] == 'status':
-                    assigned_cpu += row2['assigned_cpu']
-                    available_cpu += row2['available_cpu']
-                    pod_count += 1
-                    seen_pod_names.add(row2['id'])
+
+        # The first status reported by each pod at each t
+        status_at = first_events_by_t(self.data, 'pod', ('status',))
+
+        for t in distinct_t_values(self.data):
+            pods = status_at.get(t, {}).values()
+            assigned_cpu = sum([row['assigned_cpu'] for row in pods])
+            available_cpu = sum([row['available_cpu'] for row in pods])
 
             if assigned_cpu > 0:
                 rows.append([t, (assigned_cpu - available_cpu) / assigned_cpu])
 
         return rows
 
+def distinct_t_values(data):
+    ''' Every t value in the order it first appears. '''
+    return dict.fromkeys([datum['t'] for datum in data]).keys()
+
+def first_events_by_t(data, category, events):
+    ''' Maps t -> id -> the first record of the given category and events with that t and id. '''
+    by_t = defaultdict(dict)
+    for datum in data:
+        if datum['category'] == category and datum['event'] in events:
+            by_t[datum['t']].setdefault(datum['id'], datum)
+    return by_t
+
 def format_row(row):
     s = []
     for col in row:
@@ -256,6 +335,7 @@ def process_many(file_paths, output_dir: str = 'stats'):
 
     with open(joinpath(output_dir, 'reqs_summary'), 'w') as fp:
         for p in processors:
+            fp.write(f'{p.metrics_path}\n')
             for key, val in p.requests_summary():
                 fp.write(f'{key}\t\t{val}\n')
             fp.write('\n\n')
@@ -285,6 +365,11 @@ def process_one(file_path: str = './metrics.json', output_dir: str = 'stats'):
         for key, val in processor.requests_summary():
             fp.write(f'{key}\t\t{val}\n')
 
+    if processor.instrumentation:
+        with open(joinpath(output_dir, 'instrumentation.csv'), 'w') as fp:
+            for row in processor.instrumentation_table():
+                fp.write(format_row(row))
+
 
 if __name__ == '__main__':
     process_one()
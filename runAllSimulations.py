@@ -1,15 +1,131 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import functools
+import os
+import sys
+import tempfile
+
+import config
+from load_balancing import (
+    LeastOutstandingRequestsLoadBalancer,
+    PowerOfTwoChoicesLoadBalancer,
+    RoundRobinLoadBalancer,
+    UtilizationAwareLoadBalancer,
+)
 from process_metrics import process_many
+from run_cache import RunCache
 from runSimulation import main
 
+# Runs a batch of scenarios side by side on a process pool and processes their metrics together.
+# Every run gets a fresh worker process (max_tasks_per_child=1), so the metrics module globals,
+# the config overrides of one scenario and the clock threads of a real time run can't leak into
+# another. Each run writes its own metrics file, HPA log and console log.
+# Given a cache_dir, runs and reports which have been made before from the same traces, config and
+# simulator code are copied out of a RunCache instead of being redone.
+
+class Scenario:
+    def __init__(self, trace_file, metrics_file, config=None, virtual_time=False, hpa_file=None, log_file=None, restore_file=None):
+        ''' config maps names in config.py to the values this run should use instead. With a restore_file
+        the run starts from that checkpoint of the trace (see checkpoint.py), which needs virtual_time. '''
+        base_path = os.path.splitext(metrics_file)[0]
+
+        self.trace_file = trace_file
+        self.metrics_file = metrics_file
+        self.config = config or {}
+        self.virtual_time = virtual_time
+        self.hpa_file = hpa_file or base_path + '_hpa.csv'
+        self.log_file = log_file or base_path + '.log'
+        self.restore_file = restore_file
+
+    def __repr__(self):
+        return f'<Scenario {self.trace_file} -> {self.metrics_file}>'
+
+
+def run_scenario(scenario: Scenario) -> str:
+    ''' Runs a single scenario in this process and returns its metrics file. '''
+    saved = {name: getattr(config, name) for name in scenario.config}
+    try:
+        for name, value in scenario.config.items():
+            setattr(config, name, value)
+
+        with open(scenario.log_file, 'w') as log, contextlib.redirect_stdout(log):
+            main(scenario.trace_file, scenario.metrics_file, scenario.virtual_time, scenario.hpa_file, restore_file=scenario.restore_file)
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+    return scenario.metrics_file
+
+
+def run_cached(scenario: Scenario, cache_dir: str) -> str:
+    ''' run_scenario, unless the RunCache in cache_dir already has the outputs of the same run. '''
+    cache = RunCache(cache_dir)
+    key = cache.run_key(scenario)
+    if key is not None and cache.fetch_run(key, scenario):
+        return scenario.metrics_file
+
+    run_scenario(scenario)
+    if key is not None:
+        cache.store_run(key, scenario)
+    return scenario.metrics_file
+
+
+def run_all(scenarios, output_dir: str = 'stats_batched', max_workers: int = None, cache_dir: str = None):
+    ''' Runs every scenario in parallel, then writes the combined reports to output_dir. Returns the metrics files in scenario order. '''
+    run = run_scenario if cache_dir is None else functools.partial(run_cached, cache_dir=cache_dir)
+    max_workers = max_workers or min(len(scenarios), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1) as pool:
+        metric_files = list(pool.map(run, scenarios))
+
+    if cache_dir is None:
+        process_many(metric_files, output_dir)
+        return metric_files
+
+    cache = RunCache(cache_dir)
+    key = cache.reports_key(metric_files)
+    if not cache.fetch_reports(key, output_dir):
+        # Made on the side so that nothing else in output_dir ends up in the cache
+        with tempfile.TemporaryDirectory() as staging:
+            process_many(metric_files, staging)
+            cache.store_reports(key, staging)
+        cache.fetch_reports(key, output_dir)
+    return metric_files
+
+
 scenarios = (
-    ('tracefiles/1.txt', 'metrics_1.json'),
-    ('tracefiles/2.txt', 'metrics_2.json'),
-    ('tracefiles/3.txt', 'metrics_3.json'),
+    Scenario('tracefiles/1.txt', 'metrics_1.json'),
+    Scenario('tracefiles/2.txt', 'metrics_2.json'),
+    Scenario('tracefiles/3.txt', 'metrics_3.json'),
 )
 
-for (tracefile_path, metrics_path) in scenarios:
-    main(tracefile_path, metrics_path)
-    # metrics_data.append(process(metrics_path))
+def load_balancer_scenarios(trace_files, load_balancers):
+    ''' A scenario for every trace under every load balancer, to compare their latency percentiles side by side. '''
+    return [
+        Scenario(
+            trace_file,
+            f'metrics_{os.path.splitext(os.path.basename(trace_file))[0]}_{load_balancer.__name__}.json',
+            config={'load_balancer': load_balancer},
+        )
+        for trace_file in trace_files
+        for load_balancer in load_balancers
+    ]
+
+
+if __name__ == '__main__':
+    if '--compare-load-balancers' in sys.argv[1:]:
+        scenarios = load_balancer_scenarios(
+            [scenario.trace_file for scenario in scenarios],
+            [
+                RoundRobinLoadBalancer,
+                UtilizationAwareLoadBalancer,
+                LeastOutstandingRequestsLoadBalancer,
+                PowerOfTwoChoicesLoadBalancer,
+            ],
+        )
+
+    virtual_time = '--virtual-time' in sys.argv[1:]
+    for scenario in scenarios:
+        scenario.virtual_time = virtual_time
 
-metric_files = [x[1] for x in scenarios]
-process_many(metric_files, 'stats_batched')
+    # Outputs are reused from run_cache/ unless the traces, config or code changed
+    run_all(scenarios, cache_dir=None if '--no-cache' in sys.argv[1:] else 'run_cache')
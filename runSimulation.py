@@ -1,12 +1,20 @@
+import itertools
 import math
+import os
+import sys
 import threading
 import time
 
+import checkpoint
+import instrumentation
 import metrics
 from request import Request
-from autoscalers import HPA
+from autoscalers import HPA, AutoscalerManager
+from binary_trace import read_trace
 from dep_controller import DepController
+from metrics_sink import JsonLinesSink
 from api_server import APIServer
+from clock import VirtualClock, WallClock
 from node_controller import NodeController
 from scheduler import Scheduler
 
@@ -23,6 +31,8 @@ def get_hpa_stats(api, hpas):
                 continue
 
             dep = api.GetDeploymentByLabel(hpa.deployment_label)
+            if dep is None:
+                continue
 
             def get_handled_reqs(pod):
                 return pod.assigned_cpu - pod.available_cpu
@@ -45,81 +55,104 @@ def get_hpa_stats(api, hpas):
 
     return stats
 
+# HpaLog streams the rows of get_hpa_stats to the HPA csv as they are measured, so a long trace
+# doesn't keep them all in memory. The file is the header followed by the rows, one per line.
+class HpaLog:
+    HEADER = 't,Deployment,MV,SP,Current,Expected,Req#(Pending),Req#(Handling)'
+
+    def __init__(self, path):
+        self._fp = open(path, 'w')
+        self._fp.write(self.HEADER)
+
+    def extend(self, rows):
+        for row in rows:
+            self._fp.write('\n' + row)
+
+    def close(self):
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 # This is the simulation frontend that will interact with your APIServer to change cluster configurations and handle requests
 # All building files are guidelines, and you are welcome to change them as much as desired so long as the required functionality is still implemented.
 
-def main(
-    instructions_file = './instructions.txt',
-    metrics_file = './metrics.json',
-):
-    _nodeCtlLoop = 2
-    _depCtlLoop = 2
-    _hpaCtlLoop = 2
-    _scheduleCtlLoop = 2
+_nodeCtlLoop = 2
+_depCtlLoop = 2
+_hpaCtlLoop = 2
+_scheduleCtlLoop = 2
+
+# run_command applies a single trace command to the cluster and returns the number of seconds
+# to sleep before the next one. Load balancers and HPAs are handed to the given callbacks so
+# that the caller decides whether they run on threads or on the virtual clock.
+# Only the commands which change nodes, deployments or pods take etcdLock: requests only touch their
+# deployment's queue, which has its own lock.
+def run_command(apiServer, cmdAttributes, start_load_balancer, start_hpa):
+    time_to_sleep = 0 # in seconds
+
+    if cmdAttributes[0] == 'ReqIn':
+        apiServer.PushReq(cmdAttributes[1:])
+    elif cmdAttributes[0] == 'Sleep':
+        time_to_sleep += int(cmdAttributes[1])
+    elif cmdAttributes[0] == 'Deploy':
+        with apiServer.etcdLock:
+            deployment = apiServer.CreateDeployment(cmdAttributes[1:])
+        start_load_balancer(config.load_balancer(apiServer, deployment, config.batch_dispatch))
+    elif cmdAttributes[0] == 'AddNode':
+        with apiServer.etcdLock:
+            apiServer.CreateWorker(cmdAttributes[1:])
+    elif cmdAttributes[0] == 'CrashPod':
+        with apiServer.etcdLock:
+            apiServer.CrashPod(cmdAttributes[1])
+    elif cmdAttributes[0] == 'DeleteDeployment':
+        with apiServer.etcdLock:
+            apiServer.RemoveDeployment(cmdAttributes[1])
+    elif cmdAttributes[0] == 'CreateHPA':
+        # The autoscaler has its own lock for its HPAs
+        start_hpa(HPA(apiServer, _hpaCtlLoop, cmdAttributes[1:]))
+
+    return time_to_sleep
 
+def run_threaded(apiServer, commands, hpa_log):
     disposables = []
     hpas = []
-    hpa_log = ['t,Deployment,MV,SP,Current,Expected,Req#(Pending),Req#(Handling)']
 
-    apiServer = APIServer()
     depController = DepController(apiServer, _depCtlLoop)
     nodeController = NodeController(apiServer, _nodeCtlLoop)
     scheduler = Scheduler(apiServer, _scheduleCtlLoop)
+    autoscaler = AutoscalerManager(apiServer, _hpaCtlLoop)
     depControllerThread = threading.Thread(name='DeploymentController', target=depController)
     nodeControllerThread = threading.Thread(name='NodeController', target=nodeController)
     schedulerThread = threading.Thread(name='Scheduler', target=scheduler)
+    autoscalerThread = threading.Thread(name='Autoscaler', target=autoscaler)
     print('Threads Starting')
     nodeControllerThread.start()
     depControllerThread.start()
     schedulerThread.start()
-    print('ReadingFile')
+    autoscalerThread.start()
 
-    with open(instructions_file, 'r') as fp:
-        commands = fp.readlines()
+    def start_load_balancer(load_balancer):
+        load_balancer_thread = threading.Thread(name=f'LoadBalancer({load_balancer.deployment.deploymentLabel})', target=load_balancer)
 
-    for command in commands:
-        cmdAttributes = command.split()
+        def cleanup():
+            load_balancer.stop()
+            load_balancer_thread.join()
 
-        time_to_sleep = 0 # in seconds
+        load_balancer_thread.start()
+        disposables.append(cleanup)
 
-        with apiServer.etcdLock:
-            if cmdAttributes[0] == 'Deploy':
-                deployment = apiServer.CreateDeployment(cmdAttributes[1:])
-
-                load_balancer = config.load_balancer(apiServer, deployment)
-                load_balancer_thread = threading.Thread(target=load_balancer)
-
-                def cleanup():
-                    load_balancer.running = False
-                    load_balancer.deployment.waiting.set()
-                    load_balancer_thread.join()
-
-                load_balancer_thread.start()
-                disposables.append(cleanup)
-            elif cmdAttributes[0] == 'AddNode':
-                apiServer.CreateWorker(cmdAttributes[1:])
-            elif cmdAttributes[0] == 'CrashPod':
-                apiServer.CrashPod(cmdAttributes[1])
-            elif cmdAttributes[0] == 'DeleteDeployment':
-                apiServer.RemoveDeployment(cmdAttributes[1])
-            elif cmdAttributes[0] == 'ReqIn':
-                apiServer.PushReq(cmdAttributes[1:])
-            elif cmdAttributes[0] == 'CreateHPA':
-                hpa = HPA(apiServer, _hpaCtlLoop, cmdAttributes[1:])
-                hpa_thread = threading.Thread(target=hpa)
-
-                def cleanup():
-                    hpa.running = False
-                    hpa_thread.join()
-
-                hpas.append(hpa)
-                hpa_thread.start()
-                disposables.append(cleanup)
-            elif cmdAttributes[0] == 'Sleep':
-                time_to_sleep += int(cmdAttributes[1])
+    def start_hpa(hpa):
+        hpas.append(hpa)
+        autoscaler.add(hpa)
+
+    for command in commands:
+        time_to_sleep = run_command(apiServer, command, start_load_balancer, start_hpa)
 
         # Get hpa measurements
-        hpa_log += get_hpa_stats(apiServer, hpas)
+        hpa_log.extend(get_hpa_stats(apiServer, hpas))
         time.sleep(time_to_sleep)
     time.sleep(5)
     print('Shutting down threads')
@@ -127,17 +160,223 @@ def main(
     for dispose in disposables:
         dispose()
 
-    depController.running = False
-    scheduler.running = False
-    nodeController.running = False
+    depController.stop()
+    scheduler.stop()
+    nodeController.stop()
+    autoscaler.stop()
     depControllerThread.join()
     schedulerThread.join()
     nodeControllerThread.join()
+    autoscalerThread.join()
+
+# run_discrete plays the trace on a VirtualClock. Controllers, HPAs, trace commands and request
+# completions are all events on the clock, so Sleep commands and control loop intervals cost
+# nothing and the whole trace runs as fast as the events can be processed.
+# Controllers run as soon as their watch sees a change, or when the delay they asked for is up.
+# When restoring from a checkpoint, apiServer already holds the cluster, restored_hpas carry on
+# autoscaling it, cursor is the number of commands the trace had played (commands starts after them)
+# and restored_state is the checkpoint itself.
+# If checkpoint_at is given, a checkpoint is saved to checkpoint_file when the clock gets to that time.
+def run_discrete(apiServer, clock, commands, hpa_log, restored_hpas = (), cursor = 0, checkpoint_at = None, checkpoint_file = None, restored_state = None):
+    load_balancers = []
+    hpas = []
+
+    # Runs work after the delay it last returned (never, for None), or sooner if schedule is called
+    # with a shorter delay. Returns schedule.
+    def reactor(work, source):
+        next_run = None
+
+        def run():
+            nonlocal next_run
+            next_run = None
+            schedule(work())
+
+        def schedule(delay):
+            nonlocal next_run
+            if delay is None:
+                return
+            if next_run is not None:
+                if next_run.t <= clock.now() + delay:
+                    return
+                next_run.cancel()
+            next_run = clock.call_later(delay, run, source=source)
+
+        return schedule
+
+    def react(controller, source):
+        schedule = reactor(controller.work, source)
+        controller.informer.watch.on_event = lambda event: schedule(0)
+        schedule(0)
+
+    react(NodeController(apiServer, _nodeCtlLoop), 'NodeController')
+    react(DepController(apiServer, _depCtlLoop), 'DeploymentController')
+    react(Scheduler(apiServer, _scheduleCtlLoop), 'Scheduler')
+
+    # Load balancers of deployments which got requests or capacity since they were last dispatched.
+    # A dict, so that they are dispatched in the order they changed in.
+    dirty = {}
+
+    def start_load_balancer(load_balancer):
+        load_balancers.append(load_balancer)
+
+        def mark_dirty():
+            dirty[load_balancer] = None
+
+        load_balancer.deployment.on_changed = mark_dirty
+        mark_dirty()
+
+    autoscaler = AutoscalerManager(apiServer, _hpaCtlLoop)
+    schedule_autoscaler = reactor(autoscaler.work, 'Autoscaler')
+
+    def start_hpa(hpa):
+        hpas.append(hpa)
+        autoscaler.add(hpa)
+        schedule_autoscaler(config.autoscale_warmup_time)
+
+    # Deployments restored from a checkpoint need their load balancers and HPAs back
+    for deployment in apiServer.GetDeployments():
+        load_balancer = config.load_balancer(apiServer, deployment, config.batch_dispatch)
+        checkpoint.restore_load_balancer(restored_state, load_balancer)
+        start_load_balancer(load_balancer)
+    for hpa in restored_hpas:
+        hpas.append(hpa)
+        autoscaler.resume(hpa)
+    if restored_hpas:
+        schedule_autoscaler(max(0, min([hpa.next_run for hpa in restored_hpas]) - clock.now()))
+
+    # Requests are routed once every event has been handled, which is when pods may have
+    # freed up or new requests may have arrived. Only deployments which changed are looked at, so an
+    # event costs the same however many deployments there are.
+    def dispatch_requests():
+        while dirty:
+            load_balancer = next(iter(dirty))
+            del dirty[load_balancer]
+            while load_balancer.ready() and load_balancer.step():
+                pass
+
+    clock.after_event(dispatch_requests)
+
+    pending_commands = iter(commands)
+    played = cursor
+    # The event which plays the next command, or stops the run once the trace is done
+    trace_event = None
+    trace_done = False
+
+    def save_checkpoint():
+        nonlocal checkpoint_at
+        state = checkpoint.capture(apiServer, hpas, played, trace_event, trace_done, load_balancers)
+        checkpoint.save(state, checkpoint_file)
+        print(f'Checkpoint of t={clock.now()} saved to {checkpoint_file}')
+        checkpoint_at = None
+
+    def play():
+        nonlocal played, trace_event, trace_done
+        for command in pending_commands:
+            played += 1
+            time_to_sleep = run_command(apiServer, command, start_load_balancer, start_hpa)
+
+            # Get hpa measurements
+            hpa_log.extend(get_hpa_stats(apiServer, hpas))
+            if time_to_sleep:
+                trace_event = clock.call_later(time_to_sleep, play)
+                return
+
+        trace_done = True
+        trace_event = clock.call_later(5, clock.stop)
+
+    # Scheduled first, so that the checkpoint comes before anything else due at the same time
+    if checkpoint_at is not None:
+        clock.call_at(max(checkpoint_at, clock.now()), save_checkpoint)
+    if restored_state is not None:
+        trace_event = checkpoint.resume(restored_state, apiServer, play)
+        trace_done = restored_state['trace_event'] is not None and restored_state['trace_event']['done']
+    else:
+        trace_event = clock.call_later(0, play)
+    clock.run()
+    if checkpoint_at is not None:
+        print(f'WARNING: no checkpoint saved, the run ended at t={clock.now()} before reaching t={checkpoint_at}')
+
+# Prints the instrumentation report every interval seconds until the returned function is called
+def start_reports(clock, interval):
+    reporting = True
+
+    def print_report():
+        if reporting:
+            print(instrumentation.report())
+            clock.call_later(interval, print_report, source='Instrumentation')
+
+    def stop():
+        nonlocal reporting
+        reporting = False
+
+    clock.call_later(interval, print_report, source='Instrumentation')
+    return stop
+
+def main(
+    instructions_file = './instructions.txt',
+    metrics_file = './metrics.json',
+    virtual_time = False,
+    hpa_file = './hpa.csv',
+    checkpoint_at = None,
+    checkpoint_file = './checkpoint.json',
+    restore_file = None,
+):
+    ''' Plays a trace. In virtual time the run can save a checkpoint once the trace reaches checkpoint_at
+    seconds, or start from one saved earlier (from the same trace) instead of from the beginning. '''
+    if not virtual_time and (checkpoint_at is not None or restore_file is not None):
+        raise ValueError('Checkpoints need virtual_time')
+
+    state = checkpoint.load(restore_file) if restore_file is not None else None
+    clock = VirtualClock(state['t'] if state is not None else 0.0) if virtual_time else WallClock()
+    metrics.reset(clock, JsonLinesSink(metrics_file), config.metrics_verbosity)
+    instrumentation.reset(clock, config.instrumentation)
+    stop_reports = None
+    if config.instrumentation and config.instrumentation_report_interval:
+        stop_reports = start_reports(clock, config.instrumentation_report_interval)
+
+    print('ReadingFile')
+
+    # Streamed, so the trace never has to fit in memory. Compiled traces (see binary_trace.py) are memory mapped.
+    # Instead of a path, instructions_file can be an iterable of commands, e.g. from TraceFileGenerator.generate_trace
+    if state is not None:
+        apiServer, restored_hpas, cursor = checkpoint.restore(state, clock)
+    else:
+        apiServer = APIServer(clock)
+        restored_hpas, cursor = [], 0
+
+    # A restored run starts after the commands the checkpoint had played
+    if isinstance(instructions_file, (str, os.PathLike)):
+        commands = read_trace(instructions_file, skip=cursor)
+    else:
+        commands = itertools.islice(instructions_file, cursor, None)
+
+    with HpaLog(hpa_file) as hpa_log:
+        if virtual_time:
+            run_discrete(apiServer, clock, commands, hpa_log, restored_hpas, cursor, checkpoint_at, checkpoint_file, state)
+        else:
+            run_threaded(apiServer, commands, hpa_log)
 
     print('Recording metrics...')
-    metrics.dump(metrics_file)
-    with open('./hpa.csv', 'w') as fp:
-        fp.write('\n'.join(hpa_log))
+    if stop_reports is not None:
+        stop_reports()
+    if config.instrumentation:
+        print(instrumentation.report())
+        instrumentation.dump()
+    metrics.dump()
 
 if __name__ == '__main__':
-    main()
+    if '--quiet' in sys.argv[1:]:
+        config.metrics_verbosity = 0
+    if '--instrument' in sys.argv[1:]:
+        config.instrumentation = True
+
+    # --checkpoint-at SECONDS saves ./checkpoint.json when the trace gets there, --restore FILE starts from one
+    def option(name):
+        return sys.argv[sys.argv.index(name) + 1] if name in sys.argv[1:] else None
+    checkpoint_at = option('--checkpoint-at')
+
+    main(
+        virtual_time='--virtual-time' in sys.argv[1:],
+        checkpoint_at=float(checkpoint_at) if checkpoint_at is not None else None,
+        restore_file=option('--restore'),
+    )
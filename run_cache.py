@@ -0,0 +1,136 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import types
+
+import config
+
+# A content-addressed cache of simulation outputs.
+# A run is keyed by a fingerprint of everything that decides its outcome: the bytes of the trace
+# (and of the checkpoint it starts from, if any), the effective configuration (config.py with the
+# scenario's overrides applied), whether it ran in virtual time, and the simulator version (a hash
+# of the simulator's source files, so editing the code invalidates every entry). Its metrics file,
+# HPA log and console log are stored under that key.
+# Reports derived by process_metrics are cached the same way, keyed by the metrics files they were
+# made from (their paths and contents).
+#
+#   <root>/runs/<key>/     metrics.json, hpa.csv, run.log
+#   <root>/reports/<key>/  whatever process_many wrote
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@functools.lru_cache(maxsize=None)
+def simulator_version() -> str:
+    ''' Hash of the simulator's source files. '''
+    digest = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(SOURCE_DIR, '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _config_value(value):
+    # Strategies are classes, which are named rather than serialized
+    if isinstance(value, type):
+        return f'{value.__module__}.{value.__qualname__}'
+    return value
+
+
+def effective_config(overrides: dict = None) -> dict:
+    ''' The values in config.py, with overrides applied. '''
+    values = {
+        name: value for name, value in vars(config).items()
+        if not name.startswith('_') and not isinstance(value, (types.ModuleType, types.FunctionType))
+    }
+    values.update(overrides or {})
+    return {name: _config_value(value) for name, value in sorted(values.items())}
+
+
+def _fingerprint(document: dict) -> str:
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class RunCache:
+    RUN_FILES = ('metrics.json', 'hpa.csv', 'run.log')
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def __repr__(self):
+        return f'<RunCache {self.root}>'
+
+    def run_key(self, scenario):
+        ''' The key of a Scenario's outputs, or None if its trace isn't a file and so can't be fingerprinted. '''
+        if not isinstance(scenario.trace_file, (str, os.PathLike)):
+            return None
+        return _fingerprint({
+            'trace': file_hash(scenario.trace_file),
+            'restore': file_hash(scenario.restore_file) if scenario.restore_file is not None else None,
+            'config': effective_config(scenario.config),
+            'virtual_time': scenario.virtual_time,
+            'version': simulator_version(),
+        })
+
+    def fetch_run(self, key: str, scenario) -> bool:
+        ''' Copies a cached run's outputs to where the scenario would have written them. Returns False on a miss. '''
+        entry = os.path.join(self.root, 'runs', key)
+        if not os.path.isdir(entry):
+            return False
+        for name, destination in zip(self.RUN_FILES, (scenario.metrics_file, scenario.hpa_file, scenario.log_file)):
+            shutil.copyfile(os.path.join(entry, name), destination)
+        return True
+
+    def store_run(self, key: str, scenario):
+        self._store(os.path.join(self.root, 'runs', key), zip(self.RUN_FILES, (scenario.metrics_file, scenario.hpa_file, scenario.log_file)))
+
+    def reports_key(self, metric_files) -> str:
+        ''' The key of the reports made from metric_files. The reports name the files, so their paths count too. '''
+        return _fingerprint({
+            'metrics': [[path, file_hash(path)] for path in metric_files],
+            'version': simulator_version(),
+        })
+
+    def fetch_reports(self, key: str, output_dir: str) -> bool:
+        entry = os.path.join(self.root, 'reports', key)
+        if not os.path.isdir(entry):
+            return False
+        os.makedirs(output_dir, exist_ok=True)
+        for name in os.listdir(entry):
+            shutil.copyfile(os.path.join(entry, name), os.path.join(output_dir, name))
+        return True
+
+    def store_reports(self, key: str, output_dir: str):
+        self._store(
+            os.path.join(self.root, 'reports', key),
+            [(name, os.path.join(output_dir, name)) for name in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, name))],
+        )
+
+    def _store(self, entry: str, files):
+        ''' Copies (name, path) files into entry. The entry only appears once complete, so concurrent or interrupted runs never leave half of one. '''
+        if os.path.isdir(entry):
+            return
+        parent = os.path.dirname(entry)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=parent)
+        try:
+            for name, path in files:
+                shutil.copyfile(path, os.path.join(staging, name))
+            os.rename(staging, entry)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
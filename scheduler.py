@@ -2,49 +2,74 @@ import threading
 import time
 
 from api_server import APIServer
+import config
+import instrumentation
+from watch import Informer
 
 # The Scheduler is a control loop that checks for any pods that have been created
 # but not yet deployed, found in the etcd pendingPodList.
 # It transfers Pod objects from the pendingPodList to the runningPodList and creates an EndPoint object to store in the etcd EndPoint list
 # If no WorkerNode is available that can take the pod, it remains in the pendingPodList
+# Which node a pod goes to is decided by the placement policy (config.placement_policy by default)
+# The Scheduler watches pods, nodes and endpoints, and only runs when one of them changed (a pod became
+# PENDING, or cpu was freed up for the pods left pending) or a resync is due.
 class Scheduler(threading.Thread):
     apiServer: APIServer
 
-    def __init__(self, APISERVER, LOOPTIME):
+    def __init__(self, APISERVER, LOOPTIME, PLACEMENT=None):
         self.apiServer = APISERVER
         self.running = True
         self.time = LOOPTIME
+        self.placement = (PLACEMENT or config.placement_policy)()
+        self.informer = Informer(APISERVER, ('Pod', 'WorkerNode', 'EndPoint'), config.controller_resync_period)
 
     def __call__(self):
         print("Scheduler start")
         while self.running:
-            with self.apiServer.etcdLock:
-                for pod in self.apiServer.GetPending():
-                    assert pod.status == 'PENDING'
-
-                    # A PENDING pod can already be assigned to a node if it was crashed
-                    endpoints = self.apiServer.GetEndPointsByLabel(pod.deploymentLabel)
-                    for endpoint in endpoints:
-                        if endpoint.pod is pod:
-                            # Found the endpoint the pod is already on!
-                            # print(f'[Scheduler] Restarting {endpoint}')
-                            self.apiServer.StartPod(endpoint.pod)
-                            break
-                    else:
-                        # Try to find a suitable node for this pod
-                        for node in self.apiServer.GetWorkers():
-                            if node.available_cpu < pod.assigned_cpu:
-                                # Not enough cpu on this node for this pod
-                                continue
-
-                            # We found a suitable node
-                            # print(f'[Scheduler] Assigning pod {pod} to worker {node}')
-                            self.apiServer.CreateEndPoint(pod, node)
-
-                            # Only need to assign the pod once
-                            break
-                        else:
-                            print("FAILED TO SCHEDULE POD", pod)
-
-            time.sleep(self.time)
+            self.informer.wait(self.work())
         print("SchedShutdown")
+
+    def stop(self):
+        self.running = False
+        self.informer.close()
+
+    @instrumentation.control_loop()
+    def work(self) -> float:
+        ''' Schedules the pending pods if anything changed. Returns how long it can wait for the next change before running again. '''
+        events, resync = self.informer.poll()
+        if not events and not resync:
+            return self.informer.until_resync()
+
+        with self.apiServer.etcdLock:
+            self.schedule(self.apiServer.GetPending())
+        return self.informer.until_resync()
+
+    def schedule(self, pending):
+        if not pending:
+            return
+
+        unplaced = []
+        for pod in pending:
+            assert pod.status == 'PENDING'
+
+            # A PENDING pod can already be assigned to a node if it was crashed
+            endpoint = self.apiServer.GetEndPointForPod(pod)
+            if endpoint is not None:
+                # Found the endpoint the pod is already on!
+                # print(f'[Scheduler] Restarting {endpoint}')
+                self.apiServer.StartPod(endpoint.pod)
+            else:
+                unplaced.append(pod)
+
+        # Place the whole batch, biggest pods first since they are the hardest to fit
+        self.placement.refresh(self.apiServer.GetWorkers())
+        unplaced.sort(key=lambda pod: pod.assigned_cpu, reverse=True)
+        for pod in unplaced:
+            node = self.placement.pick(pod.assigned_cpu)
+            if node is None:
+                print("FAILED TO SCHEDULE POD", pod)
+                continue
+
+            # print(f'[Scheduler] Assigning pod {pod} to worker {node}')
+            self.apiServer.CreateEndPoint(pod, node)
+            self.placement.update(node)
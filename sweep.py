@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import hashlib
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+
+from process_metrics import MetricsProcessor
+from run_cache import simulator_version
+from runAllSimulations import Scenario, run_scenario
+
+# Parameter sweeps for the HPA. Every point (a set of HPA parameters) is run against every trace
+# on a process pool, in virtual time by default, and scored from its metrics. Lower scores are
+# better. Results are cached in a JSON Lines file keyed by the trace's content hash, the parameters,
+# the clock the runs used and the simulator version (see run_cache.py), so an interrupted or extended
+# sweep only runs the points it hasn't seen, and changing the code doesn't reuse stale scores.
+
+# Sweep parameter -> the config.py value it overrides
+PARAMETERS = {
+    'kp': 'autoscale_kp',
+    'ki': 'autoscale_ki',
+    'kd': 'autoscale_kd',
+    'buffer': 'autoscale_setpoint_buffer',
+    'warmup': 'autoscale_warmup_time',
+    'predictive': 'autoscale_predictive',
+    'horizon': 'autoscale_forecast_horizon',
+    'max_error': 'autoscale_forecast_max_error',
+}
+
+# How much each measure counts towards a run's score
+SCORE_WEIGHTS = {
+    'queue_latency': 1.0,    # seconds
+    'replica_distance': 1.0, # replicas
+    'error_rate': 100.0,     # fraction of requests
+}
+
+def grid(**axes):
+    ''' Every combination of the given values, e.g. grid(kp=[0.5, 0.9], ki=[0, 0.0013]). '''
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def random_samples(n: int, seed: int = 0, **ranges):
+    ''' n random points. A (low, high) tuple is sampled uniformly, a list is chosen from. '''
+    rng = random.Random(seed)
+    return [
+        {
+            name: rng.choice(values) if isinstance(values, list) else rng.uniform(*values)
+            for name, values in ranges.items()
+        }
+        for _ in range(n)
+    ]
+
+
+def score(processor: MetricsProcessor) -> dict:
+    ''' Queue latency, replica distance and error rate of a run, and their weighted sum. '''
+    summary = dict(processor.requests_summary())
+    distances = [abs(row[1]) for row in processor.deployment_distance()[1:]]
+
+    scores = {
+        'queue_latency': summary['Average request latency'],
+        'replica_distance': sum(distances) / len(distances) if distances else 0,
+        'error_rate': summary['Error rate (%)'],
+    }
+    scores['score'] = sum([SCORE_WEIGHTS[name] * value for name, value in scores.items()])
+    return scores
+
+
+def trace_hash(trace_file: str) -> str:
+    with open(trace_file, 'rb') as fp:
+        return hashlib.sha256(fp.read()).hexdigest()
+
+
+def cache_key(trace_digest: str, params: dict, virtual_time: bool = True) -> str:
+    clock = 'virtual' if virtual_time else 'real'
+    return f'{simulator_version()}:{trace_digest}:{clock}:{json.dumps(params, sort_keys=True)}'
+
+
+class SweepCache:
+    def __init__(self, path: str):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as fp:
+                for line in fp:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.results[entry['key']] = entry['scores']
+
+    def __contains__(self, key: str):
+        return key in self.results
+
+    def get(self, key: str) -> dict:
+        return self.results.get(key)
+
+    def put(self, key: str, scores: dict):
+        self.results[key] = scores
+        # Written straight away so a crashed sweep keeps what it finished
+        with open(self.path, 'a') as fp:
+            fp.write(json.dumps({'key': key, 'scores': scores}) + '\n')
+
+
+def run_point(trace_file: str, params: dict, virtual_time: bool = True) -> dict:
+    ''' Runs a trace with the given HPA parameters and scores it. Meant to run in a worker process. '''
+    with tempfile.TemporaryDirectory() as work_dir:
+        scenario = Scenario(
+            trace_file,
+            os.path.join(work_dir, 'metrics.json'),
+            config={PARAMETERS[name]: value for name, value in params.items()},
+            virtual_time=virtual_time,
+        )
+        return score(MetricsProcessor(run_scenario(scenario)))
+
+
+def sweep(trace_files, points, cache_path: str = 'sweep_cache.jsonl', max_workers: int = None, virtual_time: bool = True):
+    ''' Runs every point against every trace, skipping cached runs.
+    Returns [{'params', 'score', 'runs': {trace_file: scores}}] sorted best (lowest mean score) first. '''
+    for params in points:
+        for name in params:
+            if name not in PARAMETERS:
+                raise ValueError(f'Unknown sweep parameter {name!r}, expected one of {list(PARAMETERS)}')
+
+    cache = SweepCache(cache_path)
+    digests = {trace_file: trace_hash(trace_file) for trace_file in trace_files}
+
+    todo = [
+        (trace_file, params)
+        for params in points
+        for trace_file in trace_files
+        if cache_key(digests[trace_file], params, virtual_time) not in cache
+    ]
+    if todo:
+        with ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1) as pool:
+            futures = {
+                pool.submit(run_point, trace_file, params, virtual_time): (trace_file, params)
+                for trace_file, params in todo
+            }
+            for future in as_completed(futures):
+                trace_file, params = futures[future]
+                cache.put(cache_key(digests[trace_file], params, virtual_time), future.result())
+
+    results = []
+    for params in points:
+        runs = {trace_file: cache.get(cache_key(digests[trace_file], params, virtual_time)) for trace_file in trace_files}
+        results.append({
+            'params': params,
+            'score': sum([scores['score'] for scores in runs.values()]) / len(runs),
+            'runs': runs,
+        })
+    results.sort(key=lambda result: result['score'])
+    return results
+
+
+# Searched by default: around the hand-tuned gains, buffer and warmup
+DEFAULT_GRID = grid(
+    kp=[0.5, 0.7, 0.9, 1.1],
+    ki=[0, 0.0013, 0.005],
+    kd=[0, 0.1],
+    buffer=[5, 10, 15],
+    warmup=[5, 10],
+)
+
+if __name__ == '__main__':
+    # python sweep.py [--random N] [--real-time] TRACE...
+    args = sys.argv[1:]
+    points = DEFAULT_GRID
+    if '--random' in args:
+        i = args.index('--random')
+        points = random_samples(
+            int(args[i + 1]),
+            kp=(0.1, 2.0),
+            ki=(0, 0.01),
+            kd=(0, 0.5),
+            buffer=[5, 10, 15, 20],
+            warmup=[0, 5, 10, 20],
+        )
+        del args[i:i + 2]
+    virtual_time = '--real-time' not in args
+    trace_files = [arg for arg in args if arg != '--real-time'] or ['tracefiles/1.txt', 'tracefiles/2.txt', 'tracefiles/3.txt']
+
+    results = sweep(trace_files, points, virtual_time=virtual_time)
+    for result in results[:10]:
+        print(f"{result['score']:10.3f}  {json.dumps(result['params'], sort_keys=True)}")
@@ -0,0 +1,61 @@
+from collections import deque
+
+import pytest
+
+import config
+import metrics
+from admission import DropOldestAdmission, EarlyDropAdmission, RejectNewestAdmission
+from api_server import APIServer
+from metrics_sink import MemorySink
+from request import Request
+
+def requests(*ids):
+    return [Request([request_id, 'Dep_A', 1]) for request_id in ids]
+
+def admit_all(policy, arrivals):
+    queue = deque()
+    rejected = []
+    for request in arrivals:
+        rejected += policy.admit(queue, request)
+    return [request.request_id for request in queue], [request.request_id for request in rejected]
+
+def test_reject_newest():
+    assert admit_all(RejectNewestAdmission(2), requests('1', '2', '3', '4')) == (['1', '2'], ['3', '4'])
+
+def test_drop_oldest():
+    assert admit_all(DropOldestAdmission(2), requests('1', '2', '3', '4')) == (['3', '4'], ['1', '2'])
+
+@pytest.mark.parametrize('policy', [RejectNewestAdmission, DropOldestAdmission, EarlyDropAdmission])
+def test_queues_without_capacity_admit_nothing(policy):
+    assert admit_all(policy(0, 'Dep_A'), requests('1', '2')) == ([], ['1', '2'])
+
+def test_early_drop_sheds_before_the_queue_is_full():
+    policy = EarlyDropAdmission(10, 'Dep_A', threshold=0.5)
+    assert policy.drop_probability(5) == 0
+    assert policy.drop_probability(8) == pytest.approx(0.6)
+    assert policy.drop_probability(10) == 1
+
+    queue, rejected = admit_all(policy, requests(*[str(i) for i in range(100)]))
+    assert len(queue) <= 10
+    assert len(queue) + len(rejected) == 100
+    # The first requests turned away arrived while there was still room
+    assert int(rejected[0]) < 10
+    # Seeded by deployment label, so repeatable
+    assert admit_all(EarlyDropAdmission(10, 'Dep_A', threshold=0.5), requests(*[str(i) for i in range(100)])) == (queue, rejected)
+
+def test_push_req_records_rejections(monkeypatch):
+    monkeypatch.setattr(config, 'admission_queue_capacity', 1)
+    monkeypatch.setattr(config, 'admission_queue_capacities', {'Dep_B': 3})
+    sink = MemorySink()
+    metrics.reset(sink=sink, verbosity=0)
+    api = APIServer()
+    dep_a = api.CreateDeployment(['Dep_A', 1, 1])
+    dep_b = api.CreateDeployment(['Dep_B', 1, 1])
+
+    for i in range(3):
+        api.PushReq([f'A{i}', 'Dep_A', 1])
+        api.PushReq([f'B{i}', 'Dep_B', 1])
+
+    assert len(dep_a.pendingReqs) == 1 and len(dep_b.pendingReqs) == 3
+    assert dep_a.arrivals == 3
+    assert [(record['id'], record['deployment']) for record in sink.records if record['event'] == 'rejected'] == [('A1', 'Dep_A'), ('A2', 'Dep_A')]
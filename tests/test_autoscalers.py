@@ -0,0 +1,113 @@
+import math
+
+import pytest
+
+import config
+from api_server import APIServer
+from autoscalers import HPA, SCALE_COOLDOWN, AutoscalerManager, CappedList, measure_utilization, measure_utilizations
+from clock import VirtualClock
+from request import Request
+from scheduler import Scheduler
+
+@pytest.fixture
+def api():
+    scale_factor = config.cpu_scale_factor
+    config.cpu_scale_factor = 1
+    api = APIServer(VirtualClock())
+    api.CreateWorker(['Node_1', 8])
+    for label in ('Dep_A', 'Dep_B'):
+        deployment = api.CreateDeployment([label, 2, 1])
+        for _ in range(2):
+            api.CreatePod(deployment)
+    Scheduler(api, 1).work()
+    yield api
+    config.cpu_scale_factor = scale_factor
+
+def test_capped_list_keeps_a_running_average_of_the_last_values():
+    values = CappedList(3)
+    for value in (1, 2, 3, 4, 5, 6, 7):
+        values.append(value)
+    assert values.is_full()
+    assert len(values) == 3
+    assert values.average() == 6
+
+    values.clear()
+    values.append(10)
+    assert not values.is_full()
+    assert values.average() == 10
+
+def test_measure_utilizations_matches_measuring_each_deployment(api):
+    for endpoint in api.GetEndPoints():
+        endpoint.pod.status = 'RUNNING'
+    api.GetEndPointsByLabel('Dep_A')[0].pod.available_cpu = 0
+    api.PushReq(['1', 'Dep_B', 1])
+
+    deployments = {deployment.deploymentLabel: deployment for deployment in api.GetDeployments()}
+    utilizations = measure_utilizations(api.GetEndPoints(), deployments)
+    for label, deployment in deployments.items():
+        assert utilizations[label] == measure_utilization(api.GetEndPointsByLabel(label), len(deployment.pendingReqs))
+
+def test_manager_steps_due_hpas_and_cools_down_without_blocking(api):
+    manager = AutoscalerManager(api, 2)
+    busy = HPA(api, 2, ['Dep_A', '10', '2'])
+    idle = HPA(api, 2, ['Dep_B', '5', '2'])
+    manager.add(busy)
+    manager.add(idle)
+    assert manager.work() == config.autoscale_warmup_time
+
+    for endpoint in api.GetEndPoints():
+        endpoint.pod.status = 'RUNNING'
+        endpoint.pod.available_cpu = 0 if endpoint.deploymentLabel == 'Dep_A' else 1
+
+    api.clock.call_later(config.autoscale_warmup_time, lambda: None)
+    api.clock.run()
+    now = api.clock.now()
+    assert manager.work() == 2
+
+    # Dep_A is far over its set point, so it scales and cools down, while Dep_B carries on
+    assert api.GetDeploymentByLabel('Dep_A').expectedReplicas > 2
+    assert busy.cooldown_until == now + SCALE_COOLDOWN
+    assert busy.next_run == now + SCALE_COOLDOWN + 2
+    assert idle.next_run == now + 2
+
+def test_manager_drops_hpas_of_deleted_deployments(api):
+    manager = AutoscalerManager(api, 2)
+    hpa = HPA(api, 2, ['Dep_C', '50', '2'])
+    manager.add(hpa)
+    hpa.next_run = 0
+
+    assert manager.work() is None
+    assert not hpa.running
+    assert manager.hpas == []
+
+def test_predictive_hpa_scales_for_the_forecast_arrival_rate(api):
+    config.autoscale_predictive = True
+    try:
+        hpa = HPA(api, 2, ['Dep_A', '50', '10'])
+        deployment = api.GetDeploymentByLabel('Dep_A')
+
+        # 2 requests per second taking 3 seconds each keep 6 cpus busy, which is 12 pods at 50%
+        for t in range(0, 12, 2):
+            for i in range(4):
+                deployment.push_request(Request([f'{t}/{i}', 'Dep_A', 3]))
+                deployment.pop_request()
+            hpa.step(deployment, math.inf, 100, 2, t)
+
+        assert hpa.arrival_rate.forecast() == pytest.approx(2)
+        assert deployment.expectedReplicas == 12
+    finally:
+        config.autoscale_predictive = False
+
+def test_predictive_hpa_falls_back_to_pid_until_the_forecast_settles(api):
+    config.autoscale_predictive = True
+    try:
+        hpa = HPA(api, 2, ['Dep_A', '50', '2'])
+        deployment = api.GetDeploymentByLabel('Dep_A')
+        hpa.step(deployment, 100, 100, 2, 0)
+        assert hpa.forecast_demand(deployment) is None
+
+        # With no forecast the PID controller reacts to the measured utilization
+        hpa.step(deployment, 100, 100, 2, 2)
+        assert deployment.expectedReplicas > 2
+    finally:
+        config.autoscale_predictive = False
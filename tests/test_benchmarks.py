@@ -0,0 +1,32 @@
+import pytest
+
+import config
+from benchmarks import build_cluster, compare, run_benchmarks
+
+def test_build_cluster_places_every_pod():
+    scale_factor = config.cpu_scale_factor
+    config.cpu_scale_factor = 1
+    try:
+        api = build_cluster(30)
+    finally:
+        config.cpu_scale_factor = scale_factor
+
+    assert len(api.GetWorkers()) == 30
+    assert len(api.GetDeployments()) == 3
+    assert len(api.GetPodsByStatus('RUNNING')) == 30
+    assert api.GetPending() == ()
+
+def test_results_can_be_compared_to_a_baseline():
+    scale_factor = config.cpu_scale_factor
+    results = run_benchmarks(sizes=[10, 20], repeat=1)
+    assert config.cpu_scale_factor == scale_factor
+
+    names = {result['name'] for result in results['results']}
+    assert {'DepController.work (resync)', 'Scheduler.work (all pending)', 'MetricsProcessor.requests_summary'} <= names
+    assert len(results['results']) == 2 * len(names)
+    assert all([result['median_us'] >= 0 for result in results['results']])
+
+    baseline = {'results': [{**result, 'median_us': result['median_us'] * 2 or 1} for result in results['results'][:3]]}
+    comparison = list(compare(results, baseline))
+    assert len(comparison) == 3
+    assert [row[:2] for row in comparison] == [(result['name'], result['size']) for result in results['results'][:3]]
@@ -0,0 +1,73 @@
+import pytest
+
+from binary_trace import BinaryTrace, compile_trace, read_trace
+
+TRACE = '''AddNode Node_1 4
+Deploy Dep_A 2 1
+Sleep 1
+ReqIn 1 Dep_A 3
+ReqIn req-2 Dep_A 1
+
+ReqIn 007 Dep_A 2
+Sleep 2
+CrashPod Dep_A
+CreateHPA Dep_A 50 10
+ReqIn 4 Dep_A 1
+Sleep 1
+DeleteDeployment Dep_A
+'''
+
+@pytest.fixture
+def paths(tmp_path):
+    text_path = tmp_path / 'trace.txt'
+    text_path.write_text(TRACE)
+    return str(text_path), str(tmp_path / 'trace.ktrace')
+
+def test_compiled_trace_plays_back_like_the_text(paths):
+    text_path, binary_path = paths
+    assert compile_trace(text_path, binary_path) == 12
+    assert list(read_trace(binary_path)) == list(read_trace(text_path))
+
+def test_seek_replays_setup_then_streams_from_the_offset(paths):
+    text_path, binary_path = paths
+    compile_trace(text_path, binary_path)
+
+    with BinaryTrace(binary_path) as trace:
+        assert len(trace) == 12
+        assert trace.seek(0) == 0
+        assert trace.seek(3) == 7
+        assert trace.seek(2) == 7 # nothing happens at t=2, so the next command is at t=3
+        assert trace.seek(10) == 12
+
+        assert list(trace.commands(3)) == [
+            ['AddNode', 'Node_1', '4'],
+            ['Deploy', 'Dep_A', '2', '1'],
+            ['CrashPod', 'Dep_A'],
+            ['CreateHPA', 'Dep_A', '50', '10'],
+            ['ReqIn', '4', 'Dep_A', '1'],
+            ['Sleep', '1'],
+            ['DeleteDeployment', 'Dep_A'],
+        ]
+
+def test_skip_starts_after_the_played_commands(paths):
+    text_path, binary_path = paths
+    compile_trace(text_path, binary_path)
+
+    expected = list(read_trace(text_path))[5:]
+    assert list(read_trace(text_path, skip=5)) == expected
+    assert list(read_trace(binary_path, skip=5)) == expected
+    assert list(read_trace(binary_path, skip=20)) == []
+
+def test_records_are_read_in_chunks(paths):
+    text_path, binary_path = paths
+    compile_trace(text_path, binary_path)
+
+    with BinaryTrace(binary_path) as trace:
+        assert list(trace.records(chunk_size=5)) == list(trace.records())
+        assert [record[-1] for record in trace.records()] == [0, 0, 0, 1, 1, 1, 1, 3, 3, 3, 3, 4]
+
+def test_unknown_commands_are_rejected(tmp_path):
+    text_path = tmp_path / 'trace.txt'
+    text_path.write_text('AddNode Node_1 4\nReboot Node_1\n')
+    with pytest.raises(ValueError, match='trace.txt:2'):
+        compile_trace(str(text_path), str(tmp_path / 'trace.ktrace'))
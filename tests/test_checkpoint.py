@@ -0,0 +1,147 @@
+import json
+
+import pytest
+
+import checkpoint
+import config
+import runSimulation
+from admission import EarlyDropAdmission
+from clock import VirtualClock
+from load_balancing import LeastOutstandingRequestsLoadBalancer, PowerOfTwoChoicesLoadBalancer, RoundRobinLoadBalancer
+from process_metrics import MetricsProcessor
+
+TRACE = '''AddNode Node_1 4
+AddNode Node_2 4
+Deploy Dep_A 2 1
+CreateHPA Dep_A 50 4
+Sleep 3
+ReqIn 1 Dep_A 20
+ReqIn 2 Dep_A 20
+ReqIn 3 Dep_A 5
+Sleep 10
+ReqIn 4 Dep_A 5
+Sleep 10
+ReqIn 5 Dep_A 5
+Sleep 20
+'''
+
+@pytest.fixture
+def trace(tmp_path):
+    path = tmp_path / 'trace.txt'
+    path.write_text(TRACE)
+    return str(path)
+
+def successes(metrics_file, after = 0):
+    return sorted([
+        record['id'] for record in MetricsProcessor(metrics_file).data
+        if record['category'] == 'request' and record['event'] == 'success' and record['t'] >= after
+    ])
+
+def test_restoring_a_checkpoint_captures_the_same_state(tmp_path, trace):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    runSimulation.main(trace, str(tmp_path / 'metrics.json'), True, str(tmp_path / 'hpa.csv'), checkpoint_at=13, checkpoint_file=checkpoint_file)
+
+    state = checkpoint.load(checkpoint_file)
+    assert state['t'] == 13
+    assert state['cursor'] == 9
+    assert state['trace_event']['t'] == 13
+    in_flight = {request['id']: request['remaining'] for pod in state['pods'] for request in pod['in_flight']}
+    assert in_flight == {'1': 10, '2': 10}
+    assert len(state['hpas']) == 1
+
+    api_server, hpas, cursor = checkpoint.restore(state, VirtualClock(state['t']))
+    trace_event = checkpoint.resume(state, api_server, lambda: None)
+    load_balancers = [config.load_balancer(api_server, deployment) for deployment in api_server.GetDeployments()]
+    for load_balancer in load_balancers:
+        checkpoint.restore_load_balancer(state, load_balancer)
+    restored = checkpoint.capture(api_server, hpas, cursor, trace_event, False, load_balancers)
+    # The clock's queue starts afresh, but keeps the order of what was on it
+    in_flight_order = lambda state: [request['id'] for pod in state['pods'] for request in sorted(pod['in_flight'], key=lambda request: request['order'])]
+    assert in_flight_order(json.loads(json.dumps(restored))) == in_flight_order(state)
+    for checkpoint_state in (restored, state):
+        checkpoint_state['trace_event'].pop('order')
+        for pod in checkpoint_state['pods']:
+            for request in pod['in_flight']:
+                request.pop('order')
+    assert json.loads(json.dumps(restored)) == state
+
+def test_restored_run_carries_on_like_the_full_run(tmp_path, trace):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    full = str(tmp_path / 'full.json')
+    restored = str(tmp_path / 'restored.json')
+    runSimulation.main(trace, full, True, str(tmp_path / 'full.csv'), checkpoint_at=13, checkpoint_file=checkpoint_file)
+    runSimulation.main(trace, restored, True, str(tmp_path / 'restored.csv'), restore_file=checkpoint_file)
+
+    assert successes(restored) == successes(full, after=13) == ['1', '2', '4', '5']
+    # Only the requests arriving after the checkpoint start in the restored run
+    started = {
+        record['id']: record['t'] for record in MetricsProcessor(restored).data
+        if record['category'] == 'request' and record['event'] == 'started'
+    }
+    assert started == {'4': 13, '5': 23}
+
+def test_checkpoints_need_virtual_time(trace, tmp_path):
+    with pytest.raises(ValueError):
+        runSimulation.main(trace, str(tmp_path / 'metrics.json'), False, checkpoint_at=10)
+
+def test_checkpoints_after_the_last_command_are_saved(tmp_path, trace):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    # The last command plays at t=33, and the run stops 5s later
+    runSimulation.main(trace, str(tmp_path / 'metrics.json'), True, str(tmp_path / 'hpa.csv'), checkpoint_at=35, checkpoint_file=checkpoint_file)
+
+    state = checkpoint.load(checkpoint_file)
+    assert state['t'] == 35
+    assert state['cursor'] == len(TRACE.splitlines())
+
+def test_checkpoints_are_taken_mid_sleep(tmp_path, trace):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    full = str(tmp_path / 'full.json')
+    restored = str(tmp_path / 'restored.json')
+    # ReqIn 4 plays at t=13, during the Sleep 10 after it
+    runSimulation.main(trace, full, True, str(tmp_path / 'full.csv'), checkpoint_at=17, checkpoint_file=checkpoint_file)
+
+    state = checkpoint.load(checkpoint_file)
+    assert (state['t'], state['cursor'], state['trace_event']['t']) == (17, 11, 23)
+
+    runSimulation.main(trace, restored, True, str(tmp_path / 'restored.csv'), restore_file=checkpoint_file)
+    assert successes(restored) == successes(full, after=17) == ['1', '2', '4', '5']
+
+def test_checkpoints_after_the_last_command_are_saved(tmp_path, trace):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    # The last command plays at t=43, and the run stops 5s later
+    runSimulation.main(trace, str(tmp_path / 'metrics.json'), True, str(tmp_path / 'hpa.csv'), checkpoint_at=45, checkpoint_file=checkpoint_file)
+
+    state = checkpoint.load(checkpoint_file)
+    assert state['t'] == 45
+    assert state['cursor'] == len(TRACE.splitlines())
+
+def test_missed_checkpoints_are_reported(tmp_path, trace, capsys):
+    checkpoint_file = tmp_path / 'checkpoint.json'
+    runSimulation.main(trace, str(tmp_path / 'metrics.json'), True, str(tmp_path / 'hpa.csv'), checkpoint_at=100, checkpoint_file=str(checkpoint_file))
+
+    assert not checkpoint_file.exists()
+    assert 'no checkpoint saved' in capsys.readouterr().out
+
+@pytest.mark.parametrize('load_balancer', [RoundRobinLoadBalancer, PowerOfTwoChoicesLoadBalancer, LeastOutstandingRequestsLoadBalancer])
+def test_restored_load_balancers_route_like_the_full_run(tmp_path, monkeypatch, load_balancer):
+    monkeypatch.setattr(config, 'load_balancer', load_balancer)
+    monkeypatch.setattr(config, 'admission_queue_capacity', 4)
+    monkeypatch.setattr(config, 'admission_policy', EarlyDropAdmission)
+    trace = tmp_path / 'trace.txt'
+    trace.write_text('AddNode Node_1 100\nDeploy Dep_A 2 1\nSleep 3\n' + ''.join([
+        f'ReqIn {t} Dep_A 1\n' * 3 + f'ReqIn {t} Dep_A 4\n' * (t % 5) + 'Sleep 1\n' for t in range(3, 30)
+    ]))
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    full = str(tmp_path / 'full.json')
+    restored = str(tmp_path / 'restored.json')
+    runSimulation.main(str(trace), full, True, str(tmp_path / 'full.csv'), checkpoint_at=10, checkpoint_file=checkpoint_file)
+    runSimulation.main(str(trace), restored, True, str(tmp_path / 'restored.csv'), restore_file=checkpoint_file)
+
+    def routes(metrics_file):
+        return [
+            (record['t'], record['event'], record['id'], record.get('pod'))
+            for record in MetricsProcessor(metrics_file).data
+            if record['category'] == 'request' and record['event'] in ('routed', 'rejected') and record['t'] >= 10
+        ]
+    assert any([event == 'rejected' for _, event, _, _ in routes(full)])
+    assert routes(restored) == routes(full)
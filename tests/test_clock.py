@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import metrics
+from clock import VirtualClock, WallClock
+from pod import Pod
+from request import Request
+
+def test_events_run_in_time_order():
+    clock = VirtualClock()
+    seen = []
+    clock.call_later(5, lambda: seen.append(('b', clock.now())))
+    clock.call_later(1, lambda: seen.append(('a', clock.now())))
+    clock.call_later(5, lambda: seen.append(('c', clock.now())))
+    clock.run()
+
+    assert seen == [('a', 1), ('b', 5), ('c', 5)]
+
+def test_run_until():
+    clock = VirtualClock()
+    seen = []
+    clock.call_later(3, seen.append, 3)
+    clock.call_later(10, seen.append, 10)
+    clock.run(until=5)
+
+    assert seen == [3]
+    assert clock.now() == 5
+
+def test_wall_clock_runs_callbacks_on_one_timer_thread():
+    clock = WallClock()
+    seen = []
+    done = threading.Event()
+    clock.call_later(0.05, lambda: (seen.append('b'), done.set()))
+    clock.call_later(0.01, lambda: seen.append(threading.current_thread().name))
+    cancelled = clock.call_later(0.02, seen.append, 'cancelled')
+    cancelled.cancel()
+
+    assert done.wait(timeout=5)
+    assert seen == ['Timer', 'b']
+
+def test_pod_requests_complete_on_virtual_clock():
+    clock = VirtualClock()
+    metrics.reset(clock)
+
+    pod = Pod('Dep_A/1', 2, 'Dep_A', clock)
+    assert not pod.HandleRequest(Request(['0', 'Dep_A', 1]))
+
+    pod.status = 'RUNNING'
+    assert pod.HandleRequest(Request(['1', 'Dep_A', 4]))
+    assert pod.HandleRequest(Request(['2', 'Dep_A', 8]))
+    assert not pod.HandleRequest(Request(['3', 'Dep_A', 1]))
+    assert pod.available_cpu == 0
+    assert pod.is_running()
+
+    clock.call_later(6, pod.Crash)
+    clock.run()
+
+    events = [(record['event'], record['id'], record['t']) for record in metrics._sink.records]
+    assert ('success', '1', 4) in events
+    assert ('failed', '2', 6) in events
+    assert pod.available_cpu == 2
+    assert not pod.is_running()
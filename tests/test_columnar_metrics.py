@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from columnar_metrics import ColumnarMetrics
+from process_metrics import MetricsProcessor
+
+RECORDS = [
+    {'category': 'pod', 'event': 'created', 'id': 'Dep_A/1', 't': 0},
+    {'category': 'pod', 'event': 'started', 'id': 'Dep_A/1', 'was_crashed': False, 't': 0},
+    {'category': 'request', 'event': 'created', 'id': '1', 't': 1},
+    {'category': 'request', 'event': 'created', 'id': '2', 't': 1},
+    {'category': 'pod', 'event': 'status', 'id': 'Dep_A/1', 'assigned_cpu': 4, 'available_cpu': 3, 'status': 'RUNNING', 't': 2},
+    {'category': 'request', 'event': 'started', 'id': '1', 'pod': 'Dep_A/1', 't': 2},
+    {'category': 'request', 'event': 'started', 'id': '2', 'pod': 'Dep_A/1', 't': 5},
+    {'category': 'pod', 'event': 'terminating', 'id': 'Dep_A/1', 'old_status': 'RUNNING', 't': 6},
+    {'category': 'request', 'event': 'success', 'id': '1', 'pod': 'Dep_A/1', 't': 7},
+    {'category': 'request', 'event': 'failed', 'id': '2', 'pod': 'Dep_A/1', 't': 9},
+]
+
+@pytest.fixture
+def metrics_path(tmp_path):
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS]))
+    return str(path)
+
+def test_aggregations(metrics_path):
+    metrics = ColumnarMetrics.load(metrics_path)
+
+    buckets, usage = metrics.cpu_usage()
+    assert buckets.tolist() == [2]
+    assert usage.tolist() == [0.25]
+
+    t, counts = metrics.pod_state_counts()
+    assert t.tolist() == [0, 2, 6]
+    assert counts.tolist() == [[0, 1, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]]
+
+    latencies = metrics.request_latencies()
+    assert latencies['queue'].tolist() == [1, 4]
+    assert latencies['end_to_end'].tolist() == [6, 8]
+
+def test_npz_cache_round_trip(metrics_path):
+    first = ColumnarMetrics.load(metrics_path)
+    cached = ColumnarMetrics.load(metrics_path)
+
+    assert cached.vocabularies['id'].tolist() == first.vocabularies['id'].tolist()
+    for name, column in first.columns.items():
+        np.testing.assert_array_equal(cached.columns[name], column)
+    assert cached.latency_percentiles() == first.latency_percentiles()
+
+def test_requests_summary_reports_percentiles(metrics_path):
+    summary = dict(MetricsProcessor(metrics_path).requests_summary())
+    assert summary['Queue latency p50'] == 2.5
+    assert summary['End-to-end latency p99.9'] == pytest.approx(8, abs=0.01)
@@ -0,0 +1,54 @@
+import pytest
+
+from api_server import APIServer
+
+def test_indexes_follow_mutations():
+    api = APIServer()
+    dep_a = api.CreateDeployment(['Dep_A', 1, 1])
+    dep_b = api.CreateDeployment(['Dep_B', 1, 1])
+    node = api.CreateWorker(['Node_1', 4])
+    assert api.GetDeploymentByLabel('Dep_B') is dep_b
+
+    api.CreatePod(dep_a)
+    api.CreatePod(dep_b)
+    assert len(api.GetPending()) == 2
+
+    pod_a, pod_b = api.GetPending()
+    api.CreateEndPoint(pod_a, node)
+    api.CreateEndPoint(pod_b, node)
+    assert api.GetPending() == ()
+    assert api.GetPodsByStatus('RUNNING') == (pod_a, pod_b)
+    assert [endpoint.pod for endpoint in api.GetEndPointsByLabel('Dep_A')] == [pod_a]
+    assert len(api.GetEndPointsByNode('Node_1')) == 2
+
+    api.CrashPod('Dep_A')
+    assert api.GetPodsByStatus('FAILED') == (pod_a,)
+    api.RestartPod(pod_a)
+    assert api.GetPending() == (pod_a,)
+    assert api.GetEndPointForPod(pod_a).pod is pod_a
+
+    endpoint_b = api.GetEndPointForPod(pod_b)
+    api.TerminatePod(endpoint_b)
+    api.RemoveEndPoint(endpoint_b)
+    assert api.GetEndPointsByLabel('Dep_B') == ()
+    assert api.GetEndPointForPod(pod_b) is None
+    assert api.GetPodsByStatus('TERMINATING') == ()
+    assert dep_b.currentReplicas == 0
+
+    api.DeleteDeployment(dep_b)
+    assert api.GetDeploymentByLabel('Dep_B') is None
+    assert api.GetDeployments() == (dep_a,)
+
+def test_snapshots_are_stable_across_mutations():
+    api = APIServer()
+    dep = api.CreateDeployment(['Dep_A', 1, 1])
+    node = api.CreateWorker(['Node_1', 4])
+
+    api.CreatePod(dep)
+    pending = api.GetPending()
+    assert api.GetPending() is pending
+
+    api.CreateEndPoint(pending[0], node)
+    assert len(pending) == 1
+    assert api.GetPending() == ()
+    assert api.GetPodsByStatus('RUNNING') == pending
@@ -0,0 +1,25 @@
+import math
+
+import pytest
+
+from forecasting import HoltForecaster
+
+def test_holt_follows_a_ramp_and_extrapolates_it():
+    forecaster = HoltForecaster(0.5, 0.3)
+    assert forecaster.forecast() == 0
+    assert forecaster.relative_error() == math.inf
+
+    for t in range(50):
+        forecaster.update(2 * t)
+
+    assert forecaster.forecast(1) == pytest.approx(100, rel=0.01)
+    assert forecaster.peak(5) == pytest.approx(108, rel=0.01)
+    assert forecaster.relative_error() < 0.01
+
+def test_holt_error_grows_on_noise_and_forecasts_never_go_negative():
+    forecaster = HoltForecaster(0.5, 0.3)
+    for value in (10, 0, 10, 0, 10, 0, 0, 0):
+        forecaster.update(value)
+
+    assert forecaster.relative_error() > 1
+    assert forecaster.forecast(100) == 0
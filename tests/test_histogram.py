@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+import metrics
+from clock import VirtualClock
+from histogram import LatencyHistogram
+from request import Request
+
+def test_percentiles_within_relative_error():
+    histogram = LatencyHistogram(relative_error=0.01)
+    rng = random.Random(1)
+    values = sorted([rng.expovariate(10) for _ in range(10000)])
+    for value in values:
+        histogram.record(value)
+
+    assert histogram.count == len(values)
+    for p in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * p / 100) - 1]
+        assert histogram.percentile(p) == pytest.approx(exact, rel=0.02)
+    assert histogram.percentile(100) == values[-1]
+
+def test_request_latencies_are_recorded_per_deployment():
+    clock = VirtualClock()
+    metrics.reset(clock, verbosity=0)
+
+    class FakePod:
+        podName = 'Dep_A/1'
+
+    request = Request(['1', 'Dep_A', 3])
+    metrics.request_created(request)
+    clock.call_later(0.25, metrics.request_started, FakePod, request)
+    clock.call_later(3.25, metrics.request_success, FakePod, request)
+    clock.run()
+
+    summary = metrics.latency_summary('Dep_A')
+    assert summary['queue']['p50'] == pytest.approx(0.25, rel=0.01)
+    assert summary['service']['max'] == 3
+    assert summary['end_to_end']['count'] == 1
+    assert metrics.latency_summary()[metrics.ALL_DEPLOYMENTS]['queue']['count'] == 1
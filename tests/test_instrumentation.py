@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import config
+import instrumentation
+import runSimulation
+from clock import VirtualClock
+from process_metrics import MetricsProcessor
+
+TRACE = '''AddNode Node_1 4
+Deploy Dep_A 1 1
+Sleep 3
+ReqIn 1 Dep_A 2
+Sleep 5
+'''
+
+@pytest.fixture(autouse=True)
+def reset_instrumentation():
+    yield
+    instrumentation.reset()
+
+def test_locks_are_plain_unless_enabled():
+    instrumentation.reset()
+    assert type(instrumentation.lock('etcdLock')) is type(threading.Lock())
+
+    instrumentation.reset(enabled=True)
+    assert isinstance(instrumentation.lock('etcdLock'), instrumentation.InstrumentedLock)
+
+def test_lock_records_wait_and_hold_per_source():
+    clock = VirtualClock()
+    instrumentation.reset(clock, enabled=True)
+    lock = instrumentation.lock('etcdLock')
+
+    def hold():
+        with lock:
+            pass
+    clock.call_later(1, hold, source='Scheduler')
+    clock.call_later(2, hold, source='Scheduler')
+    clock.call_later(3, hold, source='HPA')
+    clock.run()
+
+    stats = instrumentation.summary()
+    assert stats[('lock.wait', 'etcdLock/Scheduler')]['count'] == 2
+    assert stats[('lock.hold', 'etcdLock/Scheduler')]['count'] == 2
+    assert stats[('lock.hold', 'etcdLock/HPA')]['count'] == 1
+    assert not lock.locked()
+
+def test_control_loop_records_duration_and_lag():
+    clock = VirtualClock()
+    instrumentation.reset(clock, enabled=True)
+
+    class Loop:
+        @instrumentation.control_loop(lambda loop: 'A')
+        def work(self):
+            return 5
+
+    loop = Loop()
+    clock.call_later(0, loop.work)
+    clock.call_later(7, loop.work) # Asked to run again at 5
+    clock.run()
+
+    stats = instrumentation.summary()
+    assert stats[('loop.duration', 'Loop(A)')]['count'] == 2
+    lag = stats[('loop.lag', 'Loop(A)')]
+    assert lag['count'] == 1
+    assert lag['max'] == pytest.approx(2)
+
+def test_simulation_dumps_instrumentation_into_metrics(tmp_path):
+    trace = tmp_path / 'trace.txt'
+    trace.write_text(TRACE)
+    metrics_file = str(tmp_path / 'metrics.json')
+
+    config.instrumentation = True
+    try:
+        runSimulation.main(str(trace), metrics_file, virtual_time=True, hpa_file=str(tmp_path / 'hpa.csv'))
+    finally:
+        config.instrumentation = False
+
+    processor = MetricsProcessor(metrics_file)
+    assert 'etcdLock/Simulator' in processor.instrumentation['lock.hold']
+    assert 'Scheduler' in processor.instrumentation['loop.duration']
+    assert all([record['category'] != 'instrumentation' for record in processor.data])
@@ -0,0 +1,213 @@
+import threading
+
+import pytest
+
+import instrumentation
+import metrics
+from api_server import APIServer
+from clock import VirtualClock
+from load_balancing import (
+    LeastOutstandingRequestsLoadBalancer,
+    PowerOfTwoChoicesLoadBalancer,
+    RoundRobinLoadBalancer,
+    outstanding_requests,
+)
+from metrics_sink import MemorySink
+
+def test_load_balancer_waits_for_capacity():
+    api = APIServer()
+    dep = api.CreateDeployment(['Dep_A', 1, 1])
+    node = api.CreateWorker(['Node_1', 4])
+    load_balancer = RoundRobinLoadBalancer(api, dep)
+
+    api.PushReq(['1', 'Dep_A', 0])
+    assert load_balancer.ready()
+    assert not load_balancer.dispatch() # no pods yet
+    assert not load_balancer.ready()
+
+    thread = threading.Thread(target=load_balancer)
+    thread.start()
+    try:
+        api.CreatePod(dep)
+        with api.etcdLock:
+            api.CreateEndPoint(api.GetPending()[0], node)
+
+        dep.wait_until(lambda: len(dep.pendingReqs) == 0)
+    finally:
+        load_balancer.stop()
+        thread.join(timeout=5)
+
+    assert not thread.is_alive()
+
+def running_deployment(pods = 3):
+    api = APIServer(VirtualClock())
+    dep = api.CreateDeployment(['Dep_A', pods, 4])
+    node = api.CreateWorker(['Node_1', 100])
+    for _ in range(pods):
+        api.CreatePod(dep)
+    with api.etcdLock:
+        for pod in api.GetPending():
+            api.CreateEndPoint(pod, node)
+    return api, dep
+
+@pytest.mark.parametrize('load_balancer, max_spread', [
+    (LeastOutstandingRequestsLoadBalancer, 0),
+    (PowerOfTwoChoicesLoadBalancer, 2),
+])
+def test_load_aware_balancers_spread_requests_evenly(load_balancer, max_spread):
+    api, dep = running_deployment()
+    balancer = load_balancer(api, dep)
+    for i in range(len(api.GetEndPoints()) * 2):
+        api.PushReq([str(i), 'Dep_A', 10])
+        assert balancer.dispatch()
+
+    loads = [outstanding_requests(endpoint.pod) for endpoint in api.GetEndPoints()]
+    assert max(loads) - min(loads) <= max_spread
+
+def test_least_outstanding_requests_heap_follows_starts_and_finishes():
+    api, dep = running_deployment()
+    balancer = LeastOutstandingRequestsLoadBalancer(api, dep)
+    pods = [endpoint.pod for endpoint in api.GetEndPoints()]
+
+    # One long request on every pod, then a short one on the first
+    for i, exec_time in enumerate((10, 10, 10, 1)):
+        api.PushReq([str(i), 'Dep_A', exec_time])
+        balancer.dispatch()
+    assert [outstanding_requests(pod) for pod in pods] == [2, 1, 1]
+
+    # Once the short request finishes the first pod is back level with the others
+    api.clock.call_later(2, lambda: None)
+    api.clock.run(until=2)
+    assert outstanding_requests(balancer.pick()) == 1
+    api.PushReq(['4', 'Dep_A', 10])
+    api.PushReq(['5', 'Dep_A', 10])
+    balancer.dispatch()
+    balancer.dispatch()
+    assert balancer.pick() is pods[0]
+
+def test_least_outstanding_requests_skips_full_and_crashed_pods():
+    api, dep = running_deployment(2)
+    balancer = LeastOutstandingRequestsLoadBalancer(api, dep)
+    pods = [endpoint.pod for endpoint in api.GetEndPoints()]
+
+    api.CrashPod('Dep_A')
+    assert balancer.pick() is pods[1]
+    for i in range(pods[1].assigned_cpu):
+        api.PushReq([str(i), 'Dep_A', 10])
+        assert balancer.dispatch()
+    assert balancer.pick() is None
+
+def test_batch_dispatch_fills_free_cpu_from_one_snapshot():
+    api, dep = running_deployment(2)
+    sink = MemorySink()
+    metrics.reset(api.clock, sink, 0)
+    try:
+        balancer = RoundRobinLoadBalancer(api, dep, batch=True)
+        for i in range(10):
+            api.PushReq([str(i), 'Dep_A', 10])
+
+        assert balancer.step()
+        # Two pods with 4 cpus each take the first 8 requests, the rest stay queued in order
+        assert [request.request_id for request in dep.pendingReqs] == ['8', '9']
+        assert [outstanding_requests(endpoint.pod) for endpoint in api.GetEndPoints()] == [4, 4]
+        assert not balancer.ready()
+
+        events = [(record['event'], record['id']) for record in sink.records if record['category'] == 'request']
+        assert [request_id for event, request_id in events if event == 'started'] == [str(i) for i in range(8)]
+        assert len([event for event, _ in events if event == 'routed']) == 8
+        assert metrics.latency_summary('Dep_A')['queue']['count'] == 8
+    finally:
+        metrics.reset()
+
+@pytest.mark.parametrize('load_balancer', [LeastOutstandingRequestsLoadBalancer, PowerOfTwoChoicesLoadBalancer])
+def test_load_aware_balancers_fill_free_cpu_in_batches(load_balancer):
+    api, dep = running_deployment(3)
+    balancer = load_balancer(api, dep, batch=True)
+    for i in range(14):
+        api.PushReq([str(i), 'Dep_A', 10])
+
+    assert balancer.step()
+    # Three pods with 4 cpus each take the first 12 requests, the rest stay queued in order
+    assert [request.request_id for request in dep.pendingReqs] == ['12', '13']
+    assert [outstanding_requests(endpoint.pod) for endpoint in api.GetEndPoints()] == [4, 4, 4]
+    assert not balancer.ready()
+
+    # A finished request frees up one pod, which the next batch finds
+    api.clock.call_later(11, lambda: None)
+    api.clock.run(until=11)
+    for i in range(14, 26):
+        api.PushReq([str(i), 'Dep_A', 10])
+    assert balancer.step()
+    assert [outstanding_requests(endpoint.pod) for endpoint in api.GetEndPoints()] == [4, 4, 4]
+
+def test_batch_dispatch_does_not_record_lag():
+    api, dep = running_deployment(1)
+    instrumentation.reset(api.clock, True)
+    try:
+        balancer = RoundRobinLoadBalancer(api, dep, batch=True)
+        for i in range(3):
+            api.PushReq([str(i), 'Dep_A', 10])
+            balancer.step()
+            api.clock.call_later(5, lambda: None)
+            api.clock.run(until=api.clock.now() + 5)
+        stats = instrumentation.summary()
+        assert ('loop.duration', 'RoundRobinLoadBalancer(Dep_A)') in stats
+        assert not [key for key in stats if key[0] == 'loop.lag']
+    finally:
+        instrumentation.reset()
+
+def test_deployments_report_arrivals_and_capacity_changes():
+    api, dep = running_deployment(1)
+    changes = []
+    dep.on_changed = lambda: changes.append(len(dep.pendingReqs))
+    balancer = RoundRobinLoadBalancer(api, dep)
+
+    api.PushReq(['1', 'Dep_A', 1])
+    assert changes == [1]
+    assert balancer.dispatch()
+    # The pod freeing up its cpu again
+    api.clock.run()
+    assert changes == [1, 0]
+
+def test_power_of_two_choices_samples_only_running_pods_with_spare_cpu():
+    api, dep = running_deployment(3)
+    balancer = PowerOfTwoChoicesLoadBalancer(api, dep)
+    pods = [endpoint.pod for endpoint in api.GetEndPoints()]
+
+    # The first pod crashes and the second fills up, which leaves only the third to sample
+    balancer.pick()
+    api.CrashPod('Dep_A')
+    for i in range(pods[1].assigned_cpu):
+        api.PushReq([str(i), 'Dep_A', 10])
+        assert pods[1].HandleRequest(dep.pop_request())
+        balancer.started(pods[1])
+    assert all([balancer.pick() is pods[2] for _ in range(10)])
+    assert list(balancer._available) == [pods[2]]
+
+    # A finished request brings the second pod back
+    api.clock.run(until=11)
+    assert pods[1] in balancer._available
+
+def test_requests_are_recorded_as_routed_once_they_start():
+    api, dep = running_deployment(1)
+    sink = MemorySink()
+    metrics.reset(api.clock, sink, 0)
+    try:
+        balancer = RoundRobinLoadBalancer(api, dep)
+        pod = api.GetEndPoints()[0].pod
+        api.PushReq(['1', 'Dep_A', 10])
+
+        # The pod crashes between being picked and the request reaching it
+        api.CrashPod('Dep_A')
+        balancer.pick = lambda: pod
+        assert balancer.dispatch()
+        assert [request.request_id for request in dep.pendingReqs] == ['1']
+
+        del balancer.pick
+        api.RestartPod(pod)
+        api.StartPod(pod)
+        assert balancer.dispatch()
+        events = [record['event'] for record in sink.records if record['category'] == 'request']
+        assert events == ['created', 'routed', 'started']
+    finally:
+        metrics.reset()
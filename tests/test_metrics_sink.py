@@ -0,0 +1,50 @@
+import json
+import random
+import threading
+import time
+
+import pytest
+
+from metrics_sink import JsonLinesSink
+from process_metrics import load_records
+
+@pytest.mark.parametrize('file_name', ['metrics.json', 'metrics.json.gz'])
+def test_json_lines_round_trip(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    sink = JsonLinesSink(path, batch_size=3, max_batches=1)
+    records = [{'category': 'request', 'event': 'created', 'id': str(i), 't': i} for i in range(10)]
+    for record in records:
+        sink.write(record)
+    sink.close()
+    sink.write({'category': 'late'})
+
+    assert load_records(path) == records
+
+def test_json_lines_sink_keeps_write_order_when_batches_are_queued_concurrently(tmp_path):
+    path = tmp_path / 'metrics.json'
+    # Batches of records from several threads
+    sink = JsonLinesSink(str(path), batch_size=3, max_batches=1)
+    # Writers get held up between taking a batch and queueing it, like they are when the queue is full
+    rng = random.Random(0)
+    put = sink._batches.put
+    def slow_put(batch):
+        time.sleep(rng.random() * 0.001)
+        put(batch)
+    sink._batches.put = slow_put
+
+    def write(thread):
+        for i in range(200):
+            sink.write({'thread': thread, 'i': i})
+            time.sleep(0) # let the other threads in
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sink.close()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 8 * 200
+    for thread in range(8):
+        assert [record['i'] for record in records if record['thread'] == thread] == list(range(200))
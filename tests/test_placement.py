@@ -0,0 +1,60 @@
+import pytest
+
+import config
+from api_server import APIServer
+from placement import BestFitPlacement, FirstFitPlacement, MostAllocatedPlacement, SpreadPlacement
+from scheduler import Scheduler
+from worker_node import WorkerNode
+
+def make_nodes(*cpus):
+    nodes = []
+    for i, cpu in enumerate(cpus):
+        node = WorkerNode([f'Node_{i}', 1])
+        node.assigned_cpu = 10
+        node.available_cpu = cpu
+        nodes.append(node)
+    return nodes
+
+@pytest.mark.parametrize('policy, expected', [
+    (FirstFitPlacement, 1),
+    (BestFitPlacement, 3),
+    (SpreadPlacement, 2),
+    (MostAllocatedPlacement, 3),
+])
+def test_pick(policy, expected):
+    nodes = make_nodes(2, 6, 9, 4, 9)
+    placement = policy()
+    placement.refresh(nodes)
+
+    assert placement.pick(4) is nodes[expected]
+    assert placement.pick(10) is None
+
+def test_update_reindexes_node():
+    nodes = make_nodes(2, 6, 9)
+    for policy in (FirstFitPlacement, BestFitPlacement, SpreadPlacement, MostAllocatedPlacement):
+        placement = policy()
+        placement.refresh(nodes)
+        nodes[2].available_cpu = 1
+        placement.update(nodes[2])
+        assert placement.pick(7) is None
+        assert placement.pick(6) is nodes[1]
+        nodes[2].available_cpu = 9
+
+def test_scheduler_places_batch_biggest_first():
+    api = APIServer()
+    small = api.CreateDeployment(['Dep_Small', 1, 1])
+    big = api.CreateDeployment(['Dep_Big', 1, 3])
+    api.CreateWorker(['Node_1', 1])
+    small.expectedReplicas = 2
+    big.expectedReplicas = 1
+    api.CreatePod(small)
+    api.CreatePod(small)
+    api.CreatePod(big)
+
+    node = api.GetWorkers()[0]
+    node.available_cpu = 4
+    Scheduler(api, 1, BestFitPlacement).work()
+
+    placed = sorted([endpoint.deploymentLabel for endpoint in api.GetEndPoints()])
+    assert placed == ['Dep_Big', 'Dep_Small']
+    assert len(api.GetPending()) == 1
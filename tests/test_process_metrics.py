@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from process_metrics import MetricsProcessor
+
+RECORDS = [
+    {'category': 'deployment', 'event': 'created', 'id': 'Dep_A', 'current': 0, 'expected': 2, 't': 0},
+    {'category': 'pod', 'event': 'created', 'id': 'Dep_A/1', 't': 0},
+    {'category': 'deployment', 'event': 'replicas', 'id': 'Dep_A', 'current': 1, 'expected': 2, 't': 0},
+    {'category': 'request', 'event': 'created', 'id': '1', 't': 1},
+    {'category': 'pod', 'event': 'status', 'id': 'Dep_A/1', 'assigned_cpu': 2, 'available_cpu': 1, 'status': 'RUNNING', 't': 2},
+    {'category': 'pod', 'event': 'status', 'id': 'Dep_A/1', 'assigned_cpu': 2, 'available_cpu': 2, 'status': 'RUNNING', 't': 2},
+    {'category': 'request', 'event': 'started', 'id': '1', 't': 2},
+    {'category': 'deployment', 'event': 'replicas', 'id': 'Dep_A', 'current': 2, 'expected': 2, 't': 3},
+    {'category': 'request', 'event': 'success', 'id': '1', 't': 4},
+]
+
+@pytest.fixture
+def processor(tmp_path):
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS]))
+    return MetricsProcessor(str(path))
+
+def test_deployment_distance(processor):
+    assert processor.deployment_distance() == [
+        ['t', 'Distance', 'Current', 'Expected', 'Dep #'],
+        [0, 2, 0, 2, 1],
+        [1, 0, 0, 0, 0],
+        [2, 0, 0, 0, 0],
+        [3, 0, 2, 2, 1],
+        [4, 0, 0, 0, 0],
+    ]
+
+def test_pod_usage(processor):
+    assert processor.pod_usage() == [['t', 'CPU Usage (% of total)'], [2, 0.5]]
+
+def test_requests_plot(processor):
+    assert processor.requests_plot()[1:] == [['1', 1, 2, 4, True]]
+
+def test_requests_summary_reports_goodput_and_rejections(tmp_path):
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS + [
+        {'category': 'request', 'event': 'created', 'id': '2', 't': 1},
+        {'category': 'request', 'event': 'rejected', 'id': '2', 'deployment': 'Dep_A', 't': 1},
+    ]]))
+    summary = dict(MetricsProcessor(str(path)).requests_summary())
+    assert summary['Request count'] == 2
+    assert summary['Rejected count'] == 1
+    assert summary['Rejection rate (%)'] == 0.5
+    assert summary['Error count'] == 1
+    assert summary['Goodput (successes/s)'] == 0.25
+
+def test_requests_summary_counts_request_ids(tmp_path):
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS + [
+        # A second request with the same id, to another deployment, which succeeds too
+        {'category': 'request', 'event': 'created', 'id': '1', 't': 1},
+        {'category': 'request', 'event': 'success', 'id': '1', 't': 4},
+        # Rejected without ever being created is left out
+        {'category': 'request', 'event': 'rejected', 'id': '3', 'deployment': 'Dep_A', 't': 1},
+    ]]))
+    summary = dict(MetricsProcessor(str(path)).requests_summary())
+    assert summary['Request count'] == 1
+    assert summary['Rejected count'] == 0
+    assert summary['Rejection rate (%)'] == 0
+    assert summary['Goodput (successes/s)'] == 0.25
+
+def test_requests_summary_without_requests(tmp_path):
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS if record['category'] != 'request']))
+    summary = dict(MetricsProcessor(str(path)).requests_summary())
+    assert summary['Request count'] == 0
+    assert summary['Rejection rate (%)'] == 0
+    assert summary['Error rate (%)'] == 0
+
+def test_requests_summary_reports_histogram_percentiles_per_deployment(tmp_path):
+    def latency(deployment_label, kind, p50):
+        return {'category': 'latency', 'event': kind, 'id': deployment_label, 'count': 1, 'min': p50, 'max': p50, 'mean': p50,
+                'p50': p50, 'p90': p50, 'p99': p50, 'p999': p50, 't': 4}
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS + [
+        latency('Dep_A', 'queue', 0.0004),
+        latency('*', 'queue', 0.0004),
+        latency('*', 'end_to_end', 2.0013),
+    ]]))
+    summary = MetricsProcessor(str(path)).requests_summary()
+    rows = [key for key, _ in summary if 'latency p' in key]
+    assert rows == [
+        'Queue latency p50', 'Queue latency p90', 'Queue latency p99', 'Queue latency p99.9',
+        'End-to-end latency p50', 'End-to-end latency p90', 'End-to-end latency p99', 'End-to-end latency p99.9',
+        'Queue latency p50 (Dep_A)', 'Queue latency p90 (Dep_A)', 'Queue latency p99 (Dep_A)', 'Queue latency p99.9 (Dep_A)',
+    ]
+    assert dict(summary)['Queue latency p99 (Dep_A)'] == 0.0004
+
+def test_instrumentation_table_puts_the_most_time_spent_first(tmp_path):
+    def summary(count, mean):
+        return {'count': count, 'min': mean, 'max': mean, 'mean': mean, 'p50': mean, 'p90': mean, 'p99': mean, 'p999': mean}
+
+    path = tmp_path / 'metrics.json'
+    path.write_text('\n'.join([json.dumps(record) for record in RECORDS + [
+        {'category': 'instrumentation', 'event': 'lock.wait', 'id': 'etcdLock/Scheduler', 't': 4, **summary(10, 0.001)},
+        {'category': 'instrumentation', 'event': 'loop.duration', 'id': 'Scheduler', 't': 4, **summary(4, 0.005)},
+        {'category': 'instrumentation', 'event': 'loop.lag', 'id': 'Scheduler', 't': 4, **summary(4, 0.5)},
+    ]]))
+
+    assert MetricsProcessor(str(path)).instrumentation_table() == [
+        ['Kind', 'Name', 'Count', 'Total', 'Mean', 'p50', 'p99', 'Max'],
+        ['loop.lag', 'Scheduler', 4, 2.0, 0.5, 0.5, 0.5, 0.5],
+        ['loop.duration', 'Scheduler', 4, pytest.approx(20), pytest.approx(5), pytest.approx(5), pytest.approx(5), pytest.approx(5)],
+        ['lock.wait', 'etcdLock/Scheduler', 10, pytest.approx(10), pytest.approx(1), pytest.approx(1), pytest.approx(1), pytest.approx(1)],
+    ]
@@ -0,0 +1,91 @@
+import pytest
+
+import config
+import runAllSimulations
+from load_balancing import LeastOutstandingRequestsLoadBalancer
+from process_metrics import MetricsProcessor
+from run_cache import RunCache
+from runAllSimulations import Scenario, run_all, run_scenario
+
+TRACE = '''AddNode Node_1 4
+Deploy Dep_A 1 1
+Sleep 3
+ReqIn 1 Dep_A 2
+Sleep 5
+'''
+
+def expected_replicas(metrics_file):
+    created = [record for record in MetricsProcessor(metrics_file).data if record['category'] == 'deployment']
+    return created[0]['expected']
+
+@pytest.fixture
+def trace(tmp_path):
+    path = tmp_path / 'trace.txt'
+    path.write_text(TRACE)
+    return str(path)
+
+def test_run_scenario_keeps_its_config_and_outputs_to_itself(tmp_path, trace):
+    scale_factor = config.cpu_scale_factor
+    scenario = Scenario(trace, str(tmp_path / 'metrics.json'), config={'cpu_scale_factor': 2}, virtual_time=True)
+    assert scenario.hpa_file == str(tmp_path / 'metrics_hpa.csv')
+
+    assert run_scenario(scenario) == scenario.metrics_file
+    assert config.cpu_scale_factor == scale_factor
+
+    assert expected_replicas(scenario.metrics_file) == 2
+    assert (tmp_path / 'metrics_hpa.csv').exists()
+    assert 'deployment.created' in (tmp_path / 'metrics.log').read_text()
+
+def test_run_all_runs_scenarios_in_separate_processes(tmp_path, trace):
+    scenarios = [
+        Scenario(trace, str(tmp_path / f'metrics_{i}.json'), config={'cpu_scale_factor': i}, virtual_time=True)
+        for i in (1, 3)
+    ]
+    metric_files = run_all(scenarios, str(tmp_path / 'stats'), max_workers=2)
+
+    assert metric_files == [scenario.metrics_file for scenario in scenarios]
+    assert (tmp_path / 'stats' / 'reqs_summary').exists()
+    assert [expected_replicas(path) for path in metric_files] == [1, 3]
+
+def test_run_all_serves_repeated_runs_from_the_cache(tmp_path, trace, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    scenario = Scenario(trace, str(tmp_path / 'metrics.json'), config={'cpu_scale_factor': 2}, virtual_time=True)
+    run_all([scenario], str(tmp_path / 'stats'), max_workers=1, cache_dir=cache_dir)
+    first = (tmp_path / 'metrics.json').read_text()
+    reports = (tmp_path / 'stats' / 'reqs_summary').read_text()
+
+    # A rerun must not simulate or process anything
+    (tmp_path / 'metrics.json').unlink()
+    (tmp_path / 'stats' / 'reqs_summary').unlink()
+    monkeypatch.setattr(runAllSimulations, 'run_scenario', fail)
+    monkeypatch.setattr(runAllSimulations, 'process_many', fail)
+    assert runAllSimulations.run_cached(scenario, cache_dir) == scenario.metrics_file
+    assert (tmp_path / 'metrics.json').read_text() == first
+
+    cache = RunCache(cache_dir)
+    assert cache.fetch_reports(cache.reports_key([scenario.metrics_file]), str(tmp_path / 'stats'))
+    assert (tmp_path / 'stats' / 'reqs_summary').read_text() == reports
+
+def test_run_keys_change_with_the_trace_and_config(tmp_path, trace):
+    cache = RunCache(str(tmp_path / 'cache'))
+    scenario = Scenario(trace, str(tmp_path / 'metrics.json'), virtual_time=True)
+    key = cache.run_key(scenario)
+    assert cache.run_key(Scenario(trace, str(tmp_path / 'other.json'), virtual_time=True)) == key
+    assert cache.run_key(Scenario(trace, str(tmp_path / 'metrics.json'), config={'load_balancer': LeastOutstandingRequestsLoadBalancer}, virtual_time=True)) != key
+    assert cache.run_key(Scenario(trace, str(tmp_path / 'metrics.json'))) != key
+
+    with open(trace, 'a') as fp:
+        fp.write('Sleep 1\n')
+    assert cache.run_key(scenario) != key
+
+def fail(*args, **kwargs):
+    raise AssertionError('should have come from the cache')
+
+def test_cached_reports_name_the_metrics_files_they_were_made_from(tmp_path, trace):
+    cache_dir = str(tmp_path / 'cache')
+    for name in ('a', 'b'):
+        scenario = Scenario(trace, str(tmp_path / f'{name}_metrics.json'), virtual_time=True)
+        run_all([scenario], str(tmp_path / f'{name}_stats'), max_workers=1, cache_dir=cache_dir)
+
+        summary = (tmp_path / f'{name}_stats' / 'reqs_summary').read_text()
+        assert summary.splitlines()[0] == scenario.metrics_file
@@ -0,0 +1,48 @@
+import pytest
+
+import sweep
+
+TRACE = '''AddNode Node_1 4
+Deploy Dep_A 1 1
+CreateHPA Dep_A 50 4
+Sleep 2
+ReqIn 1 Dep_A 3
+ReqIn 2 Dep_A 3
+Sleep 20
+'''
+
+def test_grid_and_random_samples():
+    assert sweep.grid(kp=[1, 2], kd=[0]) == [{'kp': 1, 'kd': 0}, {'kp': 2, 'kd': 0}]
+
+    samples = sweep.random_samples(5, seed=1, kp=(0.5, 1.0), buffer=[5, 10])
+    assert samples == sweep.random_samples(5, seed=1, kp=(0.5, 1.0), buffer=[5, 10])
+    assert all([0.5 <= sample['kp'] <= 1.0 and sample['buffer'] in (5, 10) for sample in samples])
+
+def test_sweep_caches_finished_points(tmp_path):
+    trace = tmp_path / 'trace.txt'
+    trace.write_text(TRACE)
+    cache_path = str(tmp_path / 'cache.jsonl')
+    points = sweep.grid(kp=[0.5, 0.9], warmup=[0])
+
+    results = sweep.sweep([str(trace)], points, cache_path, max_workers=2)
+    assert sorted([result['params']['kp'] for result in results]) == [0.5, 0.9]
+    assert [result['score'] for result in results] == sorted([result['score'] for result in results])
+    scores = results[0]['runs'][str(trace)]
+    assert set(scores) == {'queue_latency', 'replica_distance', 'error_rate', 'score'}
+    assert len(open(cache_path).readlines()) == 2
+
+    # Only the new point gets run
+    results = sweep.sweep([str(trace)], points + sweep.grid(kp=[1.1], warmup=[0]), cache_path, max_workers=2)
+    assert len(results) == 3
+    assert len(open(cache_path).readlines()) == 3
+
+def test_unknown_parameters_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        sweep.sweep([], [{'gain': 1}], str(tmp_path / 'cache.jsonl'))
+
+def test_cache_keys_depend_on_the_clock_and_simulator_version(monkeypatch):
+    key = sweep.cache_key('digest', {'kp': 1})
+    assert sweep.cache_key('digest', {'kp': 1}, virtual_time=False) != key
+
+    monkeypatch.setattr(sweep, 'simulator_version', lambda: 'edited')
+    assert sweep.cache_key('digest', {'kp': 1}) != key
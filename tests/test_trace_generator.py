@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+from binary_trace import read_trace
+from TraceFileGenerator import ARRIVAL_PROCESSES, EXEC_SHAPES, generate_exec_trace, generate_trace, label, write_trace
+
+def test_same_seed_same_trace():
+    for arrival in ARRIVAL_PROCESSES:
+        assert list(generate_trace(duration=50, arrival=arrival, seed=4)) == list(generate_trace(duration=50, arrival=arrival, seed=4))
+    assert list(generate_trace(duration=50, seed=4)) != list(generate_trace(duration=50, seed=5))
+
+def test_trace_layout():
+    commands = list(generate_trace(nodes=2, deployments=2, duration=10, arrival='stable', rate=2))
+    assert [command[0] for command in commands[:6]] == ['AddNode', 'AddNode', 'Deploy', 'CreateHPA', 'Deploy', 'CreateHPA']
+    assert [command[0] for command in commands[-2:]] == ['DeleteDeployment', 'DeleteDeployment']
+    assert sum([command == ['Sleep', '1'] for command in commands]) == 10
+
+    request_ids = [command[1] for command in commands if command[0] == 'ReqIn']
+    assert len(request_ids) == len(set(request_ids))
+
+@pytest.mark.parametrize('arrival', list(ARRIVAL_PROCESSES))
+def test_arrivals_average_out_to_the_rate(arrival):
+    commands = generate_trace(deployments=1, duration=3000, arrival=arrival, rate=2, period=50, seed=1)
+    requests = sum([command[0] == 'ReqIn' for command in commands])
+    # Each deployment's rate is drawn from [0.5, 1.5] * rate
+    assert 1 * 3000 * 0.8 <= requests <= 3 * 3000 * 1.2
+
+def test_generator_streams():
+    commands = generate_trace(nodes=1000, deployments=500, duration=10 ** 9, rate=100)
+    assert len(list(itertools.islice(commands, 5000))) == 5000
+
+def test_labels_stay_unique():
+    assert label(0, 3) == 'AA'
+    assert label(27, 3) == 'BB'
+    labels = [label(i, 1000) for i in range(1000)]
+    assert len(set(labels)) == 1000
+    assert labels[0] == 'AAA'
+
+def test_written_trace_reads_back(tmp_path):
+    path = str(tmp_path / 'trace.txt')
+    commands = list(generate_trace(duration=20, arrival='poisson', crash_rate=0.5))
+    assert write_trace(iter(commands), path) == len(commands)
+    assert list(read_trace(path)) == commands
+
+def test_unknown_arrival_process():
+    with pytest.raises(ValueError):
+        list(generate_trace(arrival='weekly'))
+
+def test_exec_shapes_send_one_request_per_deployment_per_step():
+    for shape in EXEC_SHAPES:
+        commands = list(generate_exec_trace(shape, 1234567))
+        assert commands == list(generate_exec_trace(shape, 1234567))
+        assert commands[0][0] == 'AddNode'
+        assert [command[0] for command in commands[-3:]] == ['DeleteDeployment'] * 3
+
+        steps = {}
+        for command in commands:
+            if command[0] == 'ReqIn':
+                steps.setdefault(command[1], []).append(command[2])
+        assert all([deployments == ['Deployment_AA', 'Deployment_AB', 'Deployment_AC'] for deployments in steps.values()])
+
+def test_exec_ramp_climbs_from_zero():
+    commands = generate_exec_trace('exec-ramp', 1234567)
+    exec_times = [int(command[3]) for command in commands if command[0] == 'ReqIn' and command[2] == 'Deployment_AA']
+    assert exec_times[:5] == [0, 1, 2, 3, 4]
+    assert max(exec_times) <= 15
+
+def test_unknown_exec_shape():
+    with pytest.raises(ValueError):
+        list(generate_exec_trace('exec-square', 1))
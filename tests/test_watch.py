@@ -0,0 +1,94 @@
+import threading
+
+import pytest
+
+from api_server import APIServer
+from clock import VirtualClock
+from node_controller import NodeController
+from scheduler import Scheduler
+from watch import Informer, Watch, WatchEvent
+
+def test_watch_sees_changes_in_resource_version_order():
+    api = APIServer(VirtualClock())
+    pods = api.Watch(['Pod'])
+    everything = api.Watch()
+
+    dep = api.CreateDeployment(['Dep_A', 1, 1])
+    node = api.CreateWorker(['Node_1', 4])
+    api.CreatePod(dep)
+    pod = api.GetPending()[0]
+    api.CreateEndPoint(pod, node)
+
+    events, expired = pods.drain()
+    assert not expired
+    assert [(event.type, event.previous) for event in events] == [('ADDED', None), ('MODIFIED', 'PENDING')]
+    assert all([event.obj is pod for event in events])
+
+    events, _ = everything.drain()
+    assert [(event.type, event.kind) for event in events] == [
+        ('ADDED', 'Deployment'),
+        ('ADDED', 'WorkerNode'),
+        ('ADDED', 'Pod'),
+        ('MODIFIED', 'Deployment'), # currentReplicas
+        ('ADDED', 'EndPoint'),
+        ('MODIFIED', 'Pod'),
+    ]
+    versions = [event.resource_version for event in events]
+    assert versions == sorted(versions)
+    assert everything.resource_version == api.etcd.resourceVersion == versions[-1]
+    assert everything.drain() == ([], False)
+
+def test_watch_expires_when_it_falls_behind():
+    watch = Watch(max_pending=2)
+    for version in range(1, 4):
+        watch.push(WatchEvent('ADDED', 'Pod', None, version))
+
+    assert watch.drain() == ([], True)
+    assert watch.drain() == ([], False)
+
+def test_closing_a_watch_wakes_its_owner():
+    watch = Watch()
+    thread = threading.Thread(target=watch.wait)
+    thread.start()
+    watch.close()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+
+def test_informer_resyncs_periodically():
+    clock = VirtualClock()
+    api = APIServer(clock)
+    informer = Informer(api, ['Pod'], resync_period=10)
+    assert informer.poll() == ([], True)
+    assert informer.poll() == ([], False)
+    assert informer.until_resync() == 10
+
+    clock.call_later(10, lambda: None)
+    clock.run()
+    assert informer.poll() == ([], True)
+
+def test_controllers_only_act_on_changes():
+    clock = VirtualClock()
+    api = APIServer(clock)
+    dep = api.CreateDeployment(['Dep_A', 1, 1])
+    node = api.CreateWorker(['Node_1', 4])
+    scheduler = Scheduler(api, 2)
+    node_controller = NodeController(api, 2)
+    scheduler.work()
+    node_controller.work()
+
+    api.CreatePod(dep)
+    scheduler.work()
+    pod = api.GetPodsByStatus('RUNNING')[0]
+
+    # The crash is picked up straight away, no need to wait for the next resync
+    api.CrashPod('Dep_A')
+    assert node_controller.work() == 2
+    assert pod.status == 'PENDING'
+    scheduler.work()
+    assert pod.status == 'RUNNING'
+
+    # Nothing changed, so nothing to do until the next resync
+    api.etcd.set_pod_status(pod, 'PENDING')
+    scheduler.informer.watch.drain()
+    scheduler.work()
+    assert pod.status == 'PENDING'
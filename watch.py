@@ -0,0 +1,113 @@
+from collections import deque
+import threading
+from typing import List, Tuple
+
+# Watches let controllers react to changes in etcd instead of rescanning it on a timer.
+# Every mutation in etcd gets the next resource version and is published as a WatchEvent to each
+# open Watch, which queues it until its owner drains it. A Watch only queues the kinds of objects
+# it asked for, and holds at most max_pending events: past that it drops them and is marked
+# expired, and its owner has to fall back to listing everything again (like a 410 Gone in k8s).
+#
+# Event types are ADDED, MODIFIED and DELETED. Kinds are the class names of the objects involved:
+# Deployment (added, replicas changed, deleted), WorkerNode (added), EndPoint (added, removed)
+# and Pod (created, status changed, removed). previous is the old status of a MODIFIED Pod.
+
+class WatchEvent:
+    __slots__ = ('type', 'kind', 'obj', 'resource_version', 'previous')
+
+    def __init__(self, type: str, kind: str, obj, resource_version: int, previous = None):
+        self.type = type
+        self.kind = kind
+        self.obj = obj
+        self.resource_version = resource_version
+        self.previous = previous
+
+    def __repr__(self):
+        return f'<WatchEvent {self.type} {self.obj} rv={self.resource_version}>'
+
+
+class Watch:
+    def __init__(self, kinds = None, max_pending: int = 10000):
+        self.kinds = frozenset(kinds) if kinds else None
+        self.max_pending = max_pending
+        # Resource version of the last event queued
+        self.resource_version = 0
+        self.expired = False
+        self.closed = False
+        # Called (without the watch's lock held) after an event is queued, for owners which
+        # can't block in wait(), e.g. controllers running on a VirtualClock
+        self.on_event = None
+
+        self._events = deque()
+        self._changed = threading.Condition()
+
+    def __repr__(self):
+        return f'<Watch {sorted(self.kinds) if self.kinds else "*"} pending={len(self._events)}>'
+
+    def wants(self, event: WatchEvent) -> bool:
+        return self.kinds is None or event.kind in self.kinds
+
+    def push(self, event: WatchEvent):
+        with self._changed:
+            if self.closed:
+                return
+            if len(self._events) >= self.max_pending:
+                self._events.clear()
+                self.expired = True
+            else:
+                self._events.append(event)
+            self.resource_version = event.resource_version
+            self._changed.notify_all()
+
+        if self.on_event is not None:
+            self.on_event(event)
+
+    def drain(self) -> Tuple[List[WatchEvent], bool]:
+        ''' Takes every event queued so far, oldest first, and whether any were dropped since the last drain. '''
+        with self._changed:
+            events = list(self._events)
+            expired = self.expired
+            self._events.clear()
+            self.expired = False
+            return events, expired
+
+    def wait(self, timeout: float = None) -> bool:
+        ''' Blocks until an event is queued, the watch is closed or timeout passes. Returns whether there is anything to drain. '''
+        with self._changed:
+            return self._changed.wait_for(lambda: self._events or self.expired or self.closed, timeout)
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self._events.clear()
+            self._changed.notify_all()
+
+
+class Informer:
+    ''' What a controller sees of etcd: the changes since it last looked, plus a resync (look at
+    everything again) every resync_period seconds and whenever its watch expired. '''
+
+    def __init__(self, apiServer, kinds, resync_period: float):
+        self.clock = apiServer.clock
+        self.watch = apiServer.Watch(kinds)
+        self.resync_period = resync_period
+        # The first poll is always a resync
+        self.next_resync = self.clock.now()
+
+    def poll(self) -> Tuple[List[WatchEvent], bool]:
+        ''' Returns the events since the last poll and whether the controller should resync. '''
+        events, expired = self.watch.drain()
+        now = self.clock.now()
+        if expired or now >= self.next_resync:
+            self.next_resync = now + self.resync_period
+            return events, True
+        return events, False
+
+    def until_resync(self) -> float:
+        return max(0, self.next_resync - self.clock.now())
+
+    def wait(self, timeout: float):
+        self.watch.wait(timeout)
+
+    def close(self):
+        self.watch.close()
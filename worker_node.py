@@ -1,3 +1,5 @@
+import threading
+
 import config
 
 # The WorkerNode is the object to which pods can be scheduled
@@ -5,6 +7,7 @@ import config
 # assigned_cpu is the amount of cpu assigned to the node
 # available_cpu is the amount of assigned_cpu not currently in use
 # status communicates the Node's availability. ['UP', 'CRASHED', 'TERMINATING', 'TERMINATED']
+# lock guards available_cpu
 
 class WorkerNode:
     def __init__(self, INFOLIST):
@@ -12,6 +15,7 @@ class WorkerNode:
         self.assigned_cpu = int(INFOLIST[1]) * config.cpu_scale_factor
         self.available_cpu = self.assigned_cpu * config.cpu_scale_factor
         self.status = 'UP'
+        self.lock = threading.Lock()
 
     def __repr__(self):
         return f'<WorkerNode {self.label}>'